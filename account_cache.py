@@ -0,0 +1,63 @@
+# account_cache.py
+# کش حساب‌های هر کاربر برای منوهای بات تلگرام.
+# - با تغییر وضعیت/حذف/افزودن از داخل بات صریحاً باطل می‌شود.
+# - تغییرات بیرون از بات (ادمین، ابزارهای دیگر) با مُهر نسخه (تعداد + آخرین updated_at)
+#   شناسایی می‌شوند؛ این مُهر حداکثر هر VERSION_TTL ثانیه یکبار بررسی می‌شود.
+
+import time
+
+import config
+import db_manager
+
+# کلید API عمداً در کش نگه داشته نمی‌شود
+SUMMARY_COLUMNS = """account_id, user_telegram_id, account_name, mobile_number, email,
+                     max_trade_tmn, max_trade_usdt, trade_amount_tmn, trade_amount_usdt,
+                     allowed_strategies, allowed_grades, is_active"""
+
+
+class AccountCache:
+
+    def __init__(self, version_ttl=None):
+        self.version_ttl = version_ttl if version_ttl is not None else config.TELEGRAM.get("ACCOUNT_CACHE_TTL", 5)
+        self._entries = {}   # uid -> {"accounts": [...], "version": (...), "checked": ts}
+
+    def _version(self, uid):
+        res = db_manager.execute_query(
+            "SELECT COUNT(*) AS cnt, MAX(updated_at) AS last_update FROM trading_accounts "
+            "WHERE user_telegram_id=%s AND deleted_at IS NULL",
+            (uid,), fetch='one'
+        )
+        return (res['cnt'], res['last_update']) if res else None
+
+    def _load(self, uid):
+        version = self._version(uid)
+        accounts = db_manager.execute_query(
+            f"SELECT {SUMMARY_COLUMNS} FROM trading_accounts "
+            f"WHERE user_telegram_id=%s AND deleted_at IS NULL ORDER BY account_id",
+            (uid,), fetch='all'
+        )
+        if accounts is None:
+            # خطای دیتابیس: چیزی کش نمی‌شود تا دفعه بعد دوباره تلاش شود
+            return []
+        self._entries[uid] = {"accounts": accounts, "version": version, "checked": time.monotonic()}
+        return accounts
+
+    def get_accounts(self, uid):
+        entry = self._entries.get(uid)
+        if not entry:
+            return self._load(uid)
+        now = time.monotonic()
+        if now - entry["checked"] >= self.version_ttl:
+            if self._version(uid) != entry["version"]:
+                return self._load(uid)
+            entry["checked"] = now
+        return entry["accounts"]
+
+    def get_account(self, uid, account_id):
+        for acc in self.get_accounts(uid):
+            if str(acc['account_id']) == str(account_id):
+                return acc
+        return None
+
+    def invalidate(self, uid):
+        self._entries.pop(uid, None)
@@ -0,0 +1,141 @@
+# analytics.py
+# موتور تحلیل پورتفو: بارگذاری تریدها در یک مرحله به صورت ستونی و محاسبات برداری
+# (سود/زیان، وین‌ریت، میانگین زمان نگهداری، حداکثر افت سرمایه و اکسپوژر در طول زمان)
+
+import numpy as np
+import pandas as pd
+
+import archiver
+import db_manager
+
+# ستون‌هایی از trade_ops/trade_ops_history که گزارش‌ها لازم دارند
+TRADE_COLUMNS = ('id', 'account_id', 'strategy_name', 'asset_name', 'pair', 'status',
+                 'invested_amount', 'sell_revenue', 'buy_quantity_executed', 'created_at', 'updated_at')
+
+CLOSED_STATUSES = ('COMPLETED', 'SELL_ORDER_FILLED')
+OPEN_STATUSES = ('BUY_FILLED', 'SELL_IN_PROGRESS', 'SELL_ORDER_PLACED')
+
+
+def load_trades(user_id, account_id="all"):
+    """
+    تمام تریدهای باز و بسته کاربر را با یک کوئری و به صورت ستونی می‌خواند.
+    closed_at برای تریدهای باز NaT است.
+    """
+    source, params = archiver.trades_source(TRADE_COLUMNS, user_id, account_id, CLOSED_STATUSES + OPEN_STATUSES)
+    query = f"""
+        SELECT ts.account_id, ta.account_name, ts.strategy_name, ts.asset_name, ts.pair, ts.status,
+               ts.invested_amount, ts.sell_revenue, ts.buy_quantity_executed,
+               ts.created_at, ts.updated_at
+        FROM {source} ts JOIN trading_accounts ta ON ts.account_id = ta.account_id
+    """
+    columns, rows = db_manager.fetch_columns(query, params)
+    return build_frame(columns, rows)
+
+
+def build_frame(columns, rows):
+    """تبدیل ردیف‌های خام به DataFrame با ستون‌های عددی/زمانی آماده محاسبه"""
+    if not columns or not rows:
+        return pd.DataFrame()
+
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    df['strategy_name'] = df['strategy_name'].fillna('Unknown')
+    df['invested'] = pd.to_numeric(df['invested_amount'], errors='coerce').fillna(0.0).astype(float)
+    df['revenue'] = pd.to_numeric(df['sell_revenue'], errors='coerce').fillna(0.0).astype(float)
+    df['qty'] = pd.to_numeric(df['buy_quantity_executed'], errors='coerce').fillna(0.0).astype(float)
+    df['opened_at'] = pd.to_datetime(df['created_at'])
+
+    df['is_closed'] = df['status'].isin(CLOSED_STATUSES).to_numpy()
+    df['closed_at'] = pd.to_datetime(df['updated_at']).where(df['is_closed'])
+    df['pnl'] = np.where(df['is_closed'], df['revenue'].to_numpy() - df['invested'].to_numpy(), 0.0)
+    df['hold_minutes'] = (df['closed_at'] - df['opened_at']).dt.total_seconds() / 60.0
+    return df.drop(columns=['invested_amount', 'sell_revenue', 'buy_quantity_executed',
+                            'created_at', 'updated_at'])
+
+
+def _group_stats(closed, keys):
+    if closed.empty:
+        return pd.DataFrame()
+    g = closed.assign(win=(closed['pnl'].to_numpy() > 0)).groupby(keys, sort=True)
+    out = g.agg(
+        trades=('pnl', 'size'),
+        invested=('invested', 'sum'),
+        revenue=('revenue', 'sum'),
+        pnl=('pnl', 'sum'),
+        win_rate=('win', 'mean'),
+        avg_hold_minutes=('hold_minutes', 'mean'),
+    )
+    out['win_rate'] = out['win_rate'] * 100.0
+    return out.reset_index()
+
+
+def max_drawdown(closed, keys):
+    """حداکثر افت از قله سود تجمعی (به ترتیب زمان بسته شدن) برای هر گروه"""
+    if closed.empty:
+        return pd.DataFrame(columns=keys + ['max_drawdown'])
+    c = closed.sort_values('closed_at', kind='mergesort')
+    cum = c.groupby(keys, sort=False)['pnl'].cumsum()
+    # قله از صفر شروع می‌شود تا ضرر از همان ابتدا هم افت محسوب شود
+    peak = np.maximum(cum.groupby([c[k] for k in keys], sort=False).cummax().to_numpy(), 0.0)
+    dd = pd.Series(peak - cum.to_numpy(), index=c.index)
+    return dd.groupby([c[k] for k in keys]).max().rename('max_drawdown').reset_index()
+
+
+def exposure_over_time(df):
+    """
+    سرمایه درگیر در طول زمان (به تفکیک پیر): +invested در زمان باز شدن،
+    -invested در زمان بسته شدن، سپس جمع تجمعی.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=['time', 'pair', 'exposure'])
+    closed = df[df['is_closed']]
+    times = np.concatenate([df['opened_at'].to_numpy(), closed['closed_at'].to_numpy()])
+    pairs = np.concatenate([df['pair'].to_numpy(), closed['pair'].to_numpy()])
+    deltas = np.concatenate([df['invested'].to_numpy(), -closed['invested'].to_numpy()])
+
+    ev = pd.DataFrame({'time': times, 'pair': pairs, 'delta': deltas}).dropna(subset=['time'])
+    ev = ev.sort_values('time', kind='mergesort')
+    ev['exposure'] = ev.groupby('pair', sort=False)['delta'].cumsum()
+    return ev.drop(columns='delta').reset_index(drop=True)
+
+
+def compute_summary(df):
+    """
+    خروجی: dict شامل by_account، by_strategy و exposure.
+    سود تومانی و تتری هرگز با هم جمع نمی‌شوند (pair همیشه جزو کلید گروه است).
+    """
+    if df.empty:
+        return {'by_account': pd.DataFrame(), 'by_strategy': pd.DataFrame(), 'exposure': pd.DataFrame()}
+
+    closed = df[df['is_closed']]
+    acc_keys = ['account_id', 'account_name', 'pair']
+    strat_keys = ['strategy_name', 'pair']
+
+    by_account = _group_stats(closed, acc_keys)
+    by_strategy = _group_stats(closed, strat_keys)
+    if not by_account.empty:
+        by_account = by_account.merge(max_drawdown(closed, acc_keys), on=acc_keys, how='left')
+        by_strategy = by_strategy.merge(max_drawdown(closed, strat_keys), on=strat_keys, how='left')
+
+    return {
+        'by_account': by_account,
+        'by_strategy': by_strategy,
+        'exposure': exposure_over_time(df),
+    }
+
+
+def format_summary_text(summary):
+    """متن خلاصه برای نمایش در تلگرام"""
+    acc = summary.get('by_account')
+    if acc is None or acc.empty:
+        return None
+    lines = ["📈 **خلاصه عملکرد**"]
+    for r in acc.itertuples(index=False):
+        icon = "🟢" if r.pnl >= 0 else "🔴"
+        lines.append(
+            f"──────────────\n"
+            f"👤 `{r.account_name}` ({r.pair})\n"
+            f"{icon} سود/زیان: `{r.pnl:,.0f}` | معاملات: `{r.trades}`\n"
+            f"🎯 وین‌ریت: `{r.win_rate:.1f}%` | ⏱ میانگین نگهداری: `{r.avg_hold_minutes:.0f}` دقیقه\n"
+            f"📉 حداکثر افت: `{r.max_drawdown:,.0f}`"
+        )
+    return "\n".join(lines)
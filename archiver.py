@@ -0,0 +1,151 @@
+# archiver.py
+# نگهداری جدول داغ trade_ops کوچک:
+# 1. انتقال تریدهای پایان‌یافته قدیمی به trade_ops_history (پارتیشن ماهانه) در تکه‌های محدود
+# 2. حذف پس‌زمینه و تکه‌تکه حساب‌هایی که از بات حذف شده‌اند (deleted_at)
+# 3. ساخت پارتیشن ماه‌های آینده
+
+import logging
+
+import config
+import clock
+import db_manager
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TABLE = db_manager.HISTORY_TABLE
+TERMINAL_STATUSES = db_manager.TERMINAL_STATUSES
+
+
+def trades_source(columns, user_id, account_id="all", statuses=()):
+    """
+    زیرکوئری برای گزارش‌ها: تریدهای جدول داغ + تاریخچه با ستون‌های مشخص.
+    فیلتر کاربر/حساب/وضعیت داخل هر شاخه UNION اعمال می‌شود تا MySQL (بدون pushdown شرط به
+    derived table) کل دو جدول را materialize نکند؛ حساب‌های حذف شده (deleted_at) کنار می‌روند.
+    خروجی: ("(... UNION ALL ...)", params) که باید با یک alias استفاده شود.
+    """
+    cols = ", ".join(columns)
+    where = ("account_id IN (SELECT account_id FROM trading_accounts "
+             "WHERE user_telegram_id = %s AND deleted_at IS NULL")
+    params = [user_id]
+    if account_id != "all":
+        where += " AND account_id = %s"
+        params.append(account_id)
+    where += ")"
+    if statuses:
+        where += f" AND status IN ({db_manager.placeholders(len(statuses))})"
+        params.extend(statuses)
+    sql = (f"(SELECT {cols} FROM trade_ops WHERE {where} "
+           f"UNION ALL SELECT {cols} FROM {HISTORY_TABLE} WHERE {where})")
+    return sql, tuple(params) * 2
+
+
+def archive_chunk(columns, older_than_days, chunk_size):
+    """انتقال یک تکه؛ خروجی: تعداد ردیف منتقل شده (0 یعنی کاری نمانده، None یعنی خطا)"""
+    ids = db_manager.execute_query(
+        f"""SELECT id FROM trade_ops
+            WHERE status IN ({db_manager.placeholders(len(TERMINAL_STATUSES))})
+            AND COALESCE(updated_at, created_at) < (NOW() - INTERVAL %s DAY)
+            ORDER BY id LIMIT %s""",
+        TERMINAL_STATUSES + (older_than_days, chunk_size), fetch='all'
+    )
+    if ids is None: return None
+    if not ids: return 0
+
+    id_list = tuple(r['id'] for r in ids)
+    cols = ", ".join(columns)
+    in_ids = db_manager.placeholders(len(id_list))
+    res = db_manager.execute_transaction([
+        (f"INSERT INTO {HISTORY_TABLE} ({cols}) SELECT {cols} FROM trade_ops WHERE id IN ({in_ids})", id_list),
+        (f"DELETE FROM trade_ops WHERE id IN ({in_ids})", id_list),
+    ])
+    return res[1] if res else None
+
+
+def archive_terminal_trades():
+    cfg = config.ARCHIVE
+    columns = db_manager.table_columns("trade_ops")
+    if not columns: return 0
+
+    moved = 0
+    for _ in range(cfg.get("MAX_CHUNKS_PER_RUN", 20)):
+        n = archive_chunk(columns, cfg.get("AFTER_DAYS", 7), cfg.get("CHUNK_SIZE", 500))
+        if not n: break
+        moved += n
+        clock.sleep(cfg.get("CHUNK_PAUSE", 0.2))
+    if moved:
+        logger.info("🗄 Archived %d terminal trades to %s", moved, HISTORY_TABLE)
+    return moved
+
+
+def purge_deleted_accounts():
+    """حذف تکه‌تکه تریدهای حساب‌های حذف شده و در آخر خود حساب"""
+    cfg = config.ARCHIVE
+    chunk = cfg.get("CHUNK_SIZE", 500)
+    budget = cfg.get("MAX_CHUNKS_PER_RUN", 20)
+    accounts = db_manager.execute_query(
+        "SELECT account_id FROM trading_accounts WHERE deleted_at IS NOT NULL", fetch='all'
+    ) or []
+
+    for acc in accounts:
+        aid = acc['account_id']
+        for table in ("trade_ops", HISTORY_TABLE):
+            while True:
+                # بقیه کار به دور بعد موکول می‌شود تا هر دور کوتاه بماند
+                if budget <= 0: return False
+                n = db_manager.execute_query(
+                    f"DELETE FROM {table} WHERE account_id=%s ORDER BY id LIMIT %s", (aid, chunk)
+                )
+                budget -= 1
+                if not n: break
+                clock.sleep(cfg.get("CHUNK_PAUSE", 0.2))
+
+        db_manager.execute_query("DELETE FROM trading_accounts WHERE account_id=%s AND deleted_at IS NOT NULL", (aid,))
+        logger.info("🗑 Account %s purged.", aid)
+    return True
+
+
+def ensure_partitions():
+    """پارتیشن ماه جاری و MONTHS_AHEAD ماه بعد را از pmax جدا می‌کند"""
+    rows = db_manager.execute_query(
+        """SELECT PARTITION_NAME AS name FROM information_schema.PARTITIONS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL""",
+        (HISTORY_TABLE,), fetch='all'
+    ) or []
+    existing = {r['name'] for r in rows}
+    if 'pmax' not in existing: return
+
+    now = clock.now()
+    y, m = now.year, now.month
+    new_parts = []
+    for _ in range(config.ARCHIVE.get("MONTHS_AHEAD", 2) + 1):
+        if f"p{y:04d}{m:02d}" not in existing:
+            new_parts.append(db_manager.month_partition(y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+    if new_parts:
+        new_parts.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        db_manager.execute_query(
+            f"ALTER TABLE {HISTORY_TABLE} REORGANIZE PARTITION pmax INTO ({', '.join(new_parts)})"
+        )
+        logger.info("🛠 Added %d monthly partitions to %s", len(new_parts) - 1, HISTORY_TABLE)
+
+
+def run_once():
+    ensure_partitions()
+    purge_deleted_accounts()
+    archive_terminal_trades()
+
+
+def run_archiver():
+    logger.info("🗄 Archiver Started...")
+    while True:
+        try:
+            run_once()
+        except Exception as e:
+            logger.error("Archiver Error: %s", e)
+        clock.sleep(config.ARCHIVE.get("INTERVAL_SECONDS", 60))
+
+
+if __name__ == "__main__":
+    db_manager.ensure_schema()
+    run_archiver()
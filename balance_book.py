@@ -0,0 +1,40 @@
+# balance_book.py
+# نمای موجودی حساب‌ها برای یک سیکل خرید: موجودی هر کلید API فقط یکبار در سیکل
+# خوانده می‌شود و با هر سفارش خرید، مبلغ آن به صورت محلی رزرو می‌شود.
+# سیگنال‌هایی که موجودی کافی ندارند قبل از هر درخواست سفارش کنار گذاشته می‌شوند.
+
+
+class BalanceBook:
+
+    def __init__(self, fetch, margin_pct=0.0):
+        self.fetch = fetch              # api_key -> {asset: available} یا None در صورت خطا
+        self.margin = 1.0 + margin_pct / 100.0
+        self._available = {}            # api_key -> {asset: available} یا None
+
+    def load(self, api_keys, pool=None):
+        """خواندن موجودی کلیدهایی که هنوز در این سیکل خوانده نشده‌اند (موازی اگر pool داده شود)"""
+        keys = [k for k in set(api_keys) if k not in self._available]
+        if not keys: return
+        results = pool.map(self.fetch, keys) if pool and len(keys) > 1 else map(self.fetch, keys)
+        for key, balances in zip(keys, results):
+            self._available[key] = balances
+
+    def available(self, api_key, asset):
+        balances = self._available.get(api_key)
+        if balances is None: return None
+        return balances.get(asset, 0.0)
+
+    def reserve(self, api_key, asset, amount):
+        """
+        رزرو مبلغ از موجودی محلی. اگر موجودی نامعلوم باشد (خطای API) سفارش مسدود نمی‌شود
+        و بررسی به خود صرافی سپرده می‌شود.
+        """
+        if api_key not in self._available:
+            self.load([api_key])
+        balances = self._available.get(api_key)
+        if balances is None: return True
+        need = float(amount) * self.margin
+        have = balances.get(asset, 0.0)
+        if have < need: return False
+        balances[asset] = have - need
+        return True
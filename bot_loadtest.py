@@ -0,0 +1,355 @@
+# bot_loadtest.py
+# تست بار هندلرهای بات تلگرام با ترافیک مصنوعی هزاران کاربر همزمان.
+# آپدیت‌ها مستقیماً به Application داده می‌شوند (همان مسیر webhook/polling با محدودیت
+# CONCURRENT_UPDATES) و فراخوانی‌های Bot API به fake_bot_api محلی می‌روند.
+#
+# استفاده:
+#   python bot_loadtest.py [--users 2000] [--duration 60] [--think 2] [--api-latency 0.05] [--excel]
+#
+# دیتابیس LOADTEST["INTERNAL_DB"] باید همان شِمای دیتابیس اصلی (شامل جدول users) را داشته باشد.
+# هرگز روی دیتابیس اصلی اجرا نشود: حساب‌های مصنوعی ساخته و در پایان پاک می‌شوند.
+#
+# خروجی: p50/p99 زمان پاسخ هر نوع اقدام، تأخیر حلقه رویداد (نشانه کار مسدودکننده در هندلرها)
+# و تعداد فراخوانی‌های دیتابیس/Bot API به ازای هر آپدیت.
+
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import time
+
+from telegram import Update
+
+import config
+from fake_bot_api import BOT_USER, FakeBotAPI
+
+logger = logging.getLogger(__name__)
+
+USER_ID_BASE = 7_000_000_000     # شناسه کاربران مصنوعی (بیرون از بازه شناسه‌های واقعی)
+
+
+def _percentile(values, p):
+    if not values: return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * p))]
+
+
+# ==============================================================================
+# DB Call Counter
+# ==============================================================================
+class DBCounter:
+    """شمارش و زمان‌سنجی فراخوانی‌های db_manager (توابعی که هندلرها و کش حساب استفاده می‌کنند)"""
+
+    FUNCTIONS = ("execute_query", "fetch_columns", "iter_chunks", "execute_transaction")
+
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+        self.originals = {}     # توابع اصلی برای کوئری‌های خود ابزار (خارج از شمارش)
+
+    def install(self, db_manager):
+        for name in self.FUNCTIONS:
+            self.originals[name] = getattr(db_manager, name)
+            setattr(db_manager, name, self._wrap(name, self.originals[name]))
+
+    def _wrap(self, name, fn):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.calls[name] = self.calls.get(name, 0) + 1
+                self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - started
+        return wrapper
+
+    def total(self):
+        return sum(self.calls.values())
+
+
+# ==============================================================================
+# Synthetic Updates
+# ==============================================================================
+class SimUser:
+    """یک کاربر مصنوعی: آپدیت‌هایش به ترتیب ارسال می‌شوند (وضعیت گفتگو به ترتیب وابسته است)"""
+
+    _update_ids = itertools.count(1)
+    _message_ids = itertools.count(1)
+
+    def __init__(self, index):
+        self.id = USER_ID_BASE + index
+        self.user = {"id": self.id, "is_bot": False, "first_name": f"LT{index}", "username": f"lt_user_{index}"}
+        self.chat = {"id": self.id, "type": "private"}
+        self.account_ids = []   # حساب‌هایی که همین کاربر ساخته (به کش حساب بات دست زده نمی‌شود)
+
+    def _base(self):
+        return {"update_id": next(self._update_ids)}
+
+    def command(self, name):
+        text = f"/{name}"
+        update = self._base()
+        update["message"] = {
+            "message_id": next(self._message_ids), "date": int(time.time()),
+            "chat": self.chat, "from": self.user, "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        }
+        return update
+
+    def text(self, value):
+        update = self._base()
+        update["message"] = {
+            "message_id": next(self._message_ids), "date": int(time.time()),
+            "chat": self.chat, "from": self.user, "text": value,
+        }
+        return update
+
+    def callback(self, data):
+        update = self._base()
+        update["callback_query"] = {
+            "id": str(update["update_id"]), "from": self.user, "chat_instance": str(self.id), "data": data,
+            "message": {"message_id": next(self._message_ids), "date": int(time.time()),
+                        "chat": self.chat, "from": BOT_USER, "text": "menu"},
+        }
+        return update
+
+
+def scenario_add_account(u, telegram_bot):
+    yield "add_acc", u.callback("add_acc")
+    for label, value in (("name", f"loadtest-{u.id}"), ("mobile", "09120000000"),
+                         ("email", f"{u.id}@loadtest.local"), ("api_key", f"loadtest-key-{u.id}"),
+                         ("max_tmn", "10000000"), ("max_usdt", "500"),
+                         ("budget_tmn", "1000000"), ("budget_usdt", "20")):
+        yield f"add:{label}", u.text(value)
+    for strat in random.sample(telegram_bot.ALL_STRATEGIES, 2):
+        yield "add:ts", u.callback(f"ts_{strat}")
+    yield "add:ds", u.callback("ds")
+    for grade in random.sample(telegram_bot.ALL_GRADES, 2):
+        yield "add:tg", u.callback(f"tg_{grade}")
+    yield "add:dg", u.callback("dg")
+
+
+def scenario_browse(u, telegram_bot):
+    yield "manage", u.callback("manage")
+    if u.account_ids:
+        aid = random.choice(u.account_ids)
+        yield "det", u.callback(f"det_{aid}")
+        if random.random() < 0.3:
+            yield "tog", u.callback(f"tog_{aid}")
+        yield "manage", u.callback("manage")
+    yield "main_menu", u.callback("main_menu")
+
+
+def scenario_summary(u, telegram_bot):
+    yield "report", u.callback("report")
+    yield "sum", u.callback("sum_all")
+
+
+def scenario_excel(u, telegram_bot):
+    yield "report", u.callback("report")
+    yield "gre", u.callback("gre_all")
+
+
+def scenario_start(u, telegram_bot):
+    yield "start", u.command("start")
+
+
+# (سناریو، وزن): بیشتر کلیک‌ها ناوبری منو هستند
+SCENARIOS = [
+    (scenario_browse, 60),
+    (scenario_start, 15),
+    (scenario_summary, 15),
+    (scenario_add_account, 10),
+]
+
+
+# ==============================================================================
+# Load Test Driver
+# ==============================================================================
+class LoadTest:
+
+    def __init__(self, app, telegram_bot, users, duration, think, excel=False, counter=None):
+        self.app = app
+        self.counter = counter
+        self.telegram_bot = telegram_bot
+        self.users = users
+        self.duration = duration
+        self.think = think
+        self.scenarios = SCENARIOS + ([(scenario_excel, 2)] if excel else [])
+        self.latencies = {}      # نوع اقدام -> [ثانیه]
+        self.errors = 0
+        self.loop_lag = []
+        self._stop = False
+
+    async def _send(self, label, data):
+        update = Update.de_json(data, self.app.bot)
+        started = time.perf_counter()
+        try:
+            # همان مسیر صف آپدیت‌ها: محدودیت CONCURRENT_UPDATES اعمال می‌شود
+            await self.app.update_processor.process_update(update, self.app.process_update(update))
+        except Exception as e:
+            self.errors += 1
+            logger.debug("Update %s failed: %s", label, e)
+        self.latencies.setdefault(label, []).append(time.perf_counter() - started)
+
+    async def _user(self, index, deadline):
+        u = SimUser(index)
+        # ورود کاربران در طول اولین دوره فکر پخش می‌شود تا همه با هم شروع نکنند
+        await asyncio.sleep(random.uniform(0, self.think))
+        for label, data in scenario_start(u, self.telegram_bot):
+            await self._send(label, data)
+
+        funcs, weights = zip(*self.scenarios)
+        while time.monotonic() < deadline:
+            scenario = random.choices(funcs, weights)[0]
+            for label, data in scenario(u, self.telegram_bot):
+                await asyncio.sleep(random.expovariate(1.0 / self.think))
+                if time.monotonic() >= deadline: return
+                await self._send(label, data)
+                if label == "add:dg":
+                    u.account_ids = await self._account_ids(u.id)
+
+    async def _account_ids(self, uid):
+        """
+        حساب‌های کاربر مصنوعی برای سناریوهای بعدی: در ترد جدا و با تابع اصلی db_manager، تا نه
+        تأخیر حلقه و شمارش دیتابیس هندلرها را آلوده کند و نه کش حساب بات را از قبل گرم کند.
+        """
+        execute_query = self.counter.originals["execute_query"] if self.counter else None
+        if execute_query is None: return []
+        rows = await asyncio.to_thread(
+            execute_query,
+            "SELECT account_id FROM trading_accounts WHERE user_telegram_id=%s AND deleted_at IS NULL",
+            (uid,), fetch='all'
+        )
+        return [r['account_id'] for r in rows or []]
+
+    async def _monitor_loop(self, interval=0.01):
+        """تأخیر حلقه رویداد: هر چقدر بیدار شدن از sleep دیرتر از موعد باشد، حلقه مسدود بوده است"""
+        while not self._stop:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(0.0, time.perf_counter() - expected))
+
+    async def run(self):
+        deadline = time.monotonic() + self.duration
+        monitor = asyncio.create_task(self._monitor_loop())
+        await asyncio.gather(*(self._user(i, deadline) for i in range(self.users)))
+        self._stop = True
+        await monitor
+
+
+def cleanup_database(db_manager, users):
+    """حذف حساب‌ها، تریدها و کاربران مصنوعی"""
+    lo, hi = USER_ID_BASE, USER_ID_BASE + users
+    db_manager.execute_query(
+        "DELETE t FROM trade_ops t JOIN trading_accounts a ON t.account_id = a.account_id "
+        "WHERE a.user_telegram_id BETWEEN %s AND %s", (lo, hi))
+    db_manager.execute_query("DELETE FROM trading_accounts WHERE user_telegram_id BETWEEN %s AND %s", (lo, hi))
+    db_manager.execute_query("DELETE FROM users WHERE telegram_id BETWEEN %s AND %s", (lo, hi))
+
+
+async def _run(users, duration, think, api_latency, excel):
+    # قبل از ایمپورت db_manager/telegram_bot، دیتابیس و Bot API به نسخه تست بار اشاره کنند
+    cfg = config.LOADTEST
+    config.INTERNAL_DB = cfg["INTERNAL_DB"]
+    api = FakeBotAPI(port=0, latency=api_latency).start()
+    config.TELEGRAM = dict(config.TELEGRAM, BOT_TOKEN=cfg.get("BOT_TOKEN", "123456:LOADTEST"),
+                           API_BASE_URL=api.base_url)
+
+    import db_manager
+    import wallex_api
+    import telegram_bot
+
+    # بدون تماس با والکس: کلید API مصنوعی معتبر است و قیمت زنده خالی
+    wallex_api.validate_api_key = lambda api_key: True
+    telegram_bot.get_live_prices_snapshot = lambda: {}
+
+    db_manager.ensure_schema()
+    cleanup_database(db_manager, users)
+    counter = DBCounter()
+    counter.install(db_manager)
+
+    app = telegram_bot.build_app()
+    await app.initialize()
+    api.calls.clear()
+    test = LoadTest(app, telegram_bot, users, duration, think, excel, counter)
+    logger.info("🔥 Bot load test: %d users, %ss, think=%ss, concurrent_updates=%s",
+                users, duration, think, config.TELEGRAM.get("CONCURRENT_UPDATES"))
+    started = time.perf_counter()
+    try:
+        await test.run()
+    finally:
+        wall = time.perf_counter() - started
+        await app.shutdown()
+        api.stop()
+        cleanup_database(db_manager, users)
+
+    updates = sum(len(v) for v in test.latencies.values())
+    every = [x for v in test.latencies.values() for x in v]
+    return {
+        "users": users,
+        "updates": updates,
+        "updates_per_sec": updates / max(wall, 1e-9),
+        "errors": test.errors,
+        "latency_p50": _percentile(every, 0.50),
+        "latency_p99": _percentile(every, 0.99),
+        "by_action": {label: (len(v), _percentile(v, 0.50), _percentile(v, 0.99), max(v))
+                      for label, v in sorted(test.latencies.items())},
+        "loop_lag_p50": _percentile(test.loop_lag, 0.50),
+        "loop_lag_p99": _percentile(test.loop_lag, 0.99),
+        "loop_lag_max": max(test.loop_lag) if test.loop_lag else 0.0,
+        "db_calls": dict(counter.calls),
+        "db_seconds": dict(counter.seconds),
+        "db_calls_per_update": counter.total() / max(updates, 1),
+        "bot_api_calls": api.method_counts(),
+        "wall_seconds": wall,
+    }
+
+
+def run_loadtest(users=None, duration=None, think=None, api_latency=None, excel=False):
+    cfg = config.LOADTEST
+    return asyncio.run(_run(
+        users if users is not None else cfg.get("USERS", 2000),
+        duration if duration is not None else cfg.get("DURATION_SECONDS", 60),
+        think if think is not None else cfg.get("THINK_SECONDS", 2.0),
+        api_latency if api_latency is not None else cfg.get("API_LATENCY", 0.05),
+        excel,
+    ))
+
+
+def print_report(report):
+    print("\n=== Bot Load Test Report ===")
+    for key in ("users", "updates", "updates_per_sec", "errors", "latency_p50", "latency_p99",
+                "loop_lag_p50", "loop_lag_p99", "loop_lag_max", "db_calls_per_update", "wall_seconds"):
+        v = report[key]
+        print(f"{key:>20}: {v:.4f}" if isinstance(v, float) else f"{key:>20}: {v}")
+
+    print(f"\n{'action':<14}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label, (n, p50, p99, worst) in report["by_action"].items():
+        print(f"{label:<14}{n:>8}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}{worst * 1000:>10.1f}")
+
+    print("\nDB calls:")
+    for name, n in sorted(report["db_calls"].items()):
+        print(f"{name:>20}: {n} ({report['db_seconds'][name]:.2f}s)")
+    print("\nBot API calls:")
+    for method, n in sorted(report["bot_api_calls"].items()):
+        print(f"{method:>20}: {n}")
+
+    # تأخیر حلقه یعنی هندلری کار مسدودکننده (دیتابیس/pandas) را در خود حلقه انجام داده است
+    threshold = config.LOADTEST.get("LOOP_LAG_WARN", 0.1)
+    if report["loop_lag_p99"] >= threshold:
+        print(f"⚠️ p99 event-loop lag >= {threshold}s: handlers block the loop, menus will lag at this load.")
+    else:
+        print("✅ Event loop stayed responsive at this load.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Load-test the Telegram bot handlers with synthetic users")
+    parser.add_argument("--users", type=int, default=None)
+    parser.add_argument("--duration", type=float, default=None, help="seconds of traffic")
+    parser.add_argument("--think", type=float, default=None, help="mean seconds between a user's clicks")
+    parser.add_argument("--api-latency", type=float, default=None, help="fake Bot API response delay")
+    parser.add_argument("--excel", action="store_true", help="include Excel report requests (heavy)")
+    args = parser.parse_args()
+
+    print_report(run_loadtest(args.users, args.duration, args.think, args.api_latency, args.excel))
@@ -0,0 +1,82 @@
+# clock.py
+# ساعت قابل کنترل: در حالت عادی همان time.time/time.sleep است،
+# در حالت بازپخش (replay) زمان مجازی است و با سرعت دلخواه جلو می‌رود.
+
+import time
+import threading
+from datetime import datetime, timezone
+
+
+class RealClock:
+    simulated = False
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SimulatedClock:
+    """
+    زمان مجازی. sleep به جای انتظار واقعی، زمان را جلو می‌برد.
+    speed: ضریب شتاب (مثلاً 100 یعنی هر ثانیه مجازی 0.01 ثانیه واقعی انتظار)؛
+    اگر None باشد هیچ انتظار واقعی انجام نمی‌شود (حداکثر سرعت).
+    زمان‌ها به صورت UTC تفسیر می‌شوند (سشن دیتابیس هم روی UTC تنظیم می‌شود).
+    """
+    simulated = True
+
+    def __init__(self, start_ts, speed=None):
+        self._now = float(start_ts)
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def time(self):
+        return self._now
+
+    def now(self):
+        return datetime.fromtimestamp(self._now, tz=timezone.utc).replace(tzinfo=None)
+
+    def on_advance(self, callback):
+        """callback(now_ts) بعد از هر جلو رفتن زمان صدا زده می‌شود (مثلاً موتور تطبیق)"""
+        self._listeners.append(callback)
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += seconds
+            now = self._now
+        for cb in self._listeners:
+            cb(now)
+
+    def sleep(self, seconds):
+        if self.speed:
+            time.sleep(seconds / self.speed)
+        self.advance(seconds)
+
+
+_clock = RealClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    global _clock
+    _clock = clock
+
+
+def now():
+    return _clock.now()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+
+def is_simulated():
+    return _clock.simulated
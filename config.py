@@ -22,7 +22,20 @@ TELEGRAM = {
     # توکن ربات شما
     "BOT_TOKEN": "8376582196:AAH7NWY8rq1SW07oolf7qjYoMTU3myyUprs",
     # آیدی عددی ادمین برای دریافت لاگ‌های خاص (اختیاری)
-    "ADMIN_ID": 0
+    "ADMIN_ID": 0,
+    # حالت دریافت آپدیت: "polling" (پیش‌فرض) یا "webhook"
+    "MODE": "polling",
+    # آدرس عمومی که تلگرام آپدیت‌ها را به آن POST می‌کند (باید HTTPS و به WEBHOOK_PORT برسد)
+    "WEBHOOK_URL": "https://bot.example.com/telegram",
+    "WEBHOOK_LISTEN": "0.0.0.0",
+    "WEBHOOK_PORT": 8443,
+    "WEBHOOK_PATH": "/telegram",
+    # توکن مخفی که تلگرام در هدر X-Telegram-Bot-Api-Secret-Token می‌فرستد
+    "WEBHOOK_SECRET": "change-me-to-a-random-string",
+    "CONCURRENT_UPDATES": 16,         # آپدیت‌های همزمان در حالت webhook (آپدیت‌های هر کاربر ترتیبی)
+    "ACCOUNT_CACHE_TTL": 5,           # فاصله بررسی مُهر نسخه کش حساب‌های هر کاربر (ثانیه)
+    # آدرس Bot API (برای تست آفلاین با fake_bot_api.py: "http://127.0.0.1:8081/bot")
+    "API_BASE_URL": "https://api.telegram.org/bot"
 }
 
 # 4. تنظیمات صرافی والکس (طبق مستندات Swagger جدید)
@@ -39,9 +52,14 @@ WALLEX = {
         "ACCOUNT_BALANCES": "/v1/account/balances",
         
         # آدرس دریافت لیست تمام بازارها
-        "ALL_MARKETS": "/hector/web/v1/markets"
+        "ALL_MARKETS": "/hector/web/v1/markets",
+
+        # سفارش‌های باز و معاملات اخیر حساب (برای همگام‌سازی یکجا بعد از ری‌استارت)
+        "OPEN_ORDERS": "/v1/account/openOrders",
+        "RECENT_TRADES": "/v1/account/trades"
     },
-    "QUOTE_ASSET": "TMN" # پیش‌فرض (در کد به صورت داینامیک هم هندل می‌شود)
+    "QUOTE_ASSET": "TMN", # پیش‌فرض (در کد به صورت داینامیک هم هندل می‌شود)
+    "CLIENT_ID_PREFIX": "MT" # پیشوند شناسه سفارش‌های ساخته شده توسط ربات (MT<trade_id>B/S)
 }
 
 # 5. تنظیمات کلی ربات
@@ -49,5 +67,149 @@ BOT_SETTINGS = {
     "LOG_LEVEL": "INFO",             # سطح لاگ‌گیری
     "SIGNAL_LOOKBACK_MINUTES": 5,    # سیگنال‌های ۵ دقیقه اخیر بررسی شوند
     "CHECK_INTERVAL": 3,             # فاصله زمانی بین هر سیکل اجرا (ثانیه)
-    "STALE_ORDER_MINUTES": 15        # لغو سفارش خرید اگر بعد از ۱۵ دقیقه پر نشد
+    "STALE_ORDER_MINUTES": 15,       # لغو سفارش خرید اگر بعد از ۱۵ دقیقه پر نشد
+    "BUY_CONCURRENCY": 8,            # تعداد ارسال همزمان سفارش خرید (کمتر از pool_size دیتابیس)
+    "RECONCILE_ON_START": True,      # همگام‌سازی یکجای سفارش‌های در جریان با صرافی قبل از حلقه اصلی
+    "CHECK_FUNDS": True,             # بررسی موجودی (یکبار برای هر کلید در هر سیکل) قبل از ارسال خرید
+    "FUNDS_MARGIN_PCT": 0.0          # حاشیه اطمینان روی مبلغ هر خرید در بررسی موجودی
+}
+
+# 6. تنظیمات لاگ (صف غیرمسدودکننده + چرخش فایل)
+LOGGING = {
+    "FILE": "bot_log.log",
+    "FORMAT": "%(asctime)s - [%(threadName)s] - %(levelname)s - %(message)s",
+    "JSON": False,                   # خروجی ساخت‌یافته (هر خط یک JSON)
+    "MAX_BYTES": 10 * 1024 * 1024,   # چرخش فایل بعد از ۱۰ مگابایت
+    "BACKUP_COUNT": 5,
+    "QUEUE_SIZE": 10000,             # اگر صف پر شود رکوردها دور ریخته می‌شوند (نه مسدود)
+    "RATE_LIMIT_PER_SEC": 50,        # سقف لاگ‌های زیر WARNING برای هر logger در ثانیه
+    # نمونه‌برداری از پیام‌های تکراری: فقط ۱ از هر N رکورد با این پیشوند نوشته می‌شود
+    "SAMPLING": {
+        "🔎 Signal Found": 20,
+        "✅ Queued": 10,
+        "📤 Sending": 5,
+    }
+}
+
+# 7. تنظیمات بازپخش تاریخی (replay.py) - هرگز روی دیتابیس اصلی اجرا نشود
+REPLAY = {
+    "INTERNAL_DB": {
+        'host': 'localhost',
+        'user': 'root',
+        'password': 'YourStrongPassword123!',
+        'database': 'multi_trade_replay'
+    },
+    "SIGNAL_POOL_DB": {
+        'host': 'localhost',
+        'user': 'root',
+        'password': 'YourStrongPassword123!',
+        'database': 'signal_pool_replay'
+    },
+    "SPEED": 100,                    # ضریب شتاب ساعت (None = حداکثر سرعت)
+    "ACCOUNTS": 10,                  # تعداد حساب‌های مصنوعی
+    "BUDGET_TMN": 1000000,
+    "BUDGET_USDT": 20,
+    "QTY_PRECISION": 4,              # دقت پیش‌فرض بازارهای شبیه‌سازی شده
+    "PRICE_PRECISION": 2
+}
+
+# 8. تنظیمات گزارش
+REPORT = {
+    "STREAMING_THRESHOLD": 5000,     # بیشتر از این تعداد ترید بسته، خروجی به صورت جریانی ساخته می‌شود
+    "CHUNK_SIZE": 2000,              # تعداد ردیف در هر تکه خواندن از دیتابیس
+    "STREAMING_FORMAT": "xlsx"       # "xlsx" (حالت constant_memory) یا "csv.gz"
+}
+
+# 9. زمان‌بندی تطبیقی بررسی وضعیت سفارش‌ها
+POLLING = {
+    "MARKET_SNAPSHOT_TTL": 10,       # هر چند ثانیه قیمت آخر بازارها تازه شود
+    "NEAR_DISTANCE_PCT": 0.5,        # سفارش‌های نزدیک‌تر از این درصد به قیمت بازار در هر سیکل بررسی می‌شوند
+    "MAX_INTERVAL": 60,              # حداکثر فاصله بررسی یک سفارش (ثانیه)
+    "FRESH_ORDER_SECONDS": 30,       # سفارش‌های تازه‌تر از این، بدون توجه به فاصله قیمت مرتب بررسی می‌شوند
+    "AGE_SCALE_MINUTES": 30          # به ازای هر این مقدار سن، فاصله بررسی یک برابر دیگر بیشتر می‌شود
+}
+
+# 10. صف اولویت‌دار خرید
+BUY_QUEUE = {
+    "MAX_SIGNAL_AGE_SECONDS": 300,   # سیگنال قدیمی‌تر از این خریده نمی‌شود
+    "MAX_DRIFT_PCT": 1.5,            # اگر قیمت لحظه‌ای بیش از این درصد از entry_price فاصله گرفته باشد رد می‌شود
+    # جریمه هر گرید بر حسب ثانیه سن (گرید بهتر = زودتر ارسال می‌شود)
+    "GRADE_PENALTY_SECONDS": {"Q1": 0, "Q2": 30, "Q3": 60, "Q4": 90},
+    "UNKNOWN_GRADE_PENALTY_SECONDS": 120
+}
+
+# 11. بایگانی تریدهای پایان‌یافته و حذف پس‌زمینه حساب‌ها (archiver.py)
+ARCHIVE = {
+    "AFTER_DAYS": 7,                 # تریدهای پایان‌یافته قدیمی‌تر از این به جدول تاریخچه منتقل می‌شوند
+    "CHUNK_SIZE": 500,               # تعداد ردیف در هر تراکنش انتقال/حذف
+    "MAX_CHUNKS_PER_RUN": 20,        # سقف تکه‌ها در هر دور تا قفل‌ها کوتاه بمانند
+    "CHUNK_PAUSE": 0.2,              # مکث بین تکه‌ها (ثانیه)
+    "INTERVAL_SECONDS": 60,          # فاصله بین دورهای بایگانی
+    "MONTHS_AHEAD": 2                # پارتیشن ماه‌های آینده از قبل ساخته شود
+}
+
+# 12. پروفایلر درجای سیکل‌ها (profiler.py)
+PROFILER = {
+    "ENABLED": False,                # در حین اجرا: kill -USR1 <pid> برای روشن/خاموش کردن
+    "TOGGLE_SIGNAL": "SIGUSR1",
+    "KEEP_SLOWEST": 5,               # تعداد کندترین سیکل‌هایی که برای هر حلقه نگه داشته می‌شوند
+    "DIR": "profiles",               # فایل‌های .prof (برای pstats/snakeviz) و خلاصه .txt
+    "TOP_FUNCTIONS": 30              # تعداد توابع در خلاصه متنی
+}
+
+# 13. اتصال دیتابیس داخلی در سیکل‌ها (db_manager.unit_of_work)
+DATABASE = {
+    "PREPARED_STATEMENTS": True,     # دستورات پارامتردار داخل یک واحد به صورت prepared سمت سرور اجرا شوند
+    "PREPARED_CACHE_SIZE": 32        # حداکثر prepared statement باز در هر واحد (LRU)
+}
+
+# 14. سلامت صرافی: قطع‌کننده مشترک درخواست‌های والکس (wallex_api.HEALTH)
+EXCHANGE_HEALTH = {
+    "WINDOW_SECONDS": 60,            # پنجره زمانی محاسبه نرخ خطا/کندی
+    "MIN_CALLS": 10,                 # حداقل درخواست در پنجره قبل از تصمیم‌گیری
+    "ERROR_RATE": 0.5,               # نرخ خطا (خطای شبکه، 5xx، 429) برای باز شدن
+    "SLOW_CALL_SECONDS": 5,          # درخواست کندتر از این «کند» حساب می‌شود
+    "SLOW_RATE": 0.5,                # نرخ درخواست‌های کند برای باز شدن
+    "OPEN_SECONDS": 30,              # مهلت اولیه باز ماندن (با هر شکست آزمایشی دو برابر)
+    "MAX_OPEN_SECONDS": 300,
+    "HALF_OPEN_PROBES": 3,           # تعداد درخواست آزمایشی موفق برای بسته شدن
+    "RETRY_BASE_SECONDS": 15,        # فاصله اولین تلاش مجدد ترید بعد از خطای گذرا
+    "RETRY_MAX_SECONDS": 600
+}
+
+# 15. پردازش صفحه‌ای مجموعه کار مراحل executor (work_set.py)
+BATCHING = {
+    "BATCH_SIZE": 500,               # حداکثر ردیف در هر صفحه (حافظه محدود)
+    "MAX_PER_ACCOUNT": 100,          # سهم هر حساب در هر مرحله/سیکل؛ بقیه در سیکل‌های بعد
+    "CYCLE_BUDGET_SECONDS": 60       # بودجه زمانی کل سیکل (0 = بدون محدودیت)
+}
+
+# 16. تست بار بات تلگرام (bot_loadtest.py) - هرگز روی دیتابیس اصلی اجرا نشود
+LOADTEST = {
+    "INTERNAL_DB": {
+        'host': 'localhost',
+        'user': 'root',
+        'password': 'YourStrongPassword123!',
+        'database': 'multi_trade_loadtest'
+    },
+    "BOT_TOKEN": "123456:LOADTEST",  # فقط به fake_bot_api محلی فرستاده می‌شود
+    "USERS": 2000,                   # تعداد کاربران مصنوعی همزمان
+    "DURATION_SECONDS": 60,
+    "THINK_SECONDS": 2.0,            # میانگین فاصله بین کلیک‌های هر کاربر
+    "API_LATENCY": 0.05,             # تأخیر پاسخ Bot API شبیه‌سازی شده
+    "LOOP_LAG_WARN": 0.1             # آستانه هشدار p99 تأخیر حلقه رویداد (ثانیه)
+}
+
+# 17. اسنپ‌شات مشترک اطلاعات بازار بین پروسه‌ها (market_snapshot.py)
+MARKET_SNAPSHOT = {
+    "ENABLED": True,                 # خواننده‌ها از فایل map شده بخوانند (تازه‌ساز: python main.py snapshot)
+    "PATH": "/dev/shm/multi_trade_markets.snap",  # روی tmpfs تا فقط در حافظه بماند
+    "MAX_AGE_SECONDS": 60            # اسنپ‌شات قدیمی‌تر = تازه‌ساز متوقف است؛ هر پروسه خودش از API می‌خواند
+}
+
+# 18. پخش سیگنال‌ها سمت سرور دیتابیس (signal_reader.fanout_server_side)
+SIGNAL_FANOUT = {
+    # فقط وقتی SIGNAL_POOL_DB و INTERNAL_DB روی یک سرور MySQL (8+) هستند و کاربر INTERNAL_DB
+    # دسترسی SELECT روی دیتابیس signal_pool دارد؛ سیگنال‌ها دیگر از پایتون عبور نمی‌کنند
+    "SERVER_SIDE": False
 }
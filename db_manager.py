@@ -1,31 +1,63 @@
 # db_manager.py
 import mysql.connector
 from mysql.connector import pooling
+import contextlib
 import logging
+import threading
+import time
+from collections import OrderedDict
 import config
+import clock
 
 # تنظیمات لاگ
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# --- 1. ایجاد استخر اتصال برای دیتابیس داخلی (نوشتن/خواندن زیاد) ---
-try:
-    internal_pool = pooling.MySQLConnectionPool(
-        pool_name="multi_trade_pool",
-        pool_size=10,
-        **config.INTERNAL_DB
-    )
-    logging.info("✅ Database Pool (Internal) Created.")
-except Exception as e:
-    logging.critical(f"❌ Critical Error creating DB Pool: {e}")
-    internal_pool = None
+# --- 1. استخر اتصال دیتابیس داخلی (نوشتن/خواندن زیاد) ---
+# در اولین استفاده ساخته می‌شود، نه هنگام ایمپورت: ابزارهایی که فقط ماژول را ایمپورت می‌کنند
+# هزینه اتصال نمی‌دهند و اگر دیتابیس در دسترس نباشد پروسه از کار نمی‌افتد (بعداً دوباره تلاش می‌شود).
+POOL_RETRY_SECONDS = 5
+
+internal_pool = None
+_pool_lock = threading.Lock()
+_pool_failed_at = 0.0
+
+def get_internal_pool():
+    global internal_pool, _pool_failed_at
+    if internal_pool is not None: return internal_pool
+    with _pool_lock:
+        if internal_pool is None and time.monotonic() - _pool_failed_at >= POOL_RETRY_SECONDS:
+            try:
+                internal_pool = pooling.MySQLConnectionPool(
+                    pool_name="multi_trade_pool",
+                    pool_size=10,
+                    **config.INTERNAL_DB
+                )
+                logging.info("✅ Database Pool (Internal) Created.")
+            except Exception as e:
+                _pool_failed_at = time.monotonic()
+                logging.critical(f"❌ Critical Error creating DB Pool: {e}")
+    return internal_pool
 
 # --- توابع کمکی ---
 
+def _apply_clock(conn):
+    """
+    در حالت بازپخش، NOW() سشن را روی زمان ساعت مجازی قفل می‌کند
+    تا کوئری‌های مبتنی بر NOW() بدون تغییر با زمان شبیه‌سازی کار کنند.
+    """
+    if conn and clock.is_simulated():
+        cur = conn.cursor()
+        cur.execute("SET time_zone = '+00:00'")
+        cur.execute("SET TIMESTAMP = %s", (clock.get_clock().time(),))
+        cur.close()
+    return conn
+
 def get_internal_connection():
     """یک اتصال از استخر دیتابیس داخلی می‌گیرد"""
-    if not internal_pool: return None
+    pool = get_internal_pool()
+    if not pool: return None
     try:
-        return internal_pool.get_connection()
+        return _apply_clock(pool.get_connection())
     except Exception as e:
         logging.error(f"Pool Connection Error: {e}")
         return None
@@ -33,15 +65,161 @@ def get_internal_connection():
 def get_signal_pool_connection():
     """یک اتصال مستقیم به دیتابیس استخر سیگنال می‌سازد"""
     try:
-        return mysql.connector.connect(**config.SIGNAL_POOL_DB)
+        return _apply_clock(mysql.connector.connect(**config.SIGNAL_POOL_DB))
     except Exception as e:
         logging.error(f"Signal DB Connection Error: {e}")
         return None
 
+# --- Unit of Work: یک اتصال برای کل یک مرحله/سیکل ---
+# داخل `with unit_of_work():` همه execute_query/fetch_columns/execute_transaction های همان ترد
+# از یک اتصال استفاده می‌کنند (به جای گرفتن/پس دادن اتصال از استخر برای هر دستور).
+# دستورات پارامتردار به صورت prepared statement سمت سرور اجرا و در طول واحد دوباره استفاده می‌شوند.
+# پیش‌فرض autocommit است (مثل قبل هر دستور جدا اعمال می‌شود)؛ برای مرز تراکنش صریح:
+#     with unit_of_work(transactional=True): ...   یا   with uow.transaction(): ...
+
+_local = threading.local()
+
+class UnitOfWork:
+
+    def __init__(self, conn, transactional=False):
+        self.conn = conn
+        self.transactional = False
+        self.failed = False
+        self.prepare = config.DATABASE.get("PREPARED_STATEMENTS", True)
+        self.cache_size = config.DATABASE.get("PREPARED_CACHE_SIZE", 32)
+        self._prepared = OrderedDict()      # متن کوئری -> کرسر prepared (LRU)
+        self.stats = {"statements": 0, "prepared_hits": 0, "prepares": 0}
+        conn.autocommit = True
+        if transactional:
+            self._begin()
+
+    def _begin(self):
+        self.conn.start_transaction()
+        self.transactional = True
+        self.failed = False
+
+    def _end(self, ok):
+        try:
+            if ok and not self.failed:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.transactional = False
+        return ok and not self.failed
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """مرز تراکنش صریح داخل واحد؛ تو در تو بودن به تراکنش بیرونی ملحق می‌شود"""
+        if self.transactional:
+            yield self
+            return
+        self._begin()
+        try:
+            yield self
+        except BaseException:
+            self._end(False)
+            raise
+        self._end(True)
+
+    def _cursor(self, query, params):
+        if not (self.prepare and params):
+            return self.conn.cursor(dictionary=True, buffered=True), False
+        cursor = self._prepared.get(query)
+        if cursor is not None:
+            self._prepared.move_to_end(query)
+            self.stats["prepared_hits"] += 1
+            return cursor, True
+        cursor = self.conn.cursor(prepared=True, dictionary=True)
+        self._prepared[query] = cursor
+        self.stats["prepares"] += 1
+        if len(self._prepared) > self.cache_size:
+            _, evicted = self._prepared.popitem(last=False)
+            evicted.close()
+        return cursor, True
+
+    def _discard(self, query):
+        cursor = self._prepared.pop(query, None)
+        if cursor:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def execute(self, query, params=None, fetch=None):
+        cursor, prepared = None, False
+        self.stats["statements"] += 1
+        try:
+            cursor, prepared = self._cursor(query, params)
+            cursor.execute(query, params or ())
+            if fetch == 'all':
+                return cursor.fetchall()
+            elif fetch == 'one':
+                # کرسر prepared دوباره استفاده می‌شود، پس نتیجه باید کامل خوانده شود
+                rows = cursor.fetchall()
+                return rows[0] if rows else None
+            return cursor.lastrowid if "INSERT" in query.upper() else cursor.rowcount
+        except mysql.connector.Error as e:
+            logging.error(f"SQL Error: {e}\nQuery: {query}")
+            if prepared: self._discard(query)
+            if self.transactional: self.failed = True
+            return None
+        finally:
+            if cursor and not prepared: cursor.close()
+
+    def close(self):
+        for query in list(self._prepared):
+            self._discard(query)
+        try:
+            if self.transactional: self.conn.rollback()
+            self.conn.autocommit = False
+        except Exception:
+            pass
+        self.conn.close()
+
+def current_unit():
+    return getattr(_local, "unit", None)
+
+@contextlib.contextmanager
+def unit_of_work(transactional=False):
+    """
+    نگه داشتن یک اتصال برای همه کوئری‌های این ترد تا پایان بلوک.
+    واحد تو در تو به واحد بیرونی ملحق می‌شود (با transactional=True یک تراکنش داخل آن باز می‌شود).
+    اگر اتصال در دسترس نباشد بلوک بدون واحد اجرا می‌شود (رفتار قبلی هر دستور).
+    """
+    outer = current_unit()
+    if outer is not None:
+        if transactional:
+            with outer.transaction():
+                yield outer
+        else:
+            yield outer
+        return
+
+    conn = get_internal_connection()
+    if not conn:
+        yield None
+        return
+    uow = UnitOfWork(conn, transactional)
+    _local.unit = uow
+    try:
+        yield uow
+        if uow.transactional: uow._end(True)
+    except BaseException:
+        if uow.transactional: uow._end(False)
+        raise
+    finally:
+        _local.unit = None
+        uow.close()
+
 def execute_query(query, params=None, fetch=None, use_signal_db=False):
     """
     تابع جامع اجرای کوئری.
     """
+    unit = None if use_signal_db else current_unit()
+    if unit is not None:
+        return unit.execute(query, params, fetch)
+
     conn = None
     cursor = None
     
@@ -70,3 +248,193 @@ def execute_query(query, params=None, fetch=None, use_signal_db=False):
     finally:
         if cursor: cursor.close()
         if conn: conn.close()
+
+def fetch_columns(query, params=None):
+    """
+    خواندن نتیجه به صورت ستونی (نام ستون‌ها + ردیف‌های tuple) بدون ساخت dict برای هر ردیف.
+    مناسب برای بارگذاری مستقیم در DataFrame/NumPy.
+    """
+    unit = current_unit()
+    conn = None
+    cursor = None
+    try:
+        conn = unit.conn if unit else get_internal_connection()
+        if not conn: return None, []
+
+        cursor = conn.cursor()
+        cursor.execute(query, params or ())
+        rows = cursor.fetchall()
+        return [c[0] for c in cursor.description], rows
+
+    except mysql.connector.Error as e:
+        logging.error(f"SQL Error: {e}\nQuery: {query}")
+        return None, []
+    finally:
+        if cursor: cursor.close()
+        if conn and not unit: conn.close()
+
+def iter_chunks(query, params=None, chunk_size=1000):
+    """
+    اجرای کوئری با کرسر بدون بافر (ردیف‌ها از سمت سرور به تدریج خوانده می‌شوند)
+    و برگرداندن نتیجه در تکه‌های ثابت: (نام ستون‌ها، لیست ردیف‌ها).
+    حافظه مصرفی مستقل از تعداد کل ردیف‌هاست.
+    خطای SQL (حتی وسط جریان) و نبودن اتصال raise می‌شوند تا مصرف‌کننده خروجی ناقص/خالی را کامل فرض نکند.
+    """
+    conn = get_internal_connection()
+    if not conn:
+        raise mysql.connector.Error("No internal database connection available")
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(query, params or ())
+        columns = [c[0] for c in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows: break
+            yield columns, rows
+    except mysql.connector.Error as e:
+        logging.error(f"SQL Error: {e}\nQuery: {query}")
+        raise
+    finally:
+        # اگر مصرف‌کننده زودتر متوقف شد، باقی نتیجه باید خوانده شود تا اتصال قابل استفاده بماند
+        try:
+            conn.consume_results()
+        except Exception:
+            pass
+        if cursor: cursor.close()
+        conn.close()
+
+def execute_transaction(statements):
+    """
+    اجرای چند دستور در یک تراکنش روی یک اتصال: یا همه اعمال می‌شوند یا هیچ‌کدام.
+    statements: لیست (query, params). خروجی: لیست rowcount ها یا None در صورت خطا.
+    داخل unit_of_work روی همان اتصال (و در صورت وجود، داخل همان تراکنش) اجرا می‌شود.
+    """
+    unit = current_unit()
+    if unit is not None:
+        counts = []
+        with unit.transaction():
+            for query, params in statements:
+                n = unit.execute(query, params)
+                if n is None: return None
+                counts.append(n)
+        return counts
+
+    conn = get_internal_connection()
+    if not conn: return None
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        counts = []
+        for query, params in statements:
+            cursor.execute(query, params or ())
+            counts.append(cursor.rowcount)
+        conn.commit()
+        return counts
+    except mysql.connector.Error as e:
+        logging.error(f"SQL Transaction Error: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return None
+    finally:
+        if cursor: cursor.close()
+        conn.close()
+
+# --- مهاجرت‌های سبک اسکیما (idempotent، در شروع هر موتور اجرا می‌شوند) ---
+
+SCHEMA_COLUMNS = [
+    # (جدول، ستون، تعریف)
+    ("trade_ops", "signal_grade", "VARCHAR(10) NULL"),
+    ("trade_ops", "signal_time", "DATETIME NULL"),
+    # سن سیگنال هنگام درج، نسبت به ساعت دیتابیس سیگنال (signal_time با ساعت دیتابیس داخلی مقایسه نمی‌شود)
+    ("trade_ops", "signal_lag_seconds", "INT NULL"),
+    # تلاش مجدد با فاصله نمایی برای خطاهای گذرای صرافی
+    ("trade_ops", "retry_count", "INT NOT NULL DEFAULT 0"),
+    ("trade_ops", "retry_at", "DATETIME NULL"),
+    # مُهر نسخه برای کش حساب‌ها در بات
+    ("trading_accounts", "updated_at", "TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+    # حذف حساب به صورت پس‌زمینه (archiver) انجام می‌شود؛ تا آن زمان حساب پنهان است
+    ("trading_accounts", "deleted_at", "DATETIME NULL"),
+]
+
+HISTORY_TABLE = "trade_ops_history"
+
+# وضعیت‌های پایان‌یافته ترید (بایگانی می‌شوند و مانع سیگنال جدید روی همان دارایی/استراتژی نیستند)
+TERMINAL_STATUSES = ('COMPLETED', 'SELL_ORDER_FILLED', 'ERROR', 'CANCELED_TIMEOUT',
+                     'SKIPPED_CIRCUIT', 'SKIPPED_CIRCUIT_BREAKER', 'SKIPPED_STALE', 'SKIPPED_DRIFT',
+                     'SKIPPED_FUNDS')
+
+def placeholders(n):
+    return ", ".join(["%s"] * n)
+
+def ensure_column(table, column, definition):
+    exists = execute_query(
+        """SELECT 1 AS ok FROM information_schema.COLUMNS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s""",
+        (table, column), fetch='one'
+    )
+    if exists: return True
+    logging.info(f"🛠 Adding column {table}.{column}")
+    return execute_query(f"ALTER TABLE {table} ADD COLUMN {column} {definition}") is not None
+
+def table_exists(table):
+    return bool(execute_query(
+        "SELECT 1 AS ok FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,), fetch='one'
+    ))
+
+def table_columns(table):
+    rows = execute_query(
+        """SELECT COLUMN_NAME AS name FROM information_schema.COLUMNS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION""",
+        (table,), fetch='all'
+    ) or []
+    return [r['name'] for r in rows]
+
+def month_partition(year, month):
+    ny, nm = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"PARTITION p{year:04d}{month:02d} VALUES LESS THAN (TO_DAYS('{ny:04d}-{nm:02d}-01'))"
+
+def ensure_history_table():
+    """
+    جدول تاریخچه تریدهای پایان‌یافته، پارتیشن‌بندی شده بر اساس ماه created_at.
+    کلید اصلی (id, created_at) است چون ستون پارتیشن باید در کلید اصلی باشد.
+    """
+    if table_exists(HISTORY_TABLE):
+        # ستون‌هایی که بعداً به trade_ops اضافه شده‌اند به تاریخچه هم اضافه شوند
+        for table, column, definition in SCHEMA_COLUMNS:
+            if table == "trade_ops":
+                ensure_column(HISTORY_TABLE, column, definition)
+        return True
+
+    first = execute_query("SELECT MIN(created_at) AS first FROM trade_ops", fetch='one')
+    start = first['first'] if first and first['first'] else clock.now()
+    now = clock.now()
+    parts = []
+    y, m = start.year, start.month
+    while (y, m) <= (now.year, now.month):
+        parts.append(month_partition(y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    parts.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+    logging.info(f"🛠 Creating {HISTORY_TABLE} ({len(parts) - 1} monthly partitions)")
+    ok = execute_query(f"CREATE TABLE {HISTORY_TABLE} LIKE trade_ops") is not None
+    ok = ok and execute_query(
+        f"ALTER TABLE {HISTORY_TABLE} MODIFY created_at DATETIME NOT NULL, "
+        f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at)"
+    ) is not None
+    ok = ok and execute_query(
+        f"ALTER TABLE {HISTORY_TABLE} PARTITION BY RANGE (TO_DAYS(created_at)) ({', '.join(parts)})"
+    ) is not None
+    return ok
+
+def ensure_schema():
+    """
+    مهاجرت‌های اسکیما (بررسی و سپس ALTER/CREATE، غیر اتمی). فقط یکبار در شروع پروسه و قبل از
+    راه‌اندازی تردهای اجزا اجرا شود (main.py)، نه در هر جزء؛ اجرای همزمان از چند ترد تداخل دارد.
+    """
+    for table, column, definition in SCHEMA_COLUMNS:
+        ensure_column(table, column, definition)
+    ensure_history_table()
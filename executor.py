@@ -1,32 +1,77 @@
 # executor.py
 # نسخه نهایی و کامل (شامل تمام مراحل)
 
-import time
 import logging
+import time
 import requests
 import config
 import db_manager
 import wallex_api
+import clock
+import poll_scheduler
+import balance_book
+import work_set
+import profiler
 from datetime import datetime, timedelta
 from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 TIMEOUT_MINUTES = config.BOT_SETTINGS.get("STALE_ORDER_MINUTES", 15)
 
+# زمان‌بندی جداگانه بررسی سفارش‌های خرید و فروش باز
+BUY_POLLS = poll_scheduler.PollScheduler("buy")
+SELL_POLLS = poll_scheduler.PollScheduler("sell")
+PROFILER = profiler.CycleProfiler("executor")
+
+# مهلت مرحله جاری (time.monotonic) که run_cycle از بودجه زمانی سیکل تعیین می‌کند
+_step_deadline = None
+
+def _work(step, query, params=(), newest_first=False, due=None):
+    return work_set.WorkSet(step, query, params, deadline=_step_deadline, newest_first=newest_first, due=due)
+
 def send_telegram_alert(user_id, message):
     try:
-        url = f"https://api.telegram.org/bot{config.TELEGRAM['BOT_TOKEN']}/sendMessage"
+        base = config.TELEGRAM.get("API_BASE_URL", "https://api.telegram.org/bot")
+        url = f"{base}{config.TELEGRAM['BOT_TOKEN']}/sendMessage"
         kb = {"inline_keyboard": [[{"text": "🔙 منوی اصلی", "callback_data": "main_menu"}]]}
         payload = {'chat_id': user_id, 'text': message, 'parse_mode': 'Markdown', 'reply_markup': kb}
         requests.post(url, json=payload, timeout=5)
     except: pass
 
+def exchange_paused():
+    """قطع‌کننده سلامت صرافی باز است: مراحلی که درخواست غیرضروری می‌فرستند این سیکل رد می‌شوند"""
+    return not wallex_api.HEALTH.available()
+
+# retry_count/retry_at بین فاز خرید و فروش مشترک است: با ورود به BUY_IN_PROGRESS/BUY_FILLED صفر می‌شود
+# تا عقب‌نشینی و هشدار یکباره فاز فروش از نو شروع شوند
+RESET_RETRY = "retry_count=0, retry_at=NULL"
+
+def defer_trade(trade, note, status=None):
+    """
+    خطای گذرا (صرافی ناسالم، 5xx، تایم‌اوت): ترید در وضعیت قابل تلاش مجدد می‌ماند و
+    تلاش بعدی با فاصله نمایی (retry_at) انجام می‌شود، به جای ERROR یا تلاش در هر سیکل.
+    """
+    delay = wallex_api.retry_delay(trade.get('retry_count') or 0)
+    if status:
+        db_manager.execute_query(
+            "UPDATE trade_ops SET status=%s, retry_count=retry_count+1, retry_at=NOW() + INTERVAL %s SECOND, notes=%s WHERE id=%s",
+            (status, delay, note, trade['id'])
+        )
+    else:
+        db_manager.execute_query(
+            "UPDATE trade_ops SET retry_count=retry_count+1, retry_at=NOW() + INTERVAL %s SECOND, notes=%s WHERE id=%s",
+            (delay, note, trade['id'])
+        )
+    logger.warning("🔁 Trade %s deferred %ds: %s", trade['id'], delay, note)
+
 def check_circuit_breaker(account_id, pair, limit):
     if limit <= 0: return False
     query = """SELECT SUM(invested_amount) as total_locked FROM trade_ops
                WHERE account_id = %s AND pair = %s 
-               AND status IN ('BUY_IN_PROGRESS', 'BUY_FILLED', 'SELL_IN_PROGRESS', 'SELL_ORDER_PLACED')"""
+               AND status IN ('BUY_PENDING', 'BUY_IN_PROGRESS', 'BUY_FILLED', 'SELL_IN_PROGRESS', 'SELL_ORDER_PLACED')"""
     res = db_manager.execute_query(query, (account_id, pair), fetch='one')
     curr = res.get('total_locked') or 0
     return curr >= limit
@@ -34,102 +79,281 @@ def check_circuit_breaker(account_id, pair, limit):
 # ==============================================================================
 # Step 1: Place Buy
 # ==============================================================================
-def step_1_place_buy():
-    query = """SELECT t.*, a.wallex_api_key, a.user_telegram_id, a.trade_amount_tmn, a.trade_amount_usdt, 
-               a.max_trade_tmn, a.max_trade_usdt 
+_send_pool = None
+
+def _get_send_pool():
+    global _send_pool
+    if _send_pool is None:
+        _send_pool = ThreadPoolExecutor(max_workers=config.BOT_SETTINGS.get("BUY_CONCURRENCY", 8),
+                                        thread_name_prefix="BuySender")
+    return _send_pool
+
+def _prepare_buy(sig):
+    """اعتبارسنجی محلی سیگنال؛ خروجی (symbol, price, qty, cost) یا None اگر نباید ارسال شود"""
+    pair = sig['pair']
+    symbol = f"{sig['asset_name']}{pair}"
+    budget = sig['trade_amount_tmn'] if pair == 'TMN' else sig['trade_amount_usdt']
+    limit = sig['max_trade_tmn'] if pair == 'TMN' else sig['max_trade_usdt']
+
+    if budget <= 0:
+        db_manager.execute_query("UPDATE trade_ops SET status='ERROR', notes='Budget 0' WHERE id=%s", (sig['id'],))
+        return None
+    if check_circuit_breaker(sig['account_id'], pair, limit):
+        db_manager.execute_query("UPDATE trade_ops SET status='SKIPPED_CIRCUIT' WHERE id=%s", (sig['id'],))
+        return None
+
+    qty_prec, price_prec = wallex_api.get_precision(symbol)
+    if qty_prec is None: return None
+
+    price = float(sig['entry_price'])
+    raw_qty = float(budget) / price
+    final_price = wallex_api.format_price(price, price_prec)
+    final_qty = wallex_api.format_quantity(raw_qty, qty_prec)
+
+    if final_qty <= 0:
+        db_manager.execute_query("UPDATE trade_ops SET status='ERROR', notes='Qty too small' WHERE id=%s", (sig['id'],))
+        return None
+
+    # رد سفارش‌های محکوم به شکست (حداقل مقدار/ارزش، باند قیمت) بدون رفت و برگشت به صرافی
+    final_qty, limit_err, _ = wallex_api.check_order_limits(symbol, 'buy', final_price, final_qty)
+    if limit_err:
+        db_manager.execute_query("UPDATE trade_ops SET status='ERROR', notes=%s WHERE id=%s", (f"Buy Rejected: {limit_err}", sig['id']))
+        return None
+
+    # مبلغ واقعی سفارش (بعد از گرد کردن و سقف max_qty)، نه کل بودجه
+    return symbol, final_price, final_qty, final_price * final_qty
+
+def _send_buy(order):
+    sig, cid, symbol, price, qty, _ = order
+    logger.info("🛒 Placing Buy %s | P: %s | Q: %s", symbol, price, qty)
+    try:
+        return wallex_api.place_order(sig['wallex_api_key'], symbol, 'buy', price, qty, client_id=cid)
+    except Exception as e:
+        logger.error("Step 1 send: %s", e)
+        return None
+
+def _apply_buy_result(order, res):
+    sig, cid, _, _, _, cost = order
+    if res and res.get('success'):
+        db_manager.execute_query(
+            f"UPDATE trade_ops SET status='BUY_IN_PROGRESS', invested_amount=%s, {RESET_RETRY}, updated_at=NOW() WHERE id=%s",
+            (cost, sig['id'])
+        )
+    elif res is None:
+        # تایم‌اوت/خطای شبکه: معلوم نیست سفارش ثبت شده یا نه؛ در BUY_PENDING می‌ماند
+        # و در سیکل بعد با همان شناسه بررسی می‌شود (بدون خطر سفارش تکراری)
+        db_manager.execute_query("UPDATE trade_ops SET notes='Buy Unconfirmed' WHERE id=%s", (sig['id'],))
+    elif res.get('retryable'):
+        # خطای گذرای صرافی: سیگنال با همان شناسه سفارش بعداً دوباره ارسال می‌شود
+        defer_trade(sig, f"Buy Deferred: {res.get('message') or 'Exchange unavailable'}"[:250], status='NEW_SIGNAL')
+    else:
+        # تلاش مجدد ممکن است به خاطر سفارش قبلی با همین شناسه رد شده باشد
+        status = wallex_api.ORDER_NOT_FOUND
+        if sig.get('buy_client_order_id'):
+            status = wallex_api.get_order_status(cid, sig['wallex_api_key'])
+        if status:
+            db_manager.execute_query(
+                f"UPDATE trade_ops SET status='BUY_IN_PROGRESS', invested_amount=%s, {RESET_RETRY}, updated_at=NOW() WHERE id=%s",
+                (cost, sig['id'])
+            )
+        elif status is None:
+            # وضعیت سفارش قبلی نامعلوم است: در BUY_PENDING می‌ماند تا resolve_pending_buys بررسی کند
+            db_manager.execute_query("UPDATE trade_ops SET notes='Buy Unconfirmed' WHERE id=%s", (sig['id'],))
+        else:
+            err = res.get('message') or 'API Error'
+            db_manager.execute_query("UPDATE trade_ops SET status='ERROR', notes=%s WHERE id=%s", (f"Buy Fail: {err}", sig['id']))
+
+def resolve_pending_buys():
+    """
+    خریدهایی که پاسخشان نرسیده (BUY_PENDING): اگر سفارش در صرافی هست به BUY_IN_PROGRESS می‌روند،
+    اگر صرافی نبودنش را تأیید کرد به NEW_SIGNAL برمی‌گردند تا با همان شناسه دوباره ارسال شوند،
+    و اگر استعلام خطا داد در BUY_PENDING می‌مانند (سفارش ممکن است باز باشد).
+    """
+    query = """SELECT t.id, t.buy_client_order_id, a.wallex_api_key
                FROM trade_ops t JOIN trading_accounts a ON t.account_id = a.account_id
-               WHERE t.status = 'NEW_SIGNAL' AND a.is_active = TRUE"""
-    signals = db_manager.execute_query(query, fetch='all')
-    if not signals: return
+               WHERE t.status = 'BUY_PENDING'"""
+    pending = db_manager.execute_query(query, fetch='all')
+    if not pending: return
 
-    for sig in signals:
+    for p in pending:
         try:
-            pair = sig['pair']
-            symbol = f"{sig['asset_name']}{pair}"
-            budget = sig['trade_amount_tmn'] if pair == 'TMN' else sig['trade_amount_usdt']
-            limit = sig['max_trade_tmn'] if pair == 'TMN' else sig['max_trade_usdt']
+            status = wallex_api.get_order_status(p['buy_client_order_id'], p['wallex_api_key'])
+            if status:
+                db_manager.execute_query(f"UPDATE trade_ops SET status='BUY_IN_PROGRESS', {RESET_RETRY}, updated_at=NOW() WHERE id=%s", (p['id'],))
+            elif status is wallex_api.ORDER_NOT_FOUND:
+                db_manager.execute_query("UPDATE trade_ops SET status='NEW_SIGNAL' WHERE id=%s AND status='BUY_PENDING'", (p['id'],))
+        except Exception as e: logger.error("Step 1 pending: %s", e)
 
-            if budget <= 0:
-                db_manager.execute_query("UPDATE trade_ops SET status='ERROR', notes='Budget 0' WHERE id=%s", (sig['id'],))
-                continue
-            if check_circuit_breaker(sig['account_id'], pair, limit):
-                db_manager.execute_query("UPDATE trade_ops SET status='SKIPPED_CIRCUIT' WHERE id=%s", (sig['id'],))
-                continue
+def signal_age_sql(prefix=""):
+    """
+    سن سیگنال بدون مقایسه زمان دو سرور: تأخیر ثبت شده هنگام درج (نسبت به NOW() دیتابیس سیگنال)
+    + زمان سپری شده از created_at (که همین دیتابیس داخلی ثبت کرده). signal_time خام به NOW()
+    دیتابیس داخلی مقایسه نمی‌شود چون تایم‌زون دو سرور/نشست ممکن است متفاوت باشد.
+    """
+    return (f"(COALESCE({prefix}signal_lag_seconds, 0) "
+            f"+ TIMESTAMPDIFF(SECOND, {prefix}created_at, NOW()))")
 
-            qty_prec, price_prec = wallex_api.get_precision(symbol)
-            if qty_prec is None: continue
+def expire_stale_signals():
+    """سیگنال‌هایی که از حداکثر سن گذشته‌اند، قبل از هر کار دیگری کنار گذاشته می‌شوند (یک کوئری)"""
+    max_age = config.BUY_QUEUE.get("MAX_SIGNAL_AGE_SECONDS", 300)
+    n = db_manager.execute_query(
+        f"""UPDATE trade_ops SET status='SKIPPED_STALE', notes='Signal expired'
+           WHERE status='NEW_SIGNAL' AND {signal_age_sql()} > %s""",
+        (max_age,)
+    )
+    if n: logger.warning("⌛ Expired %s stale signals", n)
 
-            price = float(sig['entry_price'])
-            raw_qty = float(budget) / price
-            final_price = wallex_api.format_price(price, price_prec)
-            final_qty = wallex_api.format_quantity(raw_qty, qty_prec)
+def prioritize_signals(signals):
+    """
+    حذف سیگنال‌هایی که قیمتشان از قیمت لحظه‌ای دور شده (بدون فراخوانی API سفارش)
+    و مرتب‌سازی بقیه: تازه‌تر و با گرید بهتر زودتر.
+    """
+    cfg = config.BUY_QUEUE
+    max_drift = cfg.get("MAX_DRIFT_PCT", 0)
+    penalties = cfg.get("GRADE_PENALTY_SECONDS", {})
+    unknown_penalty = cfg.get("UNKNOWN_GRADE_PENALTY_SECONDS", 0)
+    if max_drift:
+        wallex_api.refresh_market_snapshot()
 
-            if final_qty <= 0:
-                db_manager.execute_query("UPDATE trade_ops SET status='ERROR', notes='Qty too small' WHERE id=%s", (sig['id'],))
-                continue
+    ready = []
+    for sig in signals:
+        if max_drift:
+            last = wallex_api.get_last_price(f"{sig['asset_name']}{sig['pair']}")
+            entry = float(sig['entry_price'] or 0)
+            if last and entry:
+                drift = abs(last - entry) / entry * 100.0
+                if drift > max_drift:
+                    db_manager.execute_query(
+                        "UPDATE trade_ops SET status='SKIPPED_DRIFT', notes=%s WHERE id=%s",
+                        (f"Drift {drift:.2f}% (last {last})", sig['id'])
+                    )
+                    continue
+        score = (sig.get('signal_age') or 0) + penalties.get(sig.get('signal_grade'), unknown_penalty)
+        ready.append((score, sig['id'], sig))
 
-            logging.info(f"🛒 Placing Buy {symbol} | P: {final_price} | Q: {final_qty}")
-            res = wallex_api.place_order(sig['wallex_api_key'], symbol, 'buy', final_price, final_qty)
+    ready.sort(key=lambda r: (r[0], r[1]))
+    return [r[2] for r in ready]
 
-            if res and res.get('success'):
+def step_1_place_buy():
+    if exchange_paused():
+        # سیگنال‌ها در NEW_SIGNAL می‌مانند؛ فقط انقضای سن (بدون درخواست شبکه) اعمال می‌شود
+        expire_stale_signals()
+        return
+    resolve_pending_buys()
+    expire_stale_signals()
+
+    query = f"""SELECT t.*, a.wallex_api_key, a.user_telegram_id, a.trade_amount_tmn, a.trade_amount_usdt, 
+               a.max_trade_tmn, a.max_trade_usdt, {signal_age_sql('t.')} AS signal_age
+               FROM trade_ops t JOIN trading_accounts a ON t.account_id = a.account_id
+               WHERE t.status = 'NEW_SIGNAL' AND a.is_active = TRUE
+               AND (t.retry_at IS NULL OR t.retry_at <= NOW())"""
+
+    # موجودی هر کلید یکبار در این سیکل خوانده و با هر خرید به ترتیب اولویت رزرو می‌شود
+    funds = None
+    if config.BOT_SETTINGS.get("CHECK_FUNDS", True):
+        funds = balance_book.BalanceBook(wallex_api.get_balances, config.BOT_SETTINGS.get("FUNDS_MARGIN_PCT", 0.0))
+
+    # صفحه‌ها از تازه‌ترین سیگنال‌ها شروع می‌شوند؛ اولویت‌بندی داخل هر صفحه انجام می‌شود
+    for signals in _work("buy", query, newest_first=True).batches():
+        _place_buy_batch(prioritize_signals(signals), funds)
+
+def _place_buy_batch(signals, funds):
+    if not signals: return
+    if funds:
+        funds.load((s['wallex_api_key'] for s in signals), _get_send_pool())
+
+    # 1. اعتبارسنجی و ثبت شناسه سفارش در دیتابیس، قبل از ارسال
+    orders = []
+    for sig in signals:
+        try:
+            prepared = _prepare_buy(sig)
+            if not prepared: continue
+            _, _, _, cost = prepared
+            if funds and not funds.reserve(sig['wallex_api_key'], sig['pair'], cost):
+                have = funds.available(sig['wallex_api_key'], sig['pair'])
                 db_manager.execute_query(
-                    "UPDATE trade_ops SET status='BUY_IN_PROGRESS', buy_client_order_id=%s, invested_amount=%s, updated_at=NOW() WHERE id=%s", 
-                    (res['result']['clientOrderId'], budget, sig['id'])
+                    "UPDATE trade_ops SET status='SKIPPED_FUNDS', notes=%s WHERE id=%s",
+                    (f"Insufficient {sig['pair']}: {have:g} < {cost:g}", sig['id'])
                 )
-            else:
-                err = res.get('message') if res else 'API Error'
-                db_manager.execute_query("UPDATE trade_ops SET status='ERROR', notes=%s WHERE id=%s", (f"Buy Fail: {err}", sig['id']))
-        except Exception as e: logging.error(f"Step 1: {e}")
+                continue
+            cid = wallex_api.make_client_order_id(sig['id'], 'buy')
+            db_manager.execute_query(
+                "UPDATE trade_ops SET status='BUY_PENDING', buy_client_order_id=%s, invested_amount=%s, updated_at=NOW() WHERE id=%s",
+                (cid, cost, sig['id'])
+            )
+            orders.append((sig, cid) + prepared)
+        except Exception as e: logger.error("Step 1: %s", e)
+
+    if not orders: return
+
+    # 2. ارسال موازی (شناسه‌ها قطعی‌اند، پس تلاش مجدد امن است)
+    if len(orders) == 1:
+        results = [_send_buy(orders[0])]
+    else:
+        results = list(_get_send_pool().map(_send_buy, orders))
+
+    # 3. اعمال نتایج
+    for order, res in zip(orders, results):
+        try:
+            _apply_buy_result(order, res)
+        except Exception as e: logger.error("Step 1: %s", e)
 
 # ==============================================================================
 # Step 2: Check Buy Status
 # ==============================================================================
 def step_2_check_buy_fill():
-    query = """SELECT t.*, a.wallex_api_key, a.user_telegram_id 
+    if exchange_paused(): return
+    # سن سفارش با ساعت همین دیتابیس (updated_at هنگام ثبت سفارش تنظیم می‌شود)
+    query = """SELECT t.*, a.wallex_api_key, a.user_telegram_id,
+               TIMESTAMPDIFF(SECOND, COALESCE(t.updated_at, t.created_at), NOW()) AS order_age
                FROM trade_ops t JOIN trading_accounts a ON t.account_id=a.account_id 
                WHERE t.status='BUY_IN_PROGRESS'"""
-    orders = db_manager.execute_query(query, fetch='all')
-    if not orders: return
-
-    for o in orders:
-        try:
-            res = wallex_api.get_order_status(o['buy_client_order_id'], o['wallex_api_key'])
+    work = _work("buy_fill", query, due=lambda o: BUY_POLLS.due(o['id']))
+    for batch in work.batches():
+        # نمای قیمت بازار (با TTL) برای زمان‌بندی بررسی سفارش‌های این صفحه
+        wallex_api.refresh_market_snapshot()
+        for o in batch:
+            try:
+                res = wallex_api.get_order_status(o['buy_client_order_id'], o['wallex_api_key'])
             
-            if res and res.get('status') == 'FILLED':
-                raw_executed_qty = float(res.get('executedQty'))
-                # تلاش برای خواندن کارمزد (ممکن است API برنگرداند، پیش‌فرض ۰)
-                # در ورژن‌های جدید والکس گاهی فی را جدا کم می‌کند
-                # ما برای اطمینان، مقداری که "واقعا" اضافه شده را در نظر می‌گیریم اگر بشود
-                # اما اینجا فرض بر کسر فی از مقدار است
+                if res and res.get('status') == 'FILLED':
+                    BUY_POLLS.forget(o['id'])
+                    raw_executed_qty = float(res.get('executedQty'))
+                    # تلاش برای خواندن کارمزد (ممکن است API برنگرداند، پیش‌فرض ۰)
+                    # در ورژن‌های جدید والکس گاهی فی را جدا کم می‌کند
+                    # ما برای اطمینان، مقداری که "واقعا" اضافه شده را در نظر می‌گیریم اگر بشود
+                    # اما اینجا فرض بر کسر فی از مقدار است
                 
-                # برای سادگی و اطمینان از فروش، کمی پایین‌تر گرد می‌کنیم در مرحله بعد
-                net_quantity = raw_executed_qty
+                    # برای سادگی و اطمینان از فروش، کمی پایین‌تر گرد می‌کنیم در مرحله بعد
+                    net_quantity = raw_executed_qty
 
-                # ذخیره در دیتابیس
-                symbol = f"{o['asset_name']}{o['pair']}"
-                qty_prec, _ = wallex_api.get_precision(symbol)
-                final_sell_qty = wallex_api.format_quantity(net_quantity, qty_prec) # دوباره فرمت می‌کنیم که مطمئن شویم
+                    # ذخیره در دیتابیس
+                    symbol = f"{o['asset_name']}{o['pair']}"
+                    qty_prec, _ = wallex_api.get_precision(symbol)
+                    final_sell_qty = wallex_api.format_quantity(net_quantity, qty_prec) # دوباره فرمت می‌کنیم که مطمئن شویم
 
-                logging.info(f"✅ Buy Filled: {o['asset_name']} | Exec Qty: {final_sell_qty}")
+                    logger.info("✅ Buy Filled: %s | Exec Qty: %s", o['asset_name'], final_sell_qty)
                 
-                db_manager.execute_query(
-                    "UPDATE trade_ops SET status='BUY_FILLED', buy_quantity_executed=%s WHERE id=%s", 
-                    (final_sell_qty, o['id'])
-                )
-                send_telegram_alert(o['user_telegram_id'], f"✅ **خرید انجام شد**\n💎 {o['asset_name']}\n🔢 مقدار: `{final_sell_qty}`")
-        except Exception as e: logging.error(f"Step 2: {e}")
+                    db_manager.execute_query(
+                        f"UPDATE trade_ops SET status='BUY_FILLED', buy_quantity_executed=%s, {RESET_RETRY} WHERE id=%s",
+                        (final_sell_qty, o['id'])
+                    )
+                    send_telegram_alert(o['user_telegram_id'], f"✅ **خرید انجام شد**\n💎 {o['asset_name']}\n🔢 مقدار: `{final_sell_qty}`")
+                else:
+                    BUY_POLLS.schedule(o['id'], 'buy', o['entry_price'],
+                                       wallex_api.get_last_price(f"{o['asset_name']}{o['pair']}"), o['order_age'])
+            except Exception as e: logger.error("Step 2: %s", e)
+    if work.complete: BUY_POLLS.retain(work.ids)
 
 # ==============================================================================
 # Step 3: Place Sell Order
 # ==============================================================================
 def step_3_place_sell():
+    if exchange_paused(): return
     query = """SELECT t.*, a.wallex_api_key, a.user_telegram_id 
                FROM trade_ops t JOIN trading_accounts a ON t.account_id=a.account_id 
-               WHERE t.status='BUY_FILLED'"""
-    orders = db_manager.execute_query(query, fetch='all')
-    if not orders: return
-
-    for o in orders:
+               WHERE t.status='BUY_FILLED' AND (t.retry_at IS NULL OR t.retry_at <= NOW())"""
+    for o in _work("sell", query).rows():
         try:
             symbol = f"{o['asset_name']}{o['pair']}"
             sell_qty = float(o['buy_quantity_executed'])
@@ -137,79 +361,113 @@ def step_3_place_sell():
             
             _, price_prec = wallex_api.get_precision(symbol)
             sell_price = wallex_api.format_price(raw_price, price_prec)
+
+            sell_qty, limit_err, retryable = wallex_api.check_order_limits(symbol, 'sell', sell_price, sell_qty)
+            if limit_err:
+                # خطای باند قیمت گذراست و در سیکل بعد دوباره بررسی می‌شود
+                if retryable:
+                    db_manager.execute_query("UPDATE trade_ops SET notes=%s WHERE id=%s", (f"Sell Deferred: {limit_err}", o['id']))
+                    continue
+                # خطای دائمی (حداقل مقدار/ارزش): دارایی نزد ماست، پس ترید ERROR (پایان‌یافته و بایگانی) نمی‌شود؛
+                # در BUY_FILLED با فاصله نمایی می‌ماند و کاربر یکبار برای رسیدگی دستی خبر می‌شود
+                if not o.get('retry_count'):
+                    send_telegram_alert(o['user_telegram_id'], f"⚠️ **فروش قابل ثبت نیست**\n💎 {o['asset_name']}\n{limit_err}")
+                defer_trade(o, f"Sell Rejected: {limit_err}"[:250])
+                continue
             
-            logging.info(f"⬇️ Placing Sell {symbol} | P: {sell_price} | Q: {sell_qty}")
+            sid = wallex_api.make_client_order_id(o['id'], 'sell')
+            if o.get('sell_client_order_id'):
+                # تلاش قبلی بی‌پاسخ ماند: اگر سفارش با همین شناسه ثبت شده، دوباره ارسال نمی‌کنیم
+                status = wallex_api.get_order_status(sid, o['wallex_api_key'])
+                if status:
+                    db_manager.execute_query("UPDATE trade_ops SET status='SELL_IN_PROGRESS', notes='Sell Placed', updated_at=NOW() WHERE id=%s", (o['id'],))
+                    continue
+                if status is None:
+                    # وضعیت نامعلوم: ارسال دوباره تا پاسخ قطعی صرافی عقب می‌افتد
+                    defer_trade(o, "Sell Unconfirmed")
+                    continue
+            else:
+                db_manager.execute_query("UPDATE trade_ops SET sell_client_order_id=%s WHERE id=%s", (sid, o['id']))
+
+            logger.info("⬇️ Placing Sell %s | P: %s | Q: %s", symbol, sell_price, sell_qty)
             
-            res = wallex_api.place_order(o['wallex_api_key'], symbol, 'sell', sell_price, sell_qty)
+            res = wallex_api.place_order(o['wallex_api_key'], symbol, 'sell', sell_price, sell_qty, client_id=sid)
             
             if res and res.get('success'):
-                sid = res['result']['clientOrderId']
                 db_manager.execute_query(
-                    "UPDATE trade_ops SET status='SELL_IN_PROGRESS', sell_client_order_id=%s, notes='Sell Placed' WHERE id=%s", 
-                    (sid, o['id'])
+                    "UPDATE trade_ops SET status='SELL_IN_PROGRESS', notes='Sell Placed', updated_at=NOW() WHERE id=%s", 
+                    (o['id'],)
                 )
                 send_telegram_alert(o['user_telegram_id'], f"⬇️ **سفارش فروش ثبت شد**\n🎯 تارگت: `{sell_price}`")
             else:
                 err = res.get('message') if res else 'API Error'
-                logging.error(f"Sell Place Failed: {err}")
-                db_manager.execute_query("UPDATE trade_ops SET notes=%s WHERE id=%s", (f"Sell Place Fail: {err}", o['id']))
+                logger.error("Sell Place Failed: %s", err)
+                # دارایی خریده شده نزد ماست و ترید نباید ERROR شود؛ تلاش بعدی با فاصله نمایی
+                defer_trade(o, f"Sell Place Fail: {err}"[:250])
 
-        except Exception as e: logging.error(f"Step 3: {e}")
+        except Exception as e: logger.error("Step 3: %s", e)
 
 # ==============================================================================
 # Step 4: Check Sell Status (Profit) [این تابع گم شده بود]
 # ==============================================================================
 def step_4_check_sell_fill():
-    query = """SELECT t.*, a.wallex_api_key, a.user_telegram_id 
+    if exchange_paused(): return
+    query = """SELECT t.*, a.wallex_api_key, a.user_telegram_id,
+               TIMESTAMPDIFF(SECOND, COALESCE(t.updated_at, t.created_at), NOW()) AS order_age
                FROM trade_ops t JOIN trading_accounts a ON t.account_id=a.account_id 
                WHERE t.status='SELL_IN_PROGRESS'"""
-    orders = db_manager.execute_query(query, fetch='all')
-    if not orders: return
-
-    for o in orders:
-        try:
-            res = wallex_api.get_order_status(o['sell_client_order_id'], o['wallex_api_key'])
+    work = _work("sell_fill", query, due=lambda o: SELL_POLLS.due(o['id']))
+    for batch in work.batches():
+        # نمای قیمت بازار (با TTL) برای زمان‌بندی بررسی سفارش‌های این صفحه
+        wallex_api.refresh_market_snapshot()
+        for o in batch:
+            try:
+                res = wallex_api.get_order_status(o['sell_client_order_id'], o['wallex_api_key'])
             
-            if res and res.get('status') == 'FILLED':
-                # محاسبه درآمد کل (تومان یا تتر دریافتی)
-                revenue = res.get('cummulativeQuoteQty') or 0
+                if res and res.get('status') == 'FILLED':
+                    SELL_POLLS.forget(o['id'])
+                    # محاسبه درآمد کل (تومان یا تتر دریافتی)
+                    revenue = res.get('cummulativeQuoteQty') or 0
                 
-                logging.info(f"💰 Trade Completed: {o['asset_name']} | Rev: {revenue}")
+                    logger.info("💰 Trade Completed: %s | Rev: %s", o['asset_name'], revenue)
                 
-                db_manager.execute_query(
-                    "UPDATE trade_ops SET status='COMPLETED', sell_revenue=%s WHERE id=%s",
-                    (revenue, o['id'])
-                )
+                    db_manager.execute_query(
+                        "UPDATE trade_ops SET status='COMPLETED', sell_revenue=%s, updated_at=NOW() WHERE id=%s",
+                        (revenue, o['id'])
+                    )
                 
-                # محاسبه سود
-                profit = float(revenue) - float(o['invested_amount'])
-                icon = "🟢" if profit >= 0 else "🔴"
+                    # محاسبه سود
+                    profit = float(revenue) - float(o['invested_amount'])
+                    icon = "🟢" if profit >= 0 else "🔴"
                 
-                send_telegram_alert(o['user_telegram_id'], 
-                                    f"{icon} **معامله بسته شد**\n💎 {o['asset_name']}\n💰 دریافتی: `{revenue}`\n📊 سود/زیان: `{int(profit)}`")
+                    send_telegram_alert(o['user_telegram_id'], 
+                                        f"{icon} **معامله بسته شد**\n💎 {o['asset_name']}\n💰 دریافتی: `{revenue}`\n📊 سود/زیان: `{int(profit)}`")
+                else:
+                    SELL_POLLS.schedule(o['id'], 'sell', o['exit_price'],
+                                        wallex_api.get_last_price(f"{o['asset_name']}{o['pair']}"), o['order_age'])
 
-        except Exception as e: logging.error(f"Step 4: {e}")
+            except Exception as e: logger.error("Step 4: %s", e)
+    if work.complete: SELL_POLLS.retain(work.ids)
 
 # ==============================================================================
 # Step 5: Cleanup Stale Orders [این تابع هم گم شده بود]
 # ==============================================================================
 def step_5_cleanup():
-    # سفارشاتی که در وضعیت BUY_IN_PROGRESS مانده‌اند و زمان زیادی گذشته
+    # سفارشاتی که در وضعیت BUY_IN_PROGRESS (یا BUY_PENDING بی‌پاسخ) مانده‌اند و زمان زیادی گذشته
     query = """
     SELECT t.*, a.wallex_api_key 
     FROM trade_ops t
     JOIN trading_accounts a ON t.account_id = a.account_id
-    WHERE t.status = 'BUY_IN_PROGRESS' 
+    WHERE t.status IN ('BUY_IN_PROGRESS', 'BUY_PENDING') 
     AND t.updated_at < (NOW() - INTERVAL %s MINUTE)
     """
-    stale_orders = db_manager.execute_query(query, (TIMEOUT_MINUTES,), fetch='all')
-    
-    if not stale_orders: return
-
-    for order in stale_orders:
-        logging.warning(f"⏳ Order Timeout {order['id']}. Canceling...")
+    for order in _work("cleanup", query, (TIMEOUT_MINUTES,)).rows():
+        logger.warning("⏳ Order Timeout %s. Canceling...", order['id'])
         
         res = wallex_api.cancel_order(order['wallex_api_key'], order['buy_client_order_id'])
+        if res is None and exchange_paused():
+            # صرافی در دسترس نیست: سفارش ممکن است هنوز باز باشد، لغو در سیکل بعد دوباره امتحان می‌شود
+            continue
         
         # اگر کنسل شد یا ارور داد که وجود ندارد (یعنی شاید پر شده یا قبلا کنسل شده)
         # در هر صورت از حالت انتظار خارجش می‌کنیم
@@ -218,21 +476,174 @@ def step_5_cleanup():
             (order['id'],)
         )
 
+# ==============================================================================
+# Startup Reconciliation: همگام‌سازی یکجای سفارش‌های در جریان بعد از ری‌استارت
+# ==============================================================================
+INFLIGHT_STATUSES = ('BUY_PENDING', 'BUY_IN_PROGRESS', 'SELL_IN_PROGRESS')
+
+def _inflight_client_id(row):
+    return row['sell_client_order_id'] if row['status'] == 'SELL_IN_PROGRESS' else row['buy_client_order_id']
+
+def _fetch_account_snapshot(api_key):
+    """
+    سفارش‌های باز و معاملات اخیر یک حساب (دو درخواست به جای یک درخواست برای هر سفارش).
+    خروجی: (open_ids، fills: شناسه -> [مقدار، مبلغ])، یا None اگر هر کدام از دو درخواست خطا داد
+    (نبودن سفارش در لیست خطادار به معنی بسته شدنش نیست).
+    """
+    open_orders = wallex_api.get_open_orders(api_key)
+    if open_orders is None: return None
+    trades = wallex_api.get_recent_trades(api_key)
+    if trades is None: return None
+
+    open_ids = {o.get('clientOrderId') for o in open_orders}
+    fills = {}
+    for t in trades:
+        cid = t.get('clientOrderId')
+        if not cid: continue
+        qty = float(t.get('quantity') or 0)
+        quote = float(t.get('sum') or qty * float(t.get('price') or 0))
+        f = fills.setdefault(cid, [0.0, 0.0])
+        f[0] += qty
+        f[1] += quote
+    return open_ids, fills
+
+def _inflight_state(row, snapshot):
+    """('open'|'filled'|'missing'|None, qty, quote) از روی نمای یکجای حساب؛ None یعنی نامشخص"""
+    open_ids, fills = snapshot
+    cid = _inflight_client_id(row)
+    if not cid:
+        return None, 0, 0
+    if cid in open_ids:
+        return 'open', 0, 0
+    if cid in fills:
+        return ('filled',) + tuple(fills[cid])
+    return None, 0, 0
+
+def _state_from_status(res):
+    """مثل _inflight_state برای استعلام تکی؛ فقط پاسخ قطعی 404 یعنی 'missing'، خطا یعنی None"""
+    if res is wallex_api.ORDER_NOT_FOUND: return 'missing', 0, 0
+    if not res: return None, 0, 0
+    if res.get('status') == 'FILLED':
+        return 'filled', float(res.get('executedQty') or 0), float(res.get('cummulativeQuoteQty') or 0)
+    return 'open', 0, 0
+
+def reconcile_inflight():
+    """
+    قبل از حلقه اصلی: وضعیت همه سفارش‌های در جریان را به ازای هر کلید API یکجا از صرافی می‌خواند
+    و همه اصلاحات را در یک تراکنش اعمال می‌کند. فقط سفارش‌هایی که در نمای یکجا پیدا نشدند
+    جداگانه (و موازی) بررسی می‌شوند. سفارش‌های حسابی که نمایش خطا داد، یا استعلامشان خطا داد،
+    دست نمی‌خورند و به بررسی عادی سیکل‌ها سپرده می‌شوند.
+    """
+    placeholders = ", ".join(["%s"] * len(INFLIGHT_STATUSES))
+    query = f"""SELECT t.*, a.wallex_api_key, a.user_telegram_id
+                FROM trade_ops t JOIN trading_accounts a ON t.account_id = a.account_id
+                WHERE t.status IN ({placeholders})"""
+    rows = db_manager.execute_query(query, INFLIGHT_STATUSES, fetch='all')
+    if not rows: return 0
+
+    started = clock.get_clock().time()
+    pool = _get_send_pool()
+    keys = list({r['wallex_api_key'] for r in rows})
+    snapshots = dict(zip(keys, pool.map(_fetch_account_snapshot, keys)))
+
+    states = {}
+    unresolved = []
+    skipped = 0
+    for r in rows:
+        snapshot = snapshots[r['wallex_api_key']]
+        if snapshot is None:
+            skipped += 1
+            continue
+        state = _inflight_state(r, snapshot)
+        if state[0] is None:
+            unresolved.append(r)
+        else:
+            states[r['id']] = state
+    if unresolved:
+        results = pool.map(lambda r: wallex_api.get_order_status(_inflight_client_id(r), r['wallex_api_key']), unresolved)
+        for r, res in zip(unresolved, results):
+            state = _state_from_status(res)
+            if state[0] is None:
+                skipped += 1
+            else:
+                states[r['id']] = state
+
+    statements, alerts = [], []
+    for r in rows:
+        if r['id'] not in states: continue
+        state, qty, quote = states[r['id']]
+        status = r['status']
+        if state == 'filled' and status in ('BUY_PENDING', 'BUY_IN_PROGRESS'):
+            qty_prec, _ = wallex_api.get_precision(f"{r['asset_name']}{r['pair']}")
+            qty = wallex_api.format_quantity(qty, qty_prec)
+            statements.append((f"UPDATE trade_ops SET status='BUY_FILLED', buy_quantity_executed=%s, {RESET_RETRY} WHERE id=%s AND status=%s",
+                               (qty, r['id'], status)))
+            alerts.append((r['user_telegram_id'], f"✅ **خرید انجام شد**\n💎 {r['asset_name']}\n🔢 مقدار: `{qty}`"))
+        elif state == 'filled':
+            statements.append(("UPDATE trade_ops SET status='COMPLETED', sell_revenue=%s, updated_at=NOW() WHERE id=%s AND status=%s",
+                               (quote, r['id'], status)))
+            profit = quote - float(r['invested_amount'] or 0)
+            icon = "🟢" if profit >= 0 else "🔴"
+            alerts.append((r['user_telegram_id'],
+                           f"{icon} **معامله بسته شد**\n💎 {r['asset_name']}\n💰 دریافتی: `{quote}`\n📊 سود/زیان: `{int(profit)}`"))
+        elif status == 'BUY_PENDING':
+            # مثل resolve_pending_buys: اگر سفارش هست پیگیری می‌شود، اگر صرافی نبودنش را تأیید کرد
+            # با همان شناسه دوباره ارسال می‌شود
+            if state == 'open':
+                statements.append((f"UPDATE trade_ops SET status='BUY_IN_PROGRESS', {RESET_RETRY}, updated_at=NOW() WHERE id=%s AND status='BUY_PENDING'",
+                                   (r['id'],)))
+            else:
+                statements.append(("UPDATE trade_ops SET status='NEW_SIGNAL', updated_at=NOW() WHERE id=%s AND status='BUY_PENDING'",
+                                   (r['id'],)))
+
+    if statements and db_manager.execute_transaction(statements) is None:
+        logger.error("Reconciliation batch failed; falling back to regular polling.")
+        return 0
+    for user_id, message in alerts:
+        send_telegram_alert(user_id, message)
+
+    logger.info("🔁 Reconciled %d in-flight orders (%d accounts, %d single lookups, %d corrections, %d skipped) in %.1fs",
+                len(rows), len(keys), len(unresolved), len(statements), skipped, clock.get_clock().time() - started)
+    return len(statements)
+
 # ==============================================================================
 # Main Loop
 # ==============================================================================
+def run_cycle():
+    """یک دور کامل از تمام مراحل (برای حلقه اصلی و موتور بازپخش)"""
+    global _step_deadline
+    steps = (step_1_place_buy, step_2_check_buy_fill, step_3_place_sell,
+             step_4_check_sell_fill, step_5_cleanup)
+    budget = config.BATCHING.get("CYCLE_BUDGET_SECONDS", 0)
+    cycle_deadline = time.monotonic() + budget if budget else None
+
+    # یک اتصال (و prepared statement های مشترک) برای کل سیکل
+    with PROFILER.cycle(), db_manager.unit_of_work():
+        for i, step in enumerate(steps):
+            # هر مرحله سهم مساوی از باقی‌مانده بودجه دارد؛ وقت استفاده نشده به مراحل بعد می‌رسد
+            if cycle_deadline:
+                now = time.monotonic()
+                _step_deadline = now + max(cycle_deadline - now, 0) / (len(steps) - i)
+            try:
+                with PROFILER.step(step.__name__):
+                    step()
+            finally:
+                _step_deadline = None
+
 def run_executor():
-    logging.info("🚀 Executor V14 (Fee Deduction) Started...")
+    logger.info("🚀 Executor V14 (Fee Deduction) Started...")
+    profiler.install_signal()
     wallex_api.update_market_info()
+    if config.BOT_SETTINGS.get("RECONCILE_ON_START", True):
+        try:
+            reconcile_inflight()
+        except Exception as e: logger.error("Reconciliation Error: %s", e)
     while True:
         try:
-            step_1_place_buy()
-            step_2_check_buy_fill()
-            step_3_place_sell()
-            step_4_check_sell_fill() # الان این تابع تعریف شده است
-            step_5_cleanup()         # الان این تابع تعریف شده است
-        except Exception as e: logging.error(f"Loop Error: {e}")
-        time.sleep(config.BOT_SETTINGS["CHECK_INTERVAL"])
+            run_cycle()
+        except Exception as e: logger.error("Loop Error: %s", e)
+        clock.sleep(config.BOT_SETTINGS["CHECK_INTERVAL"])
 
 if __name__ == "__main__":
+    db_manager.ensure_schema()
     run_executor()
@@ -0,0 +1,171 @@
+# fake_bot_api.py
+# جایگزین محلی Bot API تلگرام برای تست آفلاین بات (webhook و polling) و تست بار.
+# فقط متدهایی که بات استفاده می‌کند با پاسخ‌های حداقلی معتبر شبیه‌سازی شده‌اند.
+#
+# استفاده:
+#   python fake_bot_api.py --port 8081
+#   و در config.TELEGRAM: "API_BASE_URL": "http://127.0.0.1:8081/bot"
+
+import argparse
+import email.parser
+import itertools
+import json
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "FakeBot", "username": "fake_multitrade_bot"}
+
+
+def _parse_params(content_type, body):
+    if not body: return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        msg = email.parser.BytesParser().parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        params = {}
+        for part in msg.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                params[name] = {"filename": part.get_filename(), "size": len(part.get_payload(decode=True) or b"")}
+            else:
+                params[name] = (part.get_payload(decode=True) or b"").decode()
+        return params
+    return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+
+class FakeBotAPI:
+    """
+    سرور HTTP در ترد پس‌زمینه. تمام فراخوانی‌ها در calls ثبت می‌شوند.
+    push_update آپدیت را به webhook ثبت شده (با توکن مخفی) می‌فرستد، یا اگر
+    webhook ثبت نشده باشد برای getUpdates صف می‌کند.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8081, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls = []
+        self.webhook = None
+        self.pending = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    def method_counts(self):
+        counts = {}
+        with self._lock:
+            for m, _ in self.calls:
+                counts[m] = counts.get(m, 0) + 1
+        return counts
+
+    def _message(self, params):
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text") or "",
+        }
+
+    def handle(self, method, params):
+        with self._lock:
+            self.calls.append((method, params))
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == "getMe":
+            return BOT_USER
+        if method == "setWebhook":
+            self.webhook = (params.get("url"), params.get("secret_token"))
+            return True
+        if method == "deleteWebhook":
+            self.webhook = None
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook[0] if self.webhook else "", "has_custom_certificate": False,
+                    "pending_update_count": 0}
+        if method == "getUpdates":
+            with self._lock:
+                updates, self.pending = self.pending, []
+            if not updates:
+                time.sleep(min(float(params.get("timeout") or 0), 1.0))
+            return updates
+        if method in ("sendMessage", "sendDocument", "editMessageReplyMarkup", "editMessageText"):
+            return self._message(params)
+        return True
+
+    def push_update(self, update):
+        """ارسال یک آپدیت (dict) به بات"""
+        if not self.webhook:
+            with self._lock:
+                self.pending.append(update)
+            return 200
+        url, secret = self.webhook
+        req = urllib.request.Request(url, data=json.dumps(update).encode(), method="POST",
+                                     headers={"Content-Type": "application/json"})
+        if secret:
+            req.add_header("X-Telegram-Bot-Api-Secret-Token", secret)
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return resp.status
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self):
+                # مسیر: /bot<token>/<method>
+                method = self.path.rstrip("/").split("/")[-1].split("?")[0]
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                try:
+                    result = api.handle(method, _parse_params(self.headers.get("Content-Type", ""), body))
+                    payload = {"ok": True, "result": result}
+                except Exception as e:
+                    payload = {"ok": False, "error_code": 400, "description": str(e)}
+                data = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="FakeBotAPI", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.host, args.port).start()
+    print(f"Fake Bot API on {api.base_url}<token>/<method> (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        api.stop()
@@ -0,0 +1,176 @@
+# log_manager.py
+# لاگ غیرمسدودکننده: تردهای ترید فقط رکورد را در صف می‌گذارند و یک ترد پس‌زمینه
+# آن را روی دیسک/کنسول می‌نویسد. کندی دیسک دیگر به حلقه ترید نمی‌رسد.
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+import config
+
+_listener = None
+_lock = threading.Lock()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    محدودسازی و نمونه‌برداری لاگ‌های پرتکرار (فقط زیر سطح WARNING).
+    - نمونه‌برداری: از پیام‌هایی که با پیشوندهای SAMPLING شروع می‌شوند فقط ۱ از هر N.
+    - محدودیت نرخ: برای هر logger حداکثر RATE_LIMIT_PER_SEC رکورد در ثانیه.
+    """
+
+    def __init__(self, sampling=None, rate_limit=0):
+        super().__init__()
+        self.sampling = dict(sampling or {})
+        self.rate_limit = rate_limit
+        self._counters = {}
+        self._windows = {}
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        # کلید نمونه‌برداری، قالب پیام است (نه متن نهایی) تا آرگومان‌ها ساخته نشوند
+        msg = record.msg if isinstance(record.msg, str) else ""
+        for prefix, every in self.sampling.items():
+            if every > 1 and msg.startswith(prefix):
+                n = self._counters.get(prefix, 0)
+                self._counters[prefix] = n + 1
+                if n % every:
+                    self.dropped += 1
+                    return False
+                record.sampled = every
+                break
+
+        if self.rate_limit > 0:
+            now = int(time.monotonic())
+            win = self._windows.get(record.name)
+            if not win or win[0] != now:
+                win = [now, 0]
+                self._windows[record.name] = win
+            win[1] += 1
+            if win[1] > self.rate_limit:
+                self.dropped += 1
+                return False
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    فیلدهای ساخت‌یافته از طریق extra={'fields': {...}} به رکورد اضافه می‌شوند.
+    در حالت متنی به صورت key=value و در حالت JSON به صورت یک شیء کامل نوشته می‌شوند.
+    """
+
+    def __init__(self, fmt=None, as_json=False):
+        super().__init__(fmt)
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        if self.as_json:
+            doc = {
+                "ts": self.formatTime(record),
+                "level": record.levelname,
+                "logger": record.name,
+                "thread": record.threadName,
+                "msg": record.getMessage(),
+            }
+            doc.update(fields)
+            if getattr(record, 'sampled', None):
+                doc["sampled"] = record.sampled
+            if record.exc_info:
+                doc["exc"] = self.formatException(record.exc_info)
+            return json.dumps(doc, ensure_ascii=False, default=str)
+
+        line = super().format(record)
+        if fields:
+            line += " | " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    در ترد فراخواننده هیچ فرمت‌کردنی انجام نمی‌شود؛ رکورد همان‌طور در صف می‌رود
+    (صف درون‌پردازه‌ای است و نیاز به pickle ندارد). اگر صف پر باشد رکورد دور ریخته
+    می‌شود تا ترد ترید هرگز منتظر لاگ نماند.
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=None):
+    """
+    پیکربندی لاگ کل پروسه (یکبار). هندلرهای قبلی روت (مثلاً basicConfig ماژول‌ها)
+    حذف و با هندلر صف جایگزین می‌شوند.
+    """
+    global _listener
+    with _lock:
+        if _listener:
+            return _listener
+
+        cfg = getattr(config, 'LOGGING', {})
+        level = level or config.BOT_SETTINGS.get("LOG_LEVEL", "INFO")
+
+        formatter = StructuredFormatter(
+            cfg.get("FORMAT", "%(asctime)s - %(levelname)s - %(message)s"),
+            as_json=cfg.get("JSON", False)
+        )
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            cfg.get("FILE", "bot_log.log"),
+            maxBytes=cfg.get("MAX_BYTES", 10 * 1024 * 1024),
+            backupCount=cfg.get("BACKUP_COUNT", 5),
+            encoding="utf-8"
+        )
+        file_handler.setFormatter(formatter)
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(formatter)
+
+        q = queue.Queue(maxsize=cfg.get("QUEUE_SIZE", 10000))
+        queue_handler = NonBlockingQueueHandler(q)
+        queue_handler.addFilter(SamplingFilter(
+            cfg.get("SAMPLING"), cfg.get("RATE_LIMIT_PER_SEC", 0)
+        ))
+
+        root = logging.getLogger()
+        for h in root.handlers[:]:
+            root.removeHandler(h)
+            h.close()
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(
+            q, file_handler, console_handler, respect_handler_level=True
+        )
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return _listener
+
+
+def shutdown_logging():
+    """تخلیه صف و بستن فایل‌ها (در خروج برنامه صدا زده می‌شود)"""
+    global _listener
+    with _lock:
+        if not _listener:
+            return
+        _listener.stop()
+        for h in _listener.handlers:
+            h.close()
+        _listener = None
@@ -1,28 +1,36 @@
 # main.py
+# اجرای کل سیستم یا فقط یک جزء آن در یک پروسه جداگانه:
+#   python main.py                 همه اجزا (Reader/Executor/Archiver در ترد + بات در ترد اصلی)
+#   python main.py executor        فقط حلقه ترید (بدون pandas/xlsxwriter/telegram)
+#   python main.py reader | bot | archiver | snapshot
+#   python main.py --import-times  زمان ایمپورت هر جزء در یک مفسر تازه
+import argparse
+import subprocess
+import sys
 import threading
 import time
 import logging
-import sys
 
 # ایمپورت کردن ماژول‌های پروژه
-import signal_reader
-import executor
-import telegram_bot
-
-# تنظیمات لاگ کلی
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - [MASTER] - %(message)s',
-    handlers=[
-        logging.FileHandler("bot_log.log"), # ذخیره لاگ در فایل
-        logging.StreamHandler(sys.stdout)   # نمایش در کنسول
-    ]
-)
+# ماژول‌های هر جزء فقط هنگام اجرای همان جزء ایمپورت می‌شوند تا پروسه‌های تک‌جزئی سبک بمانند
+import config
+import log_manager
+import profiler
+
+# ماژول اصلی هر جزء (برای اندازه‌گیری زمان ایمپورت)
+COMPONENT_MODULES = {
+    "reader": "signal_reader",
+    "executor": "executor",
+    "archiver": "archiver",
+    "snapshot": "market_snapshot",
+    "bot": "telegram_bot",
+}
 
 def run_signal_reader():
     """اجرای ماژول خواندن سیگنال"""
     try:
         logging.info("Starting Signal Reader...")
+        import signal_reader
         signal_reader.distribute_signals()
     except Exception as e:
         logging.critical(f"Signal Reader Crashed: {e}")
@@ -31,31 +39,129 @@ def run_executor():
     """اجرای ماژول ترید"""
     try:
         logging.info("Starting Executor...")
+        import executor
         executor.run_executor()
     except Exception as e:
         logging.critical(f"Executor Crashed: {e}")
 
+def run_archiver():
+    """اجرای بایگانی/پاکسازی پس‌زمینه"""
+    try:
+        logging.info("Starting Archiver...")
+        import archiver
+        archiver.run_archiver()
+    except Exception as e:
+        logging.critical(f"Archiver Crashed: {e}")
+
+def run_market_snapshot():
+    """اجرای تازه‌ساز اسنپ‌شات مشترک بازار (یک دریافت برای همه پروسه‌ها)"""
+    try:
+        logging.info("Starting Market Snapshot Refresher...")
+        import market_snapshot
+        market_snapshot.run_refresher()
+    except Exception as e:
+        logging.critical(f"Market Snapshot Refresher Crashed: {e}")
+
 def run_telegram():
     """اجرای بات تلگرام (باید در ترد اصلی یا جداگانه باشد)"""
     try:
         logging.info("Starting Telegram Bot...")
+        import telegram_bot
         telegram_bot.run_bot()
     except Exception as e:
         logging.critical(f"Telegram Bot Crashed: {e}")
 
-if __name__ == "__main__":
+COMPONENTS = {
+    "reader": run_signal_reader,
+    "executor": run_executor,
+    "archiver": run_archiver,
+    "snapshot": run_market_snapshot,
+    "bot": run_telegram,
+}
+
+def measure_import_times(top=5):
+    """
+    زمان ایمپورت هر جزء در یک مفسر تازه (با -X importtime) و سنگین‌ترین ایمپورت‌های مستقیم آن.
+    ایمپورت هیچ جزئی به دیتابیس وصل نمی‌شود، پس این اندازه‌گیری بدون دیتابیس هم کار می‌کند.
+    """
+    for name, module in COMPONENT_MODULES.items():
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              capture_output=True, text=True)
+        wall = time.perf_counter() - started
+        if proc.returncode != 0:
+            print(f"{name:<9} FAILED: {proc.stderr.strip().splitlines()[-1]}")
+            continue
+
+        # هر خط: "import time: self [us] | cumulative | <تورفتگی به اندازه عمق>module"
+        # هر ماژول بعد از زیرماژول‌هایش چاپ می‌شود؛ ایمپورت‌های مستقیم جزء فقط خطوط عمق ۳ همان بلوکی
+        # هستند که درست قبل از خط خود جزء آمده (ایمپورت‌های شروع مفسر و site بیرون این بلوک‌اند)
+        total, children, block = 0, [], []
+        for line in proc.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) != 3 or not parts[1].strip().isdigit(): continue
+            cumulative, raw = int(parts[1]), parts[2]
+            depth = len(raw) - len(raw.lstrip())
+            if depth == 1:
+                if raw.strip() == module:
+                    total, children = cumulative, block
+                block = []
+            elif depth == 3:
+                block.append((cumulative, raw.strip()))
+
+        print(f"{name:<9} import {total / 1000:8.1f} ms   (process {wall * 1000:.0f} ms)")
+        for us, mod in sorted(children, reverse=True)[:top]:
+            print(f"          {us / 1000:8.1f} ms  {mod}")
+
+def run_all():
     logging.info("--- System Starting Up ---")
 
+    # سیگنال روشن/خاموش کردن پروفایلر فقط از ترد اصلی قابل نصب است
+    profiler.install_signal()
+
     # 1. ساخت ترد برای Reader
     t_reader = threading.Thread(target=run_signal_reader, name="ReaderThread", daemon=True)
-    
+
     # 2. ساخت ترد برای Executor
     t_executor = threading.Thread(target=run_executor, name="ExecutorThread", daemon=True)
 
-    # 3. شروع تردها
+    # 3. ساخت ترد برای Archiver
+    t_archiver = threading.Thread(target=run_archiver, name="ArchiverThread", daemon=True)
+
+    # 4. ساخت ترد برای تازه‌ساز اسنپ‌شات بازار (فقط اگر فعال باشد)
+    t_snapshot = threading.Thread(target=run_market_snapshot, name="SnapshotThread", daemon=True)
+
+    # 5. شروع تردها
+    if config.MARKET_SNAPSHOT.get("ENABLED"):
+        t_snapshot.start()
     t_reader.start()
     t_executor.start()
+    t_archiver.start()
 
-    # 4. اجرای تلگرام در ترد اصلی (چون run_polling مسدودکننده است)
+    # 6. اجرای تلگرام در ترد اصلی (چون run_polling مسدودکننده است)
     # وقتی تلگرام بسته شود، کل برنامه بسته می‌شود
     run_telegram()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-account trading system")
+    parser.add_argument("component", nargs="?", default="all", choices=["all"] + list(COMPONENTS))
+    parser.add_argument("--import-times", action="store_true", help="measure import time of each component and exit")
+    args = parser.parse_args()
+
+    if args.import_times:
+        measure_import_times()
+        sys.exit(0)
+
+    # تنظیمات لاگ کلی: صف غیرمسدودکننده + فایل چرخشی (جایگزین FileHandler همزمان)
+    # basicConfig ماژول‌هایی که بعداً ایمپورت می‌شوند اثری ندارد چون روت هندلر دارد
+    log_manager.setup_logging()
+
+    # مهاجرت اسکیما یکبار و قبل از شروع هر ترد/جزء (بررسی-سپس-ALTER در تردهای همزمان تداخل دارد)
+    import db_manager
+    db_manager.ensure_schema()
+
+    if args.component == "all":
+        run_all()
+    else:
+        profiler.install_signal()
+        COMPONENTS[args.component]()
@@ -0,0 +1,193 @@
+# market_snapshot.py
+# اسنپ‌شات مشترک اطلاعات بازار (دقت، محدودیت‌ها و قیمت آخر) بین پروسه‌ها.
+# - فقط یک تازه‌ساز (python main.py snapshot یا ترد آن در حالت all) لیست بازارها را از والکس
+#   می‌گیرد و آن را به صورت باینری فشرده با رکوردهای هم‌اندازه و مرتب روی فایل می‌نویسد.
+# - خواننده‌ها (reader/executor/bot) فایل را mmap می‌کنند و هر نماد را با جستجوی دودویی مستقیماً
+#   از حافظه مشترک می‌خوانند: بدون دانلود/پارس JSON، بدون کپی کل لیست و بدون قفل.
+# - نوشتن با فایل موقت + os.replace انجام می‌شود؛ خواننده‌ای که نسخه قبلی را map کرده تا بازکردن
+#   نسخه جدید همان را (سالم و کامل) می‌بیند. تغییر inode یعنی نسخه جدید منتشر شده است.
+#
+# قالب فایل (little-endian):
+#   هدر:  magic(4) | format_version(u16) | record_size(u16) | generation(u64) | fetched_at(f64) | count(u32) | pad(4)
+#   رکورد: symbol(20, ascii) | qty_prec(i8) | price_prec(i8) | min_qty, max_qty, min_notional,
+#          min_price, max_price, last_price (f64؛ NaN = نامعلوم)
+
+import logging
+import math
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+
+import config
+import clock
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"WXMS"
+FORMAT_VERSION = 1
+SYMBOL_LEN = 20
+HEADER = struct.Struct("<4sHHQdI4x")
+RECORD = struct.Struct(f"<{SYMBOL_LEN}sbb6d")
+LIMIT_FIELDS = ("min_qty", "max_qty", "min_notional", "min_price", "max_price", "last_price")
+
+_view = None    # آخرین نمای باز شده در این پروسه (تا تغییر inode دوباره map نمی‌شود)
+
+
+def enabled():
+    return config.MARKET_SNAPSHOT.get("ENABLED", False)
+
+
+def snapshot_path():
+    return config.MARKET_SNAPSHOT.get("PATH", "/dev/shm/multi_trade_markets.snap")
+
+
+# ==============================================================================
+# Writer
+# ==============================================================================
+def _read_generation(path):
+    try:
+        with open(path, "rb") as f:
+            magic, version, _, generation, _, _ = HEADER.unpack(f.read(HEADER.size))
+        return generation if magic == MAGIC else 0
+    except (OSError, struct.error):
+        return 0
+
+
+def write_snapshot(markets, path=None, fetched_at=None):
+    """
+    markets: {symbol: {"qty_prec", "price_prec", "min_qty", ..., "last_price"}} (خروجی wallex_api.fetch_markets)
+    خروجی: شماره نسل (generation) اسنپ‌شات نوشته شده.
+    """
+    path = path or snapshot_path()
+    fetched_at = fetched_at if fetched_at is not None else clock.get_clock().time()
+
+    records = []
+    for symbol, info in markets.items():
+        raw = symbol.encode("ascii", "ignore")
+        if len(raw) > SYMBOL_LEN or not raw:
+            logger.warning("Symbol %r does not fit the snapshot record, skipped.", symbol)
+            continue
+        limits = [info.get(k) for k in LIMIT_FIELDS]
+        records.append((raw, int(info["qty_prec"]), int(info["price_prec"]),
+                        [math.nan if v is None else float(v) for v in limits]))
+    # مرتب بر اساس بایت‌های نماد (همان ترتیبی که خواننده با آن جستجوی دودویی می‌کند)
+    records.sort(key=lambda r: r[0])
+
+    generation = _read_generation(path) + 1
+    buf = bytearray(HEADER.size + RECORD.size * len(records))
+    HEADER.pack_into(buf, 0, MAGIC, FORMAT_VERSION, RECORD.size, generation, fetched_at, len(records))
+    for i, (raw, qty_p, prc_p, limits) in enumerate(records):
+        RECORD.pack_into(buf, HEADER.size + i * RECORD.size, raw, qty_p, prc_p, *limits)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(buf)
+    os.replace(tmp, path)
+    return generation
+
+
+def run_refresher():
+    """حلقه تازه‌ساز: هر MARKET_SNAPSHOT_TTL ثانیه یک درخواست برای همه بازارها، برای همه پروسه‌ها"""
+    import wallex_api
+
+    interval = config.POLLING.get("MARKET_SNAPSHOT_TTL", 10)
+    logger.info("🗺 Market snapshot refresher writing %s every %ss", snapshot_path(), interval)
+    while True:
+        try:
+            markets = wallex_api.fetch_markets()
+            if markets:
+                generation = write_snapshot(markets)
+                logger.debug("Market snapshot #%d: %d pairs", generation, len(markets))
+        except Exception as e:
+            logger.error("Market snapshot refresh failed: %s", e)
+        clock.sleep(interval)
+
+
+# ==============================================================================
+# Reader
+# ==============================================================================
+class SnapshotView(Mapping):
+    """
+    نمای فقط‌خواندنی روی فایل map شده؛ مثل dict کش بازار رفتار می‌کند (get، in، len، items).
+    هر get فقط همان یک رکورد را از حافظه مشترک decode می‌کند.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.generation, self.fetched_at, self._count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD.size:
+            raise ValueError(f"Unsupported market snapshot format (version {version})")
+        if len(self._mm) < HEADER.size + self._count * RECORD.size:
+            raise ValueError("Truncated market snapshot")
+
+    def _symbol_at(self, i):
+        off = HEADER.size + i * RECORD.size
+        return self._mm[off:off + SYMBOL_LEN].rstrip(b"\0")
+
+    def _find(self, raw):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._symbol_at(mid) < raw:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self._count and self._symbol_at(lo) == raw else -1
+
+    def _record(self, i):
+        _, qty_p, prc_p, *limits = RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+        info = {"qty_prec": qty_p, "price_prec": prc_p}
+        for k, v in zip(LIMIT_FIELDS, limits):
+            info[k] = None if math.isnan(v) else v
+        return info
+
+    def __getitem__(self, symbol):
+        i = self._find(symbol.encode("ascii", "ignore")) if isinstance(symbol, str) else -1
+        if i < 0: raise KeyError(symbol)
+        return self._record(i)
+
+    def __contains__(self, symbol):
+        return isinstance(symbol, str) and self._find(symbol.encode("ascii", "ignore")) >= 0
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._symbol_at(i).decode("ascii")
+
+    def __len__(self):
+        return self._count
+
+    def last_prices(self):
+        """{symbol: last_price} برای همه بازارهایی که قیمت دارند (فقط ستون نماد و قیمت خوانده می‌شود)"""
+        prices = {}
+        price_off = RECORD.size - 8
+        for i in range(self._count):
+            off = HEADER.size + i * RECORD.size
+            (price,) = struct.unpack_from("<d", self._mm, off + price_off)
+            if not math.isnan(price):
+                prices[self._mm[off:off + SYMBOL_LEN].rstrip(b"\0").decode("ascii")] = price
+        return prices
+
+
+def open_view(max_age=None):
+    """
+    نمای آخرین اسنپ‌شات منتشر شده، یا None اگر فایلی نیست یا قدیمی‌تر از max_age است
+    (تازه‌ساز در حال اجرا نیست؛ فراخواننده خودش مستقیم از API می‌خواند).
+    """
+    global _view
+    path = snapshot_path()
+    try:
+        inode = os.stat(path).st_ino
+        if _view is None or _view.inode != inode:
+            # نمای قبلی بسته نمی‌شود؛ تردهایی که هنوز آن را دارند تا آزاد شدن با GC از آن می‌خوانند
+            _view = SnapshotView(path)
+    except (OSError, ValueError, struct.error) as e:
+        logger.debug("Market snapshot unavailable: %s", e)
+        return None
+
+    max_age = max_age if max_age is not None else config.MARKET_SNAPSHOT.get("MAX_AGE_SECONDS", 60)
+    if clock.get_clock().time() - _view.fetched_at > max_age:
+        return None
+    return _view
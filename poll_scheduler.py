@@ -0,0 +1,59 @@
+# poll_scheduler.py
+# زمان‌بندی تطبیقی بررسی وضعیت سفارش‌ها: سفارش‌های نزدیک به قیمت بازار زیاد و
+# سفارش‌های دور (مثلاً فروش با تارگت ۲۰٪ بالاتر) کم بررسی می‌شوند.
+
+import config
+import clock
+
+
+class PollScheduler:
+    """
+    زمان بررسی بعدی هر سفارش را در حافظه نگه می‌دارد (کلید: شناسه ترید).
+    سن سفارش از خود ردیف دیتابیس می‌آید (نه از اولین دیده شدن در این پروسه)، پس بعد از
+    ری‌استارت زمان‌بندی سفارش‌های قدیمی از نو «تازه» حساب نمی‌شود.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._next = {}
+
+    def due(self, trade_id):
+        return clock.get_clock().time() >= self._next.get(trade_id, 0)
+
+    def schedule(self, trade_id, side, limit_price, last_price, age_seconds):
+        """تعیین زمان بررسی بعدی بر اساس سن سفارش (ثانیه، از ردیف دیتابیس) و فاصله قیمت آن از بازار"""
+        interval = next_interval(side, limit_price, last_price, age_seconds or 0)
+        self._next[trade_id] = clock.get_clock().time() + interval
+        return interval
+
+    def forget(self, trade_id):
+        self._next.pop(trade_id, None)
+
+    def retain(self, trade_ids):
+        """حذف سفارش‌هایی که دیگر در لیست کار نیستند (پر/لغو شده از مسیر دیگر)"""
+        keep = set(trade_ids)
+        for tid in [t for t in self._next if t not in keep]:
+            self.forget(tid)
+
+
+def next_interval(side, limit_price, last_price, age_seconds):
+    cfg = config.POLLING
+    base = config.BOT_SETTINGS["CHECK_INTERVAL"]
+    max_interval = cfg.get("MAX_INTERVAL", 60)
+
+    if age_seconds < cfg.get("FRESH_ORDER_SECONDS", 30):
+        return base
+    if not last_price or not limit_price:
+        return base
+
+    limit_price = float(limit_price)
+    last_price = float(last_price)
+    # سفارشی که قیمت بازار به آن رسیده یا از آن گذشته، هر سیکل بررسی می‌شود
+    if (side == 'buy' and last_price <= limit_price) or (side == 'sell' and last_price >= limit_price):
+        return base
+
+    distance_pct = abs(limit_price - last_price) / last_price * 100.0
+    near = cfg.get("NEAR_DISTANCE_PCT", 0.5)
+    interval = base * max(1.0, distance_pct / near)
+    interval *= 1.0 + (age_seconds / 60.0) / cfg.get("AGE_SCALE_MINUTES", 30)
+    return min(interval, max_interval)
@@ -0,0 +1,140 @@
+# profiler.py
+# پروفایلر درجا برای سیکل‌های executor و signal_reader، بدون ری‌استارت.
+# - روشن/خاموش با config.PROFILER["ENABLED"] یا در حین اجرا با سیگنال (پیش‌فرض SIGUSR1).
+# - در حالت روشن هر سیکل با cProfile اجرا می‌شود و زمان هر مرحله جدا ثبت می‌شود؛
+#   فقط K سیکل کندتر نگه داشته می‌شوند (فایل .prof برای snakeviz/pstats + خلاصه .txt).
+# - در حالت خاموش هزینه فقط یک بررسی bool است و context manager خالی برگردانده می‌شود.
+
+import contextlib
+import cProfile
+import heapq
+import io
+import itertools
+import logging
+import os
+import pstats
+import signal
+import threading
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_NULL = contextlib.nullcontext()
+_enabled = bool(config.PROFILER.get("ENABLED", False))
+_seq = itertools.count()
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(value):
+    global _enabled
+    _enabled = bool(value)
+    logger.warning("🩺 Cycle profiler %s", "ON" if _enabled else "OFF")
+
+
+def toggle(*_):
+    set_enabled(not _enabled)
+
+
+def install_signal():
+    """هندلر سیگنال فقط از ترد اصلی قابل نصب است (main.py یا اجرای مستقیم ماژول)"""
+    name = config.PROFILER.get("TOGGLE_SIGNAL", "SIGUSR1")
+    sig = getattr(signal, name, None) if name else None
+    if sig is None or threading.current_thread() is not threading.main_thread():
+        return False
+    signal.signal(sig, toggle)
+    logger.info("🩺 Cycle profiler: send %s to pid %d to toggle", name, os.getpid())
+    return True
+
+
+class CycleProfiler:
+    """
+    پروفایلر یک حلقه (مثلاً executor). استفاده:
+        with PROFILER.cycle():
+            with PROFILER.step("step_1"): ...
+    مراحل هم‌نام در یک سیکل جمع می‌شوند (مثلاً همه کوئری‌های تکراری).
+    """
+
+    def __init__(self, name, keep=None, out_dir=None):
+        self.name = name
+        self.keep = keep if keep is not None else config.PROFILER.get("KEEP_SLOWEST", 5)
+        self.out_dir = out_dir or config.PROFILER.get("DIR", "profiles")
+        self._slowest = []          # min-heap از (مدت، شماره، مسیر فایل بدون پسوند)
+        self._local = threading.local()
+
+    def step(self, name):
+        if not _enabled or getattr(self._local, "steps", None) is None:
+            return _NULL
+        return self._step(name)
+
+    @contextlib.contextmanager
+    def _step(self, name):
+        steps = self._local.steps
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            steps[name] = steps.get(name, 0.0) + time.perf_counter() - t0
+
+    def cycle(self):
+        if not _enabled:
+            return _NULL
+        return self._cycle()
+
+    @contextlib.contextmanager
+    def _cycle(self):
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # پروفایلر دیگری فعال است (مثلاً اجرا زیر py-spy/cProfile بیرونی)؛ فقط زمان مراحل
+            prof = None
+        self._local.steps = {}
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            if prof: prof.disable()
+            steps, self._local.steps = self._local.steps, None
+            try:
+                self._record(elapsed, steps, prof)
+            except Exception as e:
+                logger.error("Profiler dump failed: %s", e)
+
+    def _record(self, elapsed, steps, prof):
+        if len(self._slowest) >= self.keep and elapsed <= self._slowest[0][0]:
+            return
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.out_dir, f"{self.name}_{stamp}_{int(elapsed * 1000)}ms_{next(_seq)}")
+
+        lines = [f"cycle: {self.name}", f"total: {elapsed * 1000:.1f} ms", "", "steps:"]
+        for step_name, dur in sorted(steps.items(), key=lambda kv: -kv[1]):
+            lines.append(f"  {step_name:<28} {dur * 1000:10.1f} ms  {dur / elapsed * 100 if elapsed else 0:5.1f}%")
+        if prof:
+            prof.dump_stats(base + ".prof")
+            buf = io.StringIO()
+            pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(config.PROFILER.get("TOP_FUNCTIONS", 30))
+            lines += ["", buf.getvalue()]
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+        entry = (elapsed, next(_seq), base)
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, entry)
+        else:
+            _, _, evicted = heapq.heapreplace(self._slowest, entry)
+            for ext in (".prof", ".txt"):
+                with contextlib.suppress(OSError):
+                    os.remove(evicted + ext)
+        logger.info("🩺 Slow %s cycle kept: %.1f ms -> %s.txt", self.name, elapsed * 1000, base)
+
+    def slowest(self):
+        """لیست (مدت، مسیر) از کندترین به سریع‌ترین"""
+        return [(e[0], e[2]) for e in sorted(self._slowest, reverse=True)]
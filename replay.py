@@ -0,0 +1,296 @@
+# replay.py
+# بازپخش سیگنال‌های تاریخی با ساعت شتاب‌دار روی یک موتور تطبیق شبیه‌سازی شده.
+# برای برنامه‌ریزی ظرفیت: چند حساب / چند سیگنال در دقیقه / چند سفارش باز را یک استقرار تحمل می‌کند.
+#
+# استفاده:
+#   python replay.py signals.csv prices.csv [--speed 100] [--accounts 50]
+#
+# signals.csv: خروجی جدول signal_pool با ستون‌های
+#   signal_time, coin, pair, strategy_name, signal_grade, entry_price, target_price
+# prices.csv: قیمت‌های ثبت شده با ستون‌های time, symbol, price
+# زمان‌ها UTC فرض می‌شوند.
+
+import argparse
+import bisect
+import csv
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+
+import config
+import clock
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_ts(value):
+    return datetime.fromisoformat(value.strip()).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _percentile(values, p):
+    if not values: return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * p))]
+
+
+# ==============================================================================
+# Simulated Matching Engine
+# ==============================================================================
+class SimulatedExchange:
+    """
+    جایگزین توابع سفارش wallex_api. سفارش لیمیت خرید وقتی قیمت ثبت شده به
+    زیر/روی قیمت سفارش برسد پر می‌شود و فروش وقتی به بالا/روی آن برسد.
+    """
+
+    def __init__(self, prices_path):
+        self.ticks = []          # (ts, symbol, price) مرتب بر اساس زمان
+        with open(prices_path, newline='') as f:
+            for row in csv.DictReader(f):
+                self.ticks.append((_parse_ts(row['time']), row['symbol'], float(row['price'])))
+        self.ticks.sort(key=lambda t: t[0])
+        self.tick_ts = [t[0] for t in self.ticks]
+        self.symbols = {t[1] for t in self.ticks}
+        self.cursor = 0
+        self.last = {}
+        self.orders = {}
+        self.open_by_symbol = {}
+        self.not_found = None    # wallex_api.ORDER_NOT_FOUND (در install تنظیم می‌شود)
+        self.stats = {"placed": 0, "rejected": 0, "filled": 0, "canceled": 0,
+                      "status_calls": 0, "peak_open": 0, "alerts": 0}
+
+    def first_ts(self):
+        return self.ticks[0][0] if self.ticks else None
+
+    def on_tick(self, now_ts):
+        """مصرف قیمت‌ها تا زمان فعلی و تطبیق سفارش‌های باز"""
+        end = bisect.bisect_right(self.tick_ts, now_ts, lo=self.cursor)
+        touched = set()
+        for _, symbol, price in self.ticks[self.cursor:end]:
+            self.last[symbol] = price
+            touched.add(symbol)
+        self.cursor = end
+        for symbol in touched:
+            self._match(symbol)
+
+    def _match(self, symbol):
+        price = self.last.get(symbol)
+        open_ids = self.open_by_symbol.get(symbol)
+        if price is None or not open_ids: return
+        for oid in list(open_ids):
+            o = self.orders[oid]
+            crossed = price <= o['price'] if o['side'] == 'BUY' else price >= o['price']
+            if crossed:
+                o['status'] = 'FILLED'
+                o['executedQty'] = o['quantity']
+                o['cummulativeQuoteQty'] = o['quantity'] * o['price']
+                open_ids.discard(oid)
+                self.stats['filled'] += 1
+
+    def _open_count(self):
+        return sum(len(v) for v in self.open_by_symbol.values())
+
+    # --- امضای توابع برابر با wallex_api ---
+
+    def validate_api_key(self, api_key):
+        return True
+
+    def place_order(self, api_key, symbol, side, price, quantity, client_id=None):
+        if symbol not in self.symbols:
+            self.stats['rejected'] += 1
+            return {"success": False, "message": f"market {symbol} not found"}
+        if client_id in self.orders:
+            self.stats['rejected'] += 1
+            return {"success": False, "message": "duplicate client_id"}
+        oid = client_id or uuid.uuid4().hex
+        self.orders[oid] = {"symbol": symbol, "side": side.upper(), "price": float(price),
+                            "quantity": float(quantity), "status": "NEW",
+                            "executedQty": 0, "cummulativeQuoteQty": 0}
+        self.open_by_symbol.setdefault(symbol, set()).add(oid)
+        self.stats['placed'] += 1
+        self._match(symbol)
+        self.stats['peak_open'] = max(self.stats['peak_open'], self._open_count())
+        return {"success": True, "result": {"clientOrderId": oid}}
+
+    def get_order_status(self, client_id, api_key):
+        self.stats['status_calls'] += 1
+        o = self.orders.get(client_id)
+        if not o: return self.not_found
+        return {"status": o['status'], "executedQty": o['executedQty'],
+                "cummulativeQuoteQty": o['cummulativeQuoteQty']}
+
+    def get_balances(self, api_key):
+        # موجودی در شبیه‌سازی نامحدود است (None = نامعلوم، خرید مسدود نمی‌شود)
+        return None
+
+    def cancel_order(self, api_key, client_id):
+        o = self.orders.get(client_id)
+        if not o or o['status'] != 'NEW': return None
+        o['status'] = 'CANCELED'
+        self.open_by_symbol.get(o['symbol'], set()).discard(client_id)
+        self.stats['canceled'] += 1
+        return {"success": True}
+
+    def install(self, wallex_api, executor):
+        """اتصال موتور به ماژول‌های واقعی (فقط در پروسه بازپخش)"""
+        qty_p = config.REPLAY.get("QTY_PRECISION", 4)
+        prc_p = config.REPLAY.get("PRICE_PRECISION", 2)
+
+        def update_market_info():
+            wallex_api.MARKET_INFO_CACHE.clear()
+            for s in self.symbols:
+                wallex_api.MARKET_INFO_CACHE[s] = {"qty_prec": qty_p, "price_prec": prc_p,
+                                                   "last_price": self.last.get(s)}
+            return True
+
+        def send_alert(user_id, message):
+            self.stats['alerts'] += 1
+
+        self.not_found = wallex_api.ORDER_NOT_FOUND
+        wallex_api.update_market_info = update_market_info
+        wallex_api.validate_api_key = self.validate_api_key
+        wallex_api.place_order = self.place_order
+        wallex_api.get_order_status = self.get_order_status
+        wallex_api.cancel_order = self.cancel_order
+        wallex_api.get_balances = self.get_balances
+        executor.send_telegram_alert = send_alert
+        update_market_info()
+
+
+# ==============================================================================
+# Replay Driver
+# ==============================================================================
+def load_signals(path):
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    for r in rows:
+        r['_ts'] = _parse_ts(r['signal_time'])
+    rows.sort(key=lambda r: r['_ts'])
+    return rows
+
+
+def prepare_databases(db_manager, accounts):
+    """پاکسازی دیتابیس‌های بازپخش و ساخت حساب‌های مصنوعی"""
+    db_manager.ensure_schema()
+    db_manager.execute_query("DELETE FROM signal_pool", use_signal_db=True)
+    db_manager.execute_query("DELETE FROM trade_ops")
+    db_manager.execute_query("DELETE FROM trading_accounts")
+    for i in range(accounts):
+        db_manager.execute_query(
+            """INSERT INTO trading_accounts
+            (user_telegram_id, account_name, mobile_number, email, wallex_api_key,
+             max_trade_tmn, max_trade_usdt, trade_amount_tmn, trade_amount_usdt,
+             allowed_strategies, allowed_grades, is_active)
+            VALUES (%s, %s, %s, %s, %s, 0, 0, %s, %s, 'ALL', 'ALL', TRUE)""",
+            (900000 + i, f"replay_{i}", "09000000000", f"replay{i}@local", f"replay-key-{i}",
+             config.REPLAY.get("BUDGET_TMN", 0), config.REPLAY.get("BUDGET_USDT", 0))
+        )
+
+
+def feed_signals(db_manager, signals, start_idx, now_ts):
+    """سیگنال‌هایی که زمانشان رسیده را به جدول signal_pool بازپخش اضافه می‌کند"""
+    i = start_idx
+    while i < len(signals) and signals[i]['_ts'] <= now_ts:
+        s = signals[i]
+        db_manager.execute_query(
+            """INSERT INTO signal_pool
+            (signal_time, coin, pair, strategy_name, signal_grade, entry_price, target_price)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+            (s['signal_time'], s['coin'], s['pair'], s.get('strategy_name') or None,
+             s.get('signal_grade') or None, s['entry_price'], s['target_price']),
+            use_signal_db=True
+        )
+        i += 1
+    return i
+
+
+def run_replay(signals_path, prices_path, speed=None, accounts=None):
+    # قبل از ایمپورت db_manager، دیتابیس‌ها به نسخه بازپخش اشاره کنند
+    config.INTERNAL_DB = config.REPLAY["INTERNAL_DB"]
+    config.SIGNAL_POOL_DB = config.REPLAY["SIGNAL_POOL_DB"]
+    import db_manager
+    import wallex_api
+    import executor
+    import signal_reader
+
+    signals = load_signals(signals_path)
+    exchange = SimulatedExchange(prices_path)
+    if not signals or exchange.first_ts() is None:
+        logger.error("Replay input is empty.")
+        return None
+
+    start_ts = min(signals[0]['_ts'], exchange.first_ts())
+    end_ts = max(signals[-1]['_ts'], exchange.ticks[-1][0])
+    sim = clock.SimulatedClock(start_ts, speed=speed)
+    sim.on_advance(exchange.on_tick)
+    clock.set_clock(sim)
+
+    exchange.install(wallex_api, executor)
+    accounts = accounts if accounts is not None else config.REPLAY.get("ACCOUNTS", 10)
+    prepare_databases(db_manager, accounts)
+
+    interval = config.BOT_SETTINGS["CHECK_INTERVAL"]
+    reader_times, executor_times = [], []
+    fed = 0
+    real_start = time.perf_counter()
+
+    logger.info("⏪ Replay: %d signals, %d ticks, %d accounts, speed=%s",
+                len(signals), len(exchange.ticks), accounts, speed or "max")
+
+    exchange.on_tick(sim.time())
+    while sim.time() <= end_ts:
+        fed = feed_signals(db_manager, signals, fed, sim.time())
+
+        t0 = time.perf_counter()
+        signal_reader.distribute_once()
+        t1 = time.perf_counter()
+        executor.run_cycle()
+        t2 = time.perf_counter()
+
+        reader_times.append(t1 - t0)
+        executor_times.append(t2 - t1)
+        sim.sleep(interval)
+
+    sim_minutes = max((end_ts - start_ts) / 60.0, 1e-9)
+    cycle_times = [r + e for r, e in zip(reader_times, executor_times)]
+    report = {
+        "accounts": accounts,
+        "signals": len(signals),
+        "signals_per_min": len(signals) / sim_minutes,
+        "cycles": len(cycle_times),
+        "cycle_p50": _percentile(cycle_times, 0.50),
+        "cycle_p99": _percentile(cycle_times, 0.99),
+        "cycle_max": max(cycle_times) if cycle_times else 0,
+        "reader_p99": _percentile(reader_times, 0.99),
+        "executor_p99": _percentile(executor_times, 0.99),
+        # اگر زمان واقعی یک سیکل از CHECK_INTERVAL بیشتر شود، استقرار زنده عقب می‌افتد
+        "utilization_p99": _percentile(cycle_times, 0.99) / interval,
+        "wall_seconds": time.perf_counter() - real_start,
+    }
+    report.update(exchange.stats)
+    return report
+
+
+def print_report(report):
+    print("\n=== Replay Capacity Report ===")
+    for k, v in report.items():
+        print(f"{k:>18}: {v:.4f}" if isinstance(v, float) else f"{k:>18}: {v}")
+    if report["utilization_p99"] >= 1:
+        print("⚠️ p99 cycle time exceeds CHECK_INTERVAL: this load is NOT sustainable.")
+    else:
+        print("✅ Load is sustainable within CHECK_INTERVAL.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Replay historical signals at accelerated speed")
+    parser.add_argument("signals")
+    parser.add_argument("prices")
+    parser.add_argument("--speed", type=float, default=config.REPLAY.get("SPEED"),
+                        help="clock acceleration factor (0 = as fast as possible)")
+    parser.add_argument("--accounts", type=int, default=None)
+    args = parser.parse_args()
+
+    result = run_replay(args.signals, args.prices, speed=args.speed or None, accounts=args.accounts)
+    if result:
+        print_report(result)
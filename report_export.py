@@ -0,0 +1,161 @@
+# report_export.py
+# خروجی جریانی تاریخچه معاملات برای حساب‌های پرحجم:
+# کرسر بدون بافر + تکه‌های ثابت + xlsxwriter در حالت constant_memory (یا CSV فشرده).
+# حافظه مصرفی مستقل از طول تاریخچه ثابت می‌ماند.
+
+import csv
+import gzip
+import os
+from datetime import datetime
+
+import config
+import archiver
+import db_manager
+from analytics import CLOSED_STATUSES, OPEN_STATUSES, TRADE_COLUMNS
+
+HISTORY_HEADER = ['Asset', 'Pair', 'Date', 'Invested', 'Revenue', 'Profit']
+
+
+def _filter(user_id, account_id):
+    acc_filter = "AND ta.deleted_at IS NULL" + (" AND ta.account_id = %s" if account_id != "all" else "")
+    params = [user_id]
+    if account_id != "all":
+        params.append(account_id)
+    return acc_filter, params
+
+
+def _closed_source(user_id, account_id):
+    """تریدهای بسته ممکن است بایگانی شده باشند؛ تریدهای باز همیشه در جدول داغ‌اند"""
+    return archiver.trades_source(TRADE_COLUMNS, user_id, account_id, CLOSED_STATUSES)
+
+
+def _status_clause(statuses):
+    return "ts.status IN (" + ", ".join(["%s"] * len(statuses)) + ")"
+
+
+def count_closed_trades(user_id, account_id):
+    source, params = _closed_source(user_id, account_id)
+    res = db_manager.execute_query(f"SELECT COUNT(*) AS cnt FROM {source} ts", params, fetch='one')
+    return int(res['cnt']) if res else 0
+
+
+def iter_history_rows(user_id, account_id):
+    """ردیف‌های شیت History به صورت تکه‌تکه (هر ردیف مطابق HISTORY_HEADER)"""
+    source, params = _closed_source(user_id, account_id)
+    query = f"""
+        SELECT ts.asset_name, ts.pair, ts.created_at, ts.invested_amount, ts.sell_revenue
+        FROM {source} ts
+        ORDER BY ts.id
+    """
+    chunk = config.REPORT.get("CHUNK_SIZE", 2000)
+    for _, rows in db_manager.iter_chunks(query, params, chunk):
+        out = []
+        for asset, pair, created, inv, rev in rows:
+            inv = float(inv or 0)
+            rev = float(rev or 0)
+            out.append((asset, pair, str(created), inv, rev, rev - inv))
+        yield out
+
+
+def summary_rows(user_id, account_id):
+    """خلاصه هر حساب/پیر با تجمیع سمت سرور (بدون آوردن ردیف‌ها به پایتون)"""
+    source, params = _closed_source(user_id, account_id)
+    rows = db_manager.execute_query(
+        f"""SELECT ta.account_name, ts.pair, COUNT(*) AS trades,
+                   SUM(ts.invested_amount) AS invested, SUM(ts.sell_revenue) AS revenue,
+                   SUM(ts.sell_revenue - ts.invested_amount) AS pnl,
+                   100 * AVG(ts.sell_revenue > ts.invested_amount) AS win_rate,
+                   AVG(TIMESTAMPDIFF(MINUTE, ts.created_at, ts.updated_at)) AS avg_hold_minutes
+            FROM {source} ts JOIN trading_accounts ta ON ts.account_id = ta.account_id
+            GROUP BY ta.account_name, ts.pair""",
+        params, fetch='all'
+    ) or []
+    header = ['Account', 'Pair', 'Trades', 'Invested', 'Revenue', 'PnL', 'Win Rate %', 'Avg Hold (min)']
+    return header, [
+        (r['account_name'], r['pair'], r['trades'], float(r['invested'] or 0), float(r['revenue'] or 0),
+         float(r['pnl'] or 0), float(r['win_rate'] or 0), float(r['avg_hold_minutes'] or 0))
+        for r in rows
+    ]
+
+
+def active_rows(user_id, account_id, live_prices):
+    acc_filter, params = _filter(user_id, account_id)
+    rows = db_manager.execute_query(
+        f"""SELECT ts.asset_name, ts.pair, ts.invested_amount, ts.buy_quantity_executed
+            FROM trade_ops ts JOIN trading_accounts ta ON ts.account_id = ta.account_id
+            WHERE ta.user_telegram_id = %s {acc_filter} AND {_status_clause(OPEN_STATUSES)}""",
+        tuple(params) + OPEN_STATUSES, fetch='all'
+    ) or []
+    header = ['Asset', 'Pair', 'Qty', 'Invested', 'Current Price', 'Current Value', 'PnL']
+    out = []
+    for row in rows:
+        curr = live_prices.get(f"{row['asset_name']}{row['pair']}", 0)
+        qty = float(row['buy_quantity_executed'] or 0)
+        inv = float(row['invested_amount'] or 0)
+        out.append((row['asset_name'], row['pair'], qty, inv, curr, qty * curr, qty * curr - inv))
+    return header, out
+
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def export_xlsx(user_id, account_id, live_prices_fn):
+    """گزارش اکسل با xlsxwriter در حالت constant_memory (هر ردیف بلافاصله روی دیسک می‌رود)"""
+    import xlsxwriter
+
+    path = f"/tmp/Report_{user_id}_{int(datetime.now().timestamp())}.xlsx"
+    wb = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        # در حالت constant_memory ردیف‌ها باید به ترتیب نوشته شوند
+        ws = wb.add_worksheet('History')
+        ws.write_row(0, 0, HISTORY_HEADER)
+        r = 1
+        for chunk in iter_history_rows(user_id, account_id):
+            for row in chunk:
+                ws.write_row(r, 0, row)
+                r += 1
+
+        header, rows = active_rows(user_id, account_id, live_prices_fn())
+        if rows:
+            ws = wb.add_worksheet('Active Trades')
+            ws.write_row(0, 0, header)
+            for i, row in enumerate(rows, 1):
+                ws.write_row(i, 0, row)
+
+        header, rows = summary_rows(user_id, account_id)
+        ws = wb.add_worksheet('Summary')
+        ws.write_row(0, 0, header)
+        for i, row in enumerate(rows, 1):
+            ws.write_row(i, 0, row)
+    except Exception:
+        # خطای دیتابیس وسط جریان: فایل ناقص به عنوان گزارش کامل فرستاده نمی‌شود
+        wb.close()
+        _discard(path)
+        raise
+    wb.close()
+    return path
+
+
+def export_csv_gz(user_id, account_id):
+    """تاریخچه به صورت CSV فشرده (سبک‌ترین حالت، بدون شیت‌های جانبی)"""
+    path = f"/tmp/Report_{user_id}_{int(datetime.now().timestamp())}.csv.gz"
+    try:
+        with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow(HISTORY_HEADER)
+            for chunk in iter_history_rows(user_id, account_id):
+                w.writerows(chunk)
+    except Exception:
+        _discard(path)
+        raise
+    return path
+
+
+def export_history(user_id, account_id, live_prices_fn):
+    if config.REPORT.get("STREAMING_FORMAT", "xlsx") == "csv.gz":
+        return export_csv_gz(user_id, account_id)
+    return export_xlsx(user_id, account_id, live_prices_fn)
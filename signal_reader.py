@@ -1,12 +1,51 @@
 # signal_reader.py
 # نسخه اصلاح شده: حل مشکل تایم‌زون با استفاده از زمان خود دیتابیس
 
-import time
 import logging
 import config
 import db_manager
+import clock
+import profiler
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+PROFILER = profiler.CycleProfiler("reader")
+
+# تریدهای پایان‌یافته مانع سیگنال جدید روی همان دارایی/استراتژی نیستند (مقادیر با %s بایند می‌شوند)
+TERMINAL_STATUSES = db_manager.TERMINAL_STATUSES
+TERMINAL_IN = db_manager.placeholders(len(TERMINAL_STATUSES))
+
+# پخش سمت سرور: همان فیلترهای حلقه پایتونی (استراتژی، گرید، بودجه، تکراری) در یک INSERT ... SELECT.
+# ROW_NUMBER جای «اولین سیگنال، بقیه را ترید باز همان سیگنال مسدود می‌کند» در حلقه پایتونی است،
+# چون MySQL نتیجه SELECT روی trade_ops را قبل از درج کامل می‌سازد و درج‌های همین دستور را نمی‌بیند.
+FANOUT_SQL = """
+    INSERT INTO trade_ops
+    (account_id, asset_name, pair, entry_price, exit_price, strategy_name, signal_grade, signal_time,
+     signal_lag_seconds, status)
+    SELECT account_id, coin, pair, entry_price, target_price, strategy, signal_grade, signal_time,
+           signal_lag, 'NEW_SIGNAL'
+    FROM (
+        SELECT a.account_id, s.coin, s.pair, s.entry_price, s.target_price, s.strategy, s.signal_grade, s.signal_time,
+               s.signal_lag,
+               ROW_NUMBER() OVER (PARTITION BY a.account_id, s.coin, s.pair, s.strategy
+                                  ORDER BY s.signal_time) AS rn
+        FROM (SELECT p.coin, p.pair, p.entry_price, p.target_price, p.signal_grade, p.signal_time,
+                     COALESCE(p.strategy_name, 'Unknown') AS strategy,
+                     TIMESTAMPDIFF(SECOND, p.signal_time, NOW()) AS signal_lag
+              FROM `{signal_db}`.signal_pool p
+              WHERE p.signal_time >= (NOW() - INTERVAL %s MINUTE)) s
+        JOIN trading_accounts a ON a.is_active = TRUE
+        WHERE (COALESCE(a.allowed_strategies, '') IN ('', 'ALL') OR FIND_IN_SET(s.strategy, a.allowed_strategies))
+          AND (COALESCE(a.allowed_grades, '') IN ('', 'ALL') OR FIND_IN_SET(s.signal_grade, a.allowed_grades))
+          AND (CASE WHEN s.pair = 'TMN' THEN a.trade_amount_tmn ELSE a.trade_amount_usdt END) > 0
+          AND NOT EXISTS (
+              SELECT 1 FROM trade_ops t
+              WHERE t.account_id = a.account_id AND t.asset_name = s.coin AND t.pair = s.pair
+                AND t.strategy_name = s.strategy
+                AND (t.status NOT IN ({terminal}) OR t.signal_time = s.signal_time))
+    ) c
+    WHERE rn = 1
+"""
 
 def fetch_signals():
     """خواندن سیگنال‌های جدید با استفاده از زمان سرور دیتابیس"""
@@ -19,7 +58,7 @@ def fetch_signals():
         # "سیگنال‌های X دقیقه اخیر" را بده. اینطوری تایم‌زون پایتون و دیتابیس مهم نیست.
         
         query = """
-            SELECT * FROM signal_pool 
+            SELECT *, TIMESTAMPDIFF(SECOND, signal_time, NOW()) AS signal_lag FROM signal_pool 
             WHERE signal_time >= (NOW() - INTERVAL %s MINUTE)
             ORDER BY signal_time ASC
         """
@@ -30,89 +69,141 @@ def fetch_signals():
         signals = cursor.fetchall()
         
         if signals:
-            logging.info(f"Fetched {len(signals)} signals from DB")
+            logger.info("Fetched %d signals from DB", len(signals))
             
         return signals
 
     except Exception as e:
-        logging.error(f"Error reading pool: {e}")
+        logger.error("Error reading pool: %s", e)
         return []
     finally:
         conn.close()
 
+def fanout_server_side():
+    """
+    پخش سیگنال‌ها کاملاً داخل MySQL (وقتی signal_pool و multi_trade روی یک سرور هستند):
+    یک دستور سیگنال‌های اخیر را به حساب‌های واجد شرایط join و در trade_ops درج می‌کند.
+    خروجی: شناسه تریدهای درج شده.
+    """
+    unit = db_manager.current_unit()
+    if unit is None:
+        logger.error("Server-side fan-out needs a database connection.")
+        return []
+
+    lookback = config.BOT_SETTINGS.get("SIGNAL_LOOKBACK_MINUTES", 5)
+    query = FANOUT_SQL.format(signal_db=config.SIGNAL_POOL_DB['database'], terminal=TERMINAL_IN)
+    with db_manager.unit_of_work(transactional=True):
+        if db_manager.execute_query(query, (lookback,) + TERMINAL_STATUSES) is None:
+            return []
+        res = db_manager.execute_query("SELECT LAST_INSERT_ID() AS first_id, ROW_COUNT() AS inserted", fetch='one')
+        if not res or not res['inserted']:
+            return []
+        # فقط همین پروسه در trade_ops درج می‌کند، پس ردیف‌های بعد از اولین شناسه همین درج هستند
+        # (با innodb_autoinc_lock_mode=2 شناسه‌ها لزوماً پشت سر هم نیستند)
+        rows = db_manager.execute_query(
+            "SELECT id FROM trade_ops WHERE id >= %s ORDER BY id LIMIT %s",
+            (res['first_id'], res['inserted']), fetch='all'
+        ) or []
+
+    ids = [r['id'] for r in rows]
+    if ids:
+        logger.info("✅ Queued %d trades server-side (ids %s..%s)", len(ids), ids[0], ids[-1])
+    return ids
+
+def distribute_once():
+    """یک دور خواندن و پخش سیگنال‌ها بین حساب‌های فعال"""
+    with PROFILER.cycle(), db_manager.unit_of_work():
+        _distribute_once()
+
+def _distribute_once():
+    if config.SIGNAL_FANOUT.get("SERVER_SIDE"):
+        with PROFILER.step("server_fanout"):
+            fanout_server_side()
+        return
+
+    with PROFILER.step("fetch_signals"):
+        signals = fetch_signals()
+
+    if signals:
+        # دریافت کاربران فعال
+        with PROFILER.step("load_accounts"):
+            active_accounts = db_manager.execute_query(
+                "SELECT * FROM trading_accounts WHERE is_active = TRUE",
+                fetch='all'
+            )
+
+        if active_accounts:
+            for sig in signals:
+                asset = sig['coin']
+                pair = sig['pair']
+                strategy = sig.get('strategy_name') or 'Unknown'
+                grade = sig.get('signal_grade')
+
+                # لاگ پیدا شدن سیگنال (جهت اطمینان از دیده شدن)
+                logger.info("🔎 Signal Found: %s/%s (%s)", asset, pair, strategy)
+
+                for acc in active_accounts:
+                    # 1. فیلتر استراتژی
+                    allowed_strats = acc.get('allowed_strategies', '')
+                    if allowed_strats and allowed_strats != 'ALL':
+                        if strategy not in allowed_strats.split(','):
+                            continue 
+
+                    # 2. فیلتر گرید
+                    allowed_grades = acc.get('allowed_grades', '')
+                    if allowed_grades and allowed_grades != 'ALL':
+                        if grade not in allowed_grades.split(','):
+                            continue 
+
+                    # 3. بررسی بودجه
+                    budget = acc['trade_amount_tmn'] if pair == 'TMN' else acc['trade_amount_usdt']
+                    if budget <= 0:
+                        continue
+
+                    # 4. بررسی تکراری (ترید باز، یا همین سیگنال که قبلاً رد/منقضی شده)
+                    with PROFILER.step("dedupe_check"):
+                        exists = db_manager.execute_query(
+                            f"""
+                            SELECT id FROM trade_ops 
+                            WHERE account_id=%s AND asset_name=%s AND pair=%s AND strategy_name=%s
+                            AND (status NOT IN ({TERMINAL_IN})
+                                 OR signal_time = %s)
+                            """,
+                            (acc['account_id'], asset, pair, strategy) + TERMINAL_STATUSES + (sig.get('signal_time'),),
+                            fetch='one'
+                        )
+
+                    if not exists:
+                        with PROFILER.step("insert_trade"):
+                            db_manager.execute_query(
+                                """
+                                INSERT INTO trade_ops 
+                                (account_id, asset_name, pair, entry_price, exit_price, strategy_name,
+                                 signal_grade, signal_time, signal_lag_seconds, status)
+                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'NEW_SIGNAL')
+                                """,
+                                (acc['account_id'], asset, pair, sig['entry_price'], sig['target_price'], strategy,
+                                 grade, sig.get('signal_time'), sig.get('signal_lag'))
+                            )
+                        logger.info("✅ Queued: %s/%s -> User %s", asset, pair, acc['account_name'])
+
+        else:
+            # اگر سیگنال هست ولی کاربر فعال نیست، این لاگ کمک میکنه بفهمیم
+            if signals:
+                logger.warning("⚠️ Signals found but NO ACTIVE ACCOUNTS detected.")
+
 def distribute_signals():
-    logging.info("📡 Signal Reader Engine Started (Timezone Fix Applied)...")
+    logger.info("📡 Signal Reader Engine Started (Timezone Fix Applied)...")
+    profiler.install_signal()
     
     while True:
         try:
-            signals = fetch_signals()
-            
-            if signals:
-                # دریافت کاربران فعال
-                active_accounts = db_manager.execute_query(
-                    "SELECT * FROM trading_accounts WHERE is_active = TRUE",
-                    fetch='all'
-                )
-                
-                if active_accounts:
-                    for sig in signals:
-                        asset = sig['coin']
-                        pair = sig['pair']
-                        strategy = sig.get('strategy_name') or 'Unknown'
-                        grade = sig.get('signal_grade')
-
-                        # لاگ پیدا شدن سیگنال (جهت اطمینان از دیده شدن)
-                        logging.info(f"🔎 Signal Found: {asset}/{pair} ({strategy})")
-
-                        for acc in active_accounts:
-                            # 1. فیلتر استراتژی
-                            allowed_strats = acc.get('allowed_strategies', '')
-                            if allowed_strats and allowed_strats != 'ALL':
-                                if strategy not in allowed_strats.split(','):
-                                    continue 
-
-                            # 2. فیلتر گرید
-                            allowed_grades = acc.get('allowed_grades', '')
-                            if allowed_grades and allowed_grades != 'ALL':
-                                if grade not in allowed_grades.split(','):
-                                    continue 
-
-                            # 3. بررسی بودجه
-                            budget = acc['trade_amount_tmn'] if pair == 'TMN' else acc['trade_amount_usdt']
-                            if budget <= 0:
-                                continue
-
-                            # 4. بررسی تکراری
-                            exists = db_manager.execute_query(
-                                """
-                                SELECT id FROM trade_ops 
-                                WHERE account_id=%s AND asset_name=%s AND pair=%s AND strategy_name=%s
-                                AND status NOT IN ('SELL_ORDER_FILLED', 'CANCELED_TIMEOUT', 'ERROR', 'SKIPPED_CIRCUIT_BREAKER')
-                                """,
-                                (acc['account_id'], asset, pair, strategy),
-                                fetch='one'
-                            )
-                            
-                            if not exists:
-                                db_manager.execute_query(
-                                    """
-                                    INSERT INTO trade_ops 
-                                    (account_id, asset_name, pair, entry_price, exit_price, strategy_name, status)
-                                    VALUES (%s, %s, %s, %s, %s, %s, 'NEW_SIGNAL')
-                                    """,
-                                    (acc['account_id'], asset, pair, sig['entry_price'], sig['target_price'], strategy)
-                                )
-                                logging.info(f"✅ Queued: {asset}/{pair} -> User {acc['account_name']}")
-                            
-                else:
-                    # اگر سیگنال هست ولی کاربر فعال نیست، این لاگ کمک میکنه بفهمیم
-                    if signals:
-                        logging.warning("⚠️ Signals found but NO ACTIVE ACCOUNTS detected.")
-                
+            distribute_once()
         except Exception as e:
-            logging.error(f"Reader Error: {e}")
+            logger.error("Reader Error: %s", e)
         
-        time.sleep(config.BOT_SETTINGS["CHECK_INTERVAL"])
+        clock.sleep(config.BOT_SETTINGS["CHECK_INTERVAL"])
 
 if __name__ == "__main__":
+    db_manager.ensure_schema()
     distribute_signals()
@@ -1,24 +1,25 @@
 # telegram_bot.py
 # نسخه نهایی و کاملاً پایدار (Final Stable Version) - حذف ارجاع خطا
 
+import asyncio
 import logging
 import re
 import os
-import pandas as pd
-import xlsxwriter
 from datetime import datetime
 from decimal import Decimal
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler, 
+    Application, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, 
     ConversationHandler, MessageHandler, filters, ContextTypes
 )
 import config
 import db_manager
 import wallex_api
-import requests
+import account_cache
+import webhook_server
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 # --- States ---
 (STATE_NAME, STATE_MOBILE, STATE_EMAIL, STATE_API, 
@@ -32,6 +33,9 @@ STATE_EDIT_MENU, STATE_EDIT_INPUT, STATE_EDIT_STRAT, STATE_EDIT_GRADE = range(10
 ALL_STRATEGIES = ["G1", "Internal", "Computiational", "Arbitrage"]
 ALL_GRADES = ["Q1", "Q2", "Q3", "Q4"]
 
+# کش حساب‌های هر کاربر برای منوها (به جای SELECT در هر کلیک)
+ACCOUNTS = account_cache.AccountCache()
+
 # ==============================================================================
 # Helper Functions
 # ==============================================================================
@@ -88,83 +92,76 @@ def get_account_info_text(acc):
 
 # --- Excel Report ---
 def get_live_prices_snapshot():
-    url = config.WALLEX["BASE_URL"] + config.WALLEX["ENDPOINTS"]["ALL_MARKETS"]
-    try:
-        resp = requests.get(url, timeout=10)
-        if resp.status_code == 200:
-            markets = resp.json().get("result", {}).get("markets", [])
-            prices = {}
-            for m in markets:
-                symbol = m.get("symbol")
-                last = m.get("stats", {}).get("lastPrice")
-                if symbol and last:
-                    prices[symbol] = float(last)
-            return prices
-    except Exception:
-        pass
-    return {}
+    # قیمت آخر از اسنپ‌شات مشترک بازار (همان کش executor)؛ دانلود جداگانه لیست بازارها لازم نیست
+    wallex_api.refresh_market_snapshot()
+    return wallex_api.get_last_prices()
 
 def create_profit_report_excel(user_id, account_id):
+    # pandas/xlsxwriter فقط در مسیر گزارش لازم‌اند و شروع بات را کند نمی‌کنند
+    import pandas as pd
+    import analytics
+    import report_export
+
     try:
-        acc_filter = "AND ta.account_id = %s" if account_id != "all" else ""
-        params = [user_id]
-        if account_id != "all":
-            params.append(account_id)
-        
+        # تاریخچه‌های بزرگ به صورت جریانی ساخته می‌شوند تا حافظه پروسه ترید بالا نرود
+        threshold = config.REPORT.get("STREAMING_THRESHOLD", 5000)
+        if report_export.count_closed_trades(user_id, account_id) > threshold:
+            return report_export.export_history(user_id, account_id, get_live_prices_snapshot)
+
+        df = analytics.load_trades(user_id, account_id)
+        if df.empty: return None
+
         file_path = f"/tmp/Report_{user_id}_{int(datetime.now().timestamp())}.xlsx"
         writer = pd.ExcelWriter(file_path, engine='xlsxwriter')
-        
-        q_closed = f"SELECT ts.asset_name, ts.pair, ts.invested_amount, ts.sell_revenue, ts.created_at FROM trade_ops ts JOIN trading_accounts ta ON ts.account_id = ta.account_id WHERE ta.user_telegram_id = %s {acc_filter} AND (ts.status = 'COMPLETED' OR ts.status = 'SELL_ORDER_FILLED')"
-        closed = db_manager.execute_query(q_closed, tuple(params), fetch='all')
-        
-        has_data = False
-        if closed:
-            has_data = True
-            data_list = []
-            for row in closed:
-                inv = float(row['invested_amount'] or 0)
-                rev = float(row['sell_revenue'] or 0)
-                data_list.append({
-                    'Asset': row['asset_name'],
-                    'Pair': row['pair'],
-                    'Date': str(row['created_at']),
-                    'Invested': inv,
-                    'Revenue': rev,
-                    'Profit': rev - inv
-                })
-            pd.DataFrame(data_list).to_excel(writer, sheet_name='History', index=False)
-            
-        q_open = f"SELECT ts.asset_name, ts.pair, ts.invested_amount, ts.buy_quantity_executed FROM trade_ops ts JOIN trading_accounts ta ON ts.account_id = ta.account_id WHERE ta.user_telegram_id = %s {acc_filter} AND ts.status IN ('BUY_FILLED', 'SELL_IN_PROGRESS', 'SELL_ORDER_PLACED')"
-        opened = db_manager.execute_query(q_open, tuple(params), fetch='all')
-        
-        if opened:
-            has_data = True
+
+        closed = df[df['is_closed']]
+        if not closed.empty:
+            pd.DataFrame({
+                'Asset': closed['asset_name'],
+                'Pair': closed['pair'],
+                'Date': closed['opened_at'].astype(str),
+                'Invested': closed['invested'],
+                'Revenue': closed['revenue'],
+                'Profit': closed['pnl']
+            }).to_excel(writer, sheet_name='History', index=False)
+
+        opened = df[~df['is_closed']]
+        if not opened.empty:
             live_prices = get_live_prices_snapshot()
-            open_list = []
-            for row in opened:
-                sym = f"{row['asset_name']}{row['pair']}"
-                curr = live_prices.get(sym, 0)
-                qty = float(row['buy_quantity_executed'] or 0)
-                inv = float(row['invested_amount'] or 0)
-                curr_val = qty * curr
-                open_list.append({
-                    'Asset': row['asset_name'],
-                    'Pair': row['pair'],
-                    'Qty': qty,
-                    'Invested': inv,
-                    'Current Price': curr,
-                    'Current Value': curr_val,
-                    'PnL': curr_val - inv
-                })
-            pd.DataFrame(open_list).to_excel(writer, sheet_name='Active Trades', index=False)
+            curr = (opened['asset_name'] + opened['pair']).map(live_prices).fillna(0.0).astype(float)
+            curr_val = opened['qty'] * curr
+            pd.DataFrame({
+                'Asset': opened['asset_name'],
+                'Pair': opened['pair'],
+                'Qty': opened['qty'],
+                'Invested': opened['invested'],
+                'Current Price': curr,
+                'Current Value': curr_val,
+                'PnL': curr_val - opened['invested']
+            }).to_excel(writer, sheet_name='Active Trades', index=False)
+
+        summary = analytics.compute_summary(df)
+        if not summary['by_account'].empty:
+            summary['by_account'].to_excel(writer, sheet_name='By Account', index=False)
+            summary['by_strategy'].to_excel(writer, sheet_name='By Strategy', index=False)
+        if not summary['exposure'].empty:
+            summary['exposure'].to_excel(writer, sheet_name='Exposure', index=False)
 
         writer.close()
-        if not has_data: return None
         return file_path
     except Exception as e:
         logging.error(f"Excel Error: {e}")
         return None
 
+def create_summary_text(user_id, account_id="all"):
+    import analytics
+
+    try:
+        return analytics.format_summary_text(analytics.compute_summary(analytics.load_trades(user_id, account_id)))
+    except Exception as e:
+        logging.error(f"Summary Error: {e}")
+        return None
+
 # ==============================================================================
 # Add Account Wizard
 # ==============================================================================
@@ -319,6 +316,7 @@ async def sel_grade_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
                  d['max_tmn'], d['max_usdt'], d['bud_tmn'], d['bud_usdt'], 
                  ",".join(d['sel_strategies']), ",".join(d['sel_grades']))
             )
+            ACCOUNTS.invalidate(update.effective_user.id)
             await send_menu(update, context, "🎉 **حساب ساخته شد!**\nاز منوی مدیریت آن را فعال کنید.")
             await show_main_menu(update, context)
             return ConversationHandler.END
@@ -354,6 +352,29 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, tex
           [InlineKeyboardButton("📊 گزارش عملکرد", callback_data="report")]]
     await send_menu(update, context, text, InlineKeyboardMarkup(kb))
 
+async def show_account_list(update: Update, context: ContextTypes.DEFAULT_TYPE, uid):
+    accs = ACCOUNTS.get_accounts(uid)
+    if not accs:
+        await send_menu(update, context, "❌ شما هنوز حسابی ندارید.")
+        return
+    kb = []
+    for a in accs: kb.append([InlineKeyboardButton(f"{'🟢' if a['is_active'] else '🔴'} {a['account_name']}", callback_data=f"det_{a['account_id']}")])
+    kb.append([InlineKeyboardButton("🔙 بازگشت", callback_data="main_menu")])
+    await send_menu(update, context, "⚙️ **مدیریت حساب‌ها**\nحساب مورد نظر را انتخاب کنید:", InlineKeyboardMarkup(kb))
+
+async def show_account_details(update: Update, context: ContextTypes.DEFAULT_TYPE, uid, aid):
+    acc = ACCOUNTS.get_account(uid, aid)
+    if not acc:
+        await show_account_list(update, context, uid)
+        return
+    txt = get_account_info_text(acc)
+    kb = [
+        [InlineKeyboardButton("تغییر وضعیت 🔄", callback_data=f"tog_{aid}")],
+        [InlineKeyboardButton("🗑 حذف حساب", callback_data=f"del_{aid}")],
+        [InlineKeyboardButton("🔙 بازگشت به لیست", callback_data="manage")]
+    ]
+    await send_menu(update, context, txt, InlineKeyboardMarkup(kb))
+
 async def manage_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if q: await q.answer()
@@ -364,46 +385,38 @@ async def manage_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if d.startswith("edit_start_"): return
 
     if d == "manage":
-        accs = db_manager.execute_query("SELECT * FROM trading_accounts WHERE user_telegram_id=%s", (uid,), fetch='all')
-        if not accs:
-            await send_menu(update, context, "❌ شما هنوز حسابی ندارید.")
-            return
-        kb = []
-        for a in accs: kb.append([InlineKeyboardButton(f"{'🟢' if a['is_active'] else '🔴'} {a['account_name']}", callback_data=f"det_{a['account_id']}")])
-        kb.append([InlineKeyboardButton("🔙 بازگشت", callback_data="main_menu")])
-        await send_menu(update, context, "⚙️ **مدیریت حساب‌ها**\nحساب مورد نظر را انتخاب کنید:", InlineKeyboardMarkup(kb))
+        await show_account_list(update, context, uid)
 
     elif d == "main_menu":
         await show_main_menu(update, context)
 
     elif d.startswith("det_"):
-        aid = d.split("_")[1]
-        acc = db_manager.execute_query("SELECT * FROM trading_accounts WHERE account_id=%s", (aid,), fetch='one')
-        txt = get_account_info_text(acc)
-        kb = [
-            [InlineKeyboardButton("تغییر وضعیت 🔄", callback_data=f"tog_{aid}")],
-            [InlineKeyboardButton("🗑 حذف حساب", callback_data=f"del_{aid}")],
-            [InlineKeyboardButton("🔙 بازگشت به لیست", callback_data="manage")]
-        ]
-        await send_menu(update, context, txt, InlineKeyboardMarkup(kb))
+        await show_account_details(update, context, uid, d.split("_")[1])
 
     elif d.startswith("tog_"):
-        db_manager.execute_query("UPDATE trading_accounts SET is_active = NOT is_active WHERE account_id=%s", (d.split("_")[1],))
-        q.data = f"det_{d.split('_')[1]}"
-        await manage_handler(update, context)
+        aid = d.split("_")[1]
+        db_manager.execute_query("UPDATE trading_accounts SET is_active = NOT is_active WHERE account_id=%s AND user_telegram_id=%s", (aid, uid))
+        ACCOUNTS.invalidate(uid)
+        await show_account_details(update, context, uid, aid)
 
     elif d.startswith("del_"):
         aid = d.split("_")[1]
-        db_manager.execute_query("DELETE FROM trade_ops WHERE account_id=%s", (aid,))
-        db_manager.execute_query("DELETE FROM trading_accounts WHERE account_id=%s", (aid,))
+        if ACCOUNTS.get_account(uid, aid):
+            # فقط علامت‌گذاری؛ حذف تریدها و خود حساب به صورت تکه‌تکه در archiver انجام می‌شود
+            db_manager.execute_query(
+                "UPDATE trading_accounts SET is_active=FALSE, deleted_at=NOW() WHERE account_id=%s AND user_telegram_id=%s",
+                (aid, uid)
+            )
+        ACCOUNTS.invalidate(uid)
         await send_menu(update, context, "✅ حساب حذف شد.")
-        await manage_handler(update, context)
+        await show_account_list(update, context, uid)
 
     elif d == "report":
-        accs = db_manager.execute_query("SELECT account_id, account_name FROM trading_accounts WHERE user_telegram_id=%s", (uid,), fetch='all')
+        accs = ACCOUNTS.get_accounts(uid)
         kb = []
         for a in accs: kb.append([InlineKeyboardButton(a['account_name'], callback_data=f"gre_{a['account_id']}")])
         kb.append([InlineKeyboardButton("همه حساب‌ها", callback_data="gre_all")])
+        kb.append([InlineKeyboardButton("📈 خلاصه عملکرد", callback_data="sum_all")])
         kb.append([InlineKeyboardButton("🔙 بازگشت", callback_data="main_menu")])
         await send_menu(update, context, "📊 **گزارش عملکرد**\nانتخاب کنید:", InlineKeyboardMarkup(kb))
         
@@ -412,18 +425,68 @@ async def manage_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         acc_id = d.split("_")[1]
         path = create_profit_report_excel(update.effective_user.id, acc_id if acc_id != 'all' else 'all')
         if path:
-            await context.bot.send_document(chat_id=update.effective_chat.id, document=open(path, 'rb'), filename="Report.xlsx")
+            ext = ".csv.gz" if path.endswith(".csv.gz") else ".xlsx"
+            with open(path, 'rb') as f:
+                await context.bot.send_document(chat_id=update.effective_chat.id, document=f, filename=f"Report{ext}")
             os.remove(path)
             await show_main_menu(update, context)
         else:
             await send_menu(update, context, "❌ داده‌ای یافت نشد.")
 
+    elif d.startswith("sum_"):
+        txt = create_summary_text(uid, d.split("_")[1])
+        kb = [[InlineKeyboardButton("🔙 بازگشت", callback_data="report")]]
+        await send_menu(update, context, txt or "❌ داده‌ای یافت نشد.", InlineKeyboardMarkup(kb))
+
 async def cancel(u,c): 
     await show_main_menu(u,c)
     return ConversationHandler.END
 
-def run_bot():
-    app = Application.builder().token(config.TELEGRAM["BOT_TOKEN"]).build()
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    پردازش همزمان آپدیت‌های کاربران مختلف، ولی آپدیت‌های یک کاربر به ترتیب و یکی‌یکی؛
+    وگرنه مراحل ConversationHandler افزودن حساب (و user_data) روی وضعیت همان کاربر رقابت می‌کنند.
+    قفل کاربر قبل از semaphore سراسری گرفته می‌شود: آپدیت‌های صف کشیده یک کاربر پرکلیک
+    سهمی از CONCURRENT_UPDATES اشغال نمی‌کنند و بقیه کاربران معطل او نمی‌مانند.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}    # user_id -> [lock, تعداد آپدیت‌های در جریان]
+
+    async def process_update(self, update, coroutine):
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            await super().process_update(update, coroutine)
+            return
+        entry = self._locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(user.id, None)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def build_app(concurrent=True):
+    """concurrent=False: پردازش ترتیبی پیش‌فرض PTB (حالت polling)"""
+    tg = config.TELEGRAM
+    builder = Application.builder().token(tg["BOT_TOKEN"])
+    if concurrent:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(tg.get("CONCURRENT_UPDATES", 16)))
+    if tg.get("API_BASE_URL"):
+        builder = builder.base_url(tg["API_BASE_URL"])
+    app = builder.build()
     
     add_conv = ConversationHandler(
         entry_points=[CallbackQueryHandler(start_add, pattern="^add_acc$")],
@@ -445,9 +508,53 @@ def run_bot():
     app.add_handler(CommandHandler("start", start))
     app.add_handler(add_conv)
     app.add_handler(CallbackQueryHandler(manage_handler))
-    
+    return app
+
+async def run_webhook(app):
+    """اجرای بات با سرور webhook داخلی تا زمان لغو (Ctrl+C)"""
+    tg = config.TELEGRAM
+    await app.initialize()
+    await app.bot.set_webhook(
+        url=tg["WEBHOOK_URL"],
+        secret_token=tg.get("WEBHOOK_SECRET") or None,
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=max(1, min(100, tg.get("CONCURRENT_UPDATES", 16)))
+    )
+    await app.start()
+    server = await webhook_server.start(
+        app, tg.get("WEBHOOK_LISTEN", "0.0.0.0"), tg.get("WEBHOOK_PORT", 8443),
+        tg.get("WEBHOOK_PATH", "/telegram"), tg.get("WEBHOOK_SECRET")
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await app.stop()
+        try:
+            await app.bot.delete_webhook()
+        except Exception:
+            pass
+        await app.shutdown()
+
+def run_bot():
+    if config.TELEGRAM.get("MODE") == "webhook":
+        print("Telegram Bot Running (Webhook)...")
+        try:
+            asyncio.run(run_webhook(build_app()))
+            return
+        except (KeyboardInterrupt, SystemExit):
+            return
+        except Exception as e:
+            # اگر webhook راه نیفتاد (پورت/آدرس/شبکه) به long polling برمی‌گردیم
+            logger.error(f"Webhook mode failed, falling back to polling: {e}")
+
+    # همزمانی آپدیت‌ها فقط در حالت webhook؛ polling مثل قبل ترتیبی است
+    app = build_app(concurrent=False)
     print("Telegram Bot Running (Final Corrected)...")
+    # run_polling خودش webhook ثبت شده قبلی را حذف می‌کند
     app.run_polling()
 
 if __name__ == "__main__":
+    db_manager.ensure_schema()
     run_bot()
@@ -5,37 +5,157 @@ import requests
 import logging
 import json
 import config
+import clock
+import market_snapshot
 import math
+import threading
+import time
+from collections import deque
 from decimal import Decimal
 
+logger = logging.getLogger(__name__)
+
 # حافظه کش برای نگهداری اطلاعات دقیق بازار
 MARKET_INFO_CACHE = {}
+_snapshot_ts = 0.0
+_snapshot_failed_ts = None     # زمان آخرین تلاش ناموفق تازه‌سازی (برای عقب‌نشینی در قطعی)
+
+# ==============================================================================
+# سلامت صرافی: قطع‌کننده مشترک برای همه درخواست‌ها
+# ==============================================================================
+class ExchangeUnavailable(Exception):
+    """درخواست به دلیل باز بودن قطع‌کننده ارسال نشد"""
+
+class ExchangeHealth:
+    """
+    CLOSED: همه درخواست‌ها آزادند و نتیجه/تاخیرشان در یک پنجره زمانی ثبت می‌شود.
+    OPEN: اگر نرخ خطا یا نرخ درخواست‌های کند از آستانه بگذرد؛ فقط درخواست‌های ضروری (لغو سفارش) می‌روند.
+    HALF_OPEN: بعد از پایان مهلت، چند درخواست آزمایشی؛ موفقیت همه = CLOSED، هر خطا = OPEN با مهلت دو برابر.
+    """
+    CLOSED, OPEN, HALF_OPEN = "CLOSED", "OPEN", "HALF_OPEN"
+
+    def __init__(self, settings=None):
+        cfg = settings if settings is not None else config.EXCHANGE_HEALTH
+        self.window = cfg.get("WINDOW_SECONDS", 60)
+        self.min_calls = cfg.get("MIN_CALLS", 10)
+        self.error_rate = cfg.get("ERROR_RATE", 0.5)
+        self.slow_seconds = cfg.get("SLOW_CALL_SECONDS", 5)
+        self.slow_rate = cfg.get("SLOW_RATE", 0.5)
+        self.base_open = cfg.get("OPEN_SECONDS", 30)
+        self.max_open = cfg.get("MAX_OPEN_SECONDS", 300)
+        self.probes = cfg.get("HALF_OPEN_PROBES", 3)
+
+        self.state = self.CLOSED
+        self._calls = deque()        # (ts, ok, slow)
+        self._open_for = self.base_open
+        self._reopen_at = 0.0
+        self._probes_sent = 0
+        self._probes_ok = 0
+        self._lock = threading.Lock()
+
+    def available(self):
+        """آیا درخواست‌های غیرضروری الان ارسال می‌شوند؟ (بدون مصرف سهمیه آزمایشی)"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() >= self._reopen_at
+            if self.state == self.HALF_OPEN:
+                return self._probes_sent < self.probes
+            return True
+
+    def allow(self, essential=False):
+        with self._lock:
+            if self.state == self.CLOSED or essential:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() < self._reopen_at:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probes_sent = self._probes_ok = 0
+                logger.warning("🩹 Exchange breaker HALF_OPEN: probing with %d calls", self.probes)
+            if self._probes_sent >= self.probes:
+                return False
+            self._probes_sent += 1
+            return True
+
+    def record(self, ok, latency):
+        slow = latency >= self.slow_seconds
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.HALF_OPEN:
+                if not ok or slow:
+                    self._trip(now, min(self._open_for * 2, self.max_open))
+                else:
+                    self._probes_ok += 1
+                    if self._probes_ok >= self.probes:
+                        self.state = self.CLOSED
+                        self._calls.clear()
+                        self._open_for = self.base_open
+                        logger.warning("✅ Exchange breaker CLOSED: traffic resumed")
+                return
+            if self.state == self.OPEN:
+                return
+
+            self._calls.append((now, ok, slow))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            n = len(self._calls)
+            if n < self.min_calls: return
+            errors = sum(1 for c in self._calls if not c[1])
+            slows = sum(1 for c in self._calls if c[2])
+            if errors / n >= self.error_rate or slows / n >= self.slow_rate:
+                self._trip(now, self.base_open)
+
+    def _trip(self, now, open_for):
+        self.state = self.OPEN
+        self._open_for = open_for
+        self._reopen_at = now + open_for
+        self._calls.clear()
+        logger.error("⛔ Exchange breaker OPEN for %ds (errors/latency over threshold)", open_for)
+
+HEALTH = ExchangeHealth()
+
+def _call(method, url, essential=False, **kwargs):
+    """همه درخواست‌های HTTP به والکس از اینجا می‌گذرند تا در سلامت صرافی ثبت شوند"""
+    if not HEALTH.allow(essential):
+        raise ExchangeUnavailable(f"Exchange circuit open ({method} {url})")
+    started = time.monotonic()
+    try:
+        resp = requests.request(method, url, **kwargs)
+    except Exception:
+        HEALTH.record(False, time.monotonic() - started)
+        raise
+    HEALTH.record(resp.status_code < 500 and resp.status_code != 429, time.monotonic() - started)
+    return resp
+
+def retry_delay(attempt):
+    """فاصله تلاش مجدد برای خطاهای گذرا (نمایی، با سقف)"""
+    cfg = config.EXCHANGE_HEALTH
+    base = cfg.get("RETRY_BASE_SECONDS", 15)
+    return int(min(base * (2 ** max(attempt, 0)), cfg.get("RETRY_MAX_SECONDS", 600)))
 
 def get_url(endpoint):
     base = config.WALLEX["BASE_URL"].rstrip('/')
     path = endpoint.lstrip('/')
     return f"{base}/{path}"
 
-def update_market_info():
+def fetch_markets():
     """
     دریافت لیست کامل بازارها و دقت اعشار از API والکس
     Endpoint: /hector/web/v1/markets
+    خروجی: {symbol: {...}} یا None در صورت خطا
     """
-    global MARKET_INFO_CACHE
     url = get_url(config.WALLEX["ENDPOINTS"]["ALL_MARKETS"])
     
     try:
-        logging.info("🔄 Fetching ALL market precisions from Wallex API...")
-        resp = requests.get(url, timeout=20)
+        logger.info("🔄 Fetching ALL market precisions from Wallex API...")
+        resp = _call("GET", url, timeout=20)
         
         if resp.status_code == 200:
             data = resp.json()
             if data.get("success") and "result" in data:
                 markets = data["result"]["markets"]
                 
-                # پاکسازی کش قبلی برای اطمینان از تازگی داده‌ها
-                MARKET_INFO_CACHE.clear()
-                
+                fresh = {}
                 for m in markets:
                     symbol = m["symbol"]
                     # دریافت دقیق مقادیر از API
@@ -44,22 +164,127 @@ def update_market_info():
                     prc_p = m.get("price_precision")
                     
                     if amt_p is not None and prc_p is not None:
-                        MARKET_INFO_CACHE[symbol] = {
+                        fresh[symbol] = {
                             "qty_prec": int(amt_p),
-                            "price_prec": int(prc_p)
+                            "price_prec": int(prc_p),
+                            # محدودیت‌های بازار برای اعتبارسنجی محلی قبل از ارسال سفارش
+                            "min_qty": _limit(m, "min_qty", "minQty"),
+                            "max_qty": _limit(m, "max_qty", "maxQty"),
+                            "min_notional": _limit(m, "min_notional", "minNotional"),
+                            "min_price": _limit(m, "min_price", "minPrice"),
+                            "max_price": _limit(m, "max_price", "maxPrice"),
+                            "last_price": _limit(m.get("stats") or {}, "lastPrice")
                         }
-                
-                logging.info(f"✅ Market Info Loaded: {len(MARKET_INFO_CACHE)} pairs cached.")
-                return True
+                return fresh
             else:
-                logging.error(f"API Response Error: {data}")
+                logger.error(f"API Response Error: {data}")
         else:
-            logging.error(f"HTTP Error fetching markets: {resp.status_code}")
+            logger.error(f"HTTP Error fetching markets: {resp.status_code}")
             
     except Exception as e:
-        logging.error(f"Connection Error updating markets: {e}")
+        logger.error(f"Connection Error updating markets: {e}")
     
-    return False
+    return None
+
+def update_market_info():
+    """
+    تازه‌سازی کش بازار. اگر اسنپ‌شات مشترک فعال و تازه باشد، کش همان نمای map شده
+    (بدون درخواست شبکه) می‌شود؛ در غیر این صورت این پروسه خودش از API می‌خواند.
+    """
+    global MARKET_INFO_CACHE, _snapshot_ts
+    if market_snapshot.enabled():
+        view = market_snapshot.open_view()
+        if view is not None:
+            MARKET_INFO_CACHE = view
+            _snapshot_ts = view.fetched_at
+            return True
+
+    fresh = fetch_markets()
+    if fresh is None:
+        return False
+    # جایگزینی یکجا (تعویض ارجاع) تا تردهای دیگر کش خالی یا نیمه‌کاره نبینند
+    MARKET_INFO_CACHE = fresh
+    _snapshot_ts = clock.get_clock().time()
+    logger.info(f"✅ Market Info Loaded: {len(MARKET_INFO_CACHE)} pairs cached.")
+    return True
+
+def _limit(m, *keys):
+    """اولین مقدار عددی مثبت از بین کلیدهای ممکن (نام فیلدها در API یکسان نیست)"""
+    for k in keys:
+        v = m.get(k)
+        if v in (None, ""): continue
+        try:
+            v = float(v)
+        except (TypeError, ValueError):
+            continue
+        if v > 0: return v
+    return None
+
+def refresh_market_snapshot(max_age=None):
+    """
+    تازه‌سازی قیمت‌های آخر کش بازار اگر قدیمی‌تر از max_age ثانیه باشد.
+    یک درخواست برای همه بازارها؛ به جای درخواست جداگانه برای هر سفارش.
+    بعد از تلاش ناموفق تا max_age ثانیه دوباره تلاش نمی‌شود (در قطعی، هر مرحله دانلود کامل نمی‌زند).
+    """
+    global _snapshot_failed_ts
+    max_age = max_age if max_age is not None else config.POLLING.get("MARKET_SNAPSHOT_TTL", 10)
+    now = clock.get_clock().time()
+    if MARKET_INFO_CACHE and now - _snapshot_ts < max_age:
+        return True
+    if _snapshot_failed_ts is not None and now - _snapshot_failed_ts < max_age:
+        return False
+    ok = update_market_info()
+    _snapshot_failed_ts = None if ok else now
+    return ok
+
+def get_last_price(symbol):
+    info = MARKET_INFO_CACHE.get(symbol)
+    return info.get("last_price") if info else None
+
+def get_last_prices():
+    """{symbol: last_price} همه بازارها از کش (برای گزارش‌ها)"""
+    cache = MARKET_INFO_CACHE
+    if isinstance(cache, market_snapshot.SnapshotView):
+        return cache.last_prices()
+    return {s: info["last_price"] for s, info in cache.items() if info.get("last_price")}
+
+def get_market_info(symbol):
+    """اطلاعات کامل بازار از کش (با یکبار آپدیت در صورت نبودن)"""
+    if not MARKET_INFO_CACHE or symbol not in MARKET_INFO_CACHE:
+        update_market_info()
+    return MARKET_INFO_CACHE.get(symbol)
+
+def check_order_limits(symbol, side, price, quantity):
+    """
+    اعتبارسنجی سفارش با محدودیت‌های کش شده بازار، قبل از هر درخواست شبکه.
+    خروجی: (quantity, error, retryable)
+    - error=None یعنی سفارش قابل ارسال است (مقدار خرید ممکن است تا max_qty کم شده باشد).
+    - retryable=True یعنی خطا گذراست (مثلاً قیمت خارج از باند فعلی) و بعداً قابل تلاش مجدد است.
+    """
+    info = MARKET_INFO_CACHE.get(symbol)
+    if not info: return quantity, None, False
+
+    max_qty = info.get("max_qty")
+    if max_qty and quantity > max_qty:
+        if side.lower() != 'buy':
+            return quantity, f"Qty {quantity} > max {max_qty}", False
+        # خرید بزرگ‌تر از سقف بازار: مقدار را تا سقف پایین می‌آوریم
+        quantity = format_quantity(max_qty, info["qty_prec"])
+
+    min_qty = info.get("min_qty")
+    if min_qty and quantity < min_qty:
+        return quantity, f"Qty {quantity} < min {min_qty}", False
+
+    min_notional = info.get("min_notional")
+    if min_notional and float(price) * quantity < min_notional:
+        return quantity, f"Notional {float(price) * quantity:g} < min {min_notional}", False
+
+    min_price = info.get("min_price")
+    max_price = info.get("max_price")
+    if (min_price and float(price) < min_price) or (max_price and float(price) > max_price):
+        return quantity, f"Price {price} outside band [{min_price}, {max_price}]", True
+
+    return quantity, None, False
 
 def get_precision(symbol):
     """
@@ -76,7 +301,7 @@ def get_precision(symbol):
         return info["qty_prec"], info["price_prec"]
     
     # اگر پیدا نشد، یعنی این ارز در مارکت والکس نیست یا API مشکل دارد
-    logging.warning(f"⚠️ Precision not found for {symbol} in API data.")
+    logger.warning("⚠️ Precision not found for %s in API data.", symbol)
     return None, None
 
 def format_quantity(quantity, precision):
@@ -111,11 +336,41 @@ def validate_api_key(api_key):
     url = get_url(config.WALLEX["ENDPOINTS"]["ACCOUNT_BALANCES"])
     headers = {"x-api-key": api_key}
     try:
-        r = requests.get(url, headers=headers, timeout=10)
+        r = _call("GET", url, essential=True, headers=headers, timeout=10)
         return r.status_code == 200 and r.json().get("success")
     except: return False
 
-def place_order(api_key, symbol, side, price, quantity):
+def get_balances(api_key):
+    """
+    موجودی قابل استفاده هر دارایی حساب: {asset: value - locked}.
+    None یعنی خطا (موجودی نامعلوم است، نه صفر).
+    """
+    url = get_url(config.WALLEX["ENDPOINTS"]["ACCOUNT_BALANCES"])
+    headers = {"x-api-key": api_key}
+    try:
+        r = _call("GET", url, headers=headers, timeout=10)
+        if r.status_code != 200: return None
+        data = r.json()
+        if not data.get("success"): return None
+        balances = {}
+        for asset, b in ((data.get("result") or {}).get("balances") or {}).items():
+            value = float(b.get("value") or 0)
+            locked = float(b.get("locked") or 0)
+            balances[b.get("asset") or asset] = max(value - locked, 0.0)
+        return balances
+    except Exception as e:
+        logger.error("Balances Error: %s", e)
+        return None
+
+def make_client_order_id(trade_id, side):
+    """
+    شناسه سفارش قطعی بر اساس شناسه ترید: تلاش مجدد با همین شناسه
+    سفارش تکراری نمی‌سازد (صرافی شناسه تکراری را رد می‌کند).
+    """
+    prefix = config.WALLEX.get("CLIENT_ID_PREFIX", "MT")
+    return f"{prefix}{trade_id}{'B' if side.lower() == 'buy' else 'S'}"
+
+def place_order(api_key, symbol, side, price, quantity, client_id=None):
     url = get_url(config.WALLEX["ENDPOINTS"]["ORDERS"])
     headers = {"Content-Type": "application/json", "x-api-key": api_key}
     
@@ -131,26 +386,44 @@ def place_order(api_key, symbol, side, price, quantity):
         "side": side.upper(),
         "type": "LIMIT"
     }
+    if client_id:
+        payload["client_id"] = client_id
     
-    logging.info(f"📤 Sending {symbol} | P: {str_price} | Q: {str_qty}")
+    logger.info("📤 Sending %s | P: %s | Q: %s", symbol, str_price, str_qty)
     
     try:
-        resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=10)
+        resp = _call("POST", url, headers=headers, data=json.dumps(payload), timeout=10)
         if resp.status_code in [200, 201]: return resp.json()
         
-        logging.error(f"❌ Order Failed: {resp.text}")
-        return {"success": False, "message": resp.text}
+        logger.error("❌ Order Failed: %s", resp.text)
+        # خطای سمت صرافی (5xx) یا محدودیت نرخ: گذراست و سفارش بعداً دوباره ارسال می‌شود
+        retryable = resp.status_code >= 500 or resp.status_code == 429
+        return {"success": False, "message": resp.text, "retryable": retryable}
+    except ExchangeUnavailable as e:
+        return {"success": False, "message": str(e), "retryable": True}
     except Exception as e:
-        logging.error(f"Exception Place Order: {e}")
+        logger.error("Exception Place Order: %s", e)
         return None
 
+class _OrderNotFound:
+    """پاسخ قطعی صرافی (404): سفارشی با این شناسه وجود ندارد. در شرط‌ها مثل None نادرست است."""
+    def __bool__(self): return False
+    def __repr__(self): return "ORDER_NOT_FOUND"
+
+ORDER_NOT_FOUND = _OrderNotFound()
+
 def get_order_status(client_id, api_key):
+    """
+    خروجی: dict وضعیت سفارش، ORDER_NOT_FOUND اگر صرافی نبودن سفارش را تأیید کرد،
+    یا None برای هر خطای دیگر (تایم‌اوت، 5xx، 429، قطع‌کننده باز) که یعنی وضعیت نامعلوم است.
+    """
     base = config.WALLEX["ENDPOINTS"]["GET_ORDER"]
     url = get_url(f"{base}{client_id}")
     headers = {"x-api-key": api_key}
     try:
-        r = requests.get(url, headers=headers, timeout=10)
+        r = _call("GET", url, headers=headers, timeout=10)
         if r.status_code == 200: return r.json().get("result")
+        if r.status_code == 404: return ORDER_NOT_FOUND
         return None
     except: return None
 
@@ -159,7 +432,34 @@ def cancel_order(api_key, client_id):
     headers = {"Content-Type": "application/json", "x-api-key": api_key}
     payload = {"clientOrderId": client_id}
     try:
-        r = requests.delete(url, headers=headers, data=json.dumps(payload), timeout=10)
+        # لغو سفارش حتی با قطع‌کننده باز ارسال می‌شود (کاهش ریسک پر شدن دیرهنگام)
+        r = _call("DELETE", url, essential=True, headers=headers, data=json.dumps(payload), timeout=10)
         if r.status_code == 200: return r.json()
         return None
     except: return None
+
+def get_open_orders(api_key):
+    """همه سفارش‌های باز حساب در یک درخواست؛ None یعنی خطا (نه لیست خالی)"""
+    url = get_url(config.WALLEX["ENDPOINTS"]["OPEN_ORDERS"])
+    headers = {"x-api-key": api_key}
+    try:
+        r = _call("GET", url, headers=headers, timeout=10)
+        if r.status_code == 200:
+            return (r.json().get("result") or {}).get("orders") or []
+        return None
+    except Exception as e:
+        logger.error("Open Orders Error: %s", e)
+        return None
+
+def get_recent_trades(api_key):
+    """معاملات اخیر حساب (پر شدن‌ها) در یک درخواست؛ None یعنی خطا"""
+    url = get_url(config.WALLEX["ENDPOINTS"]["RECENT_TRADES"])
+    headers = {"x-api-key": api_key}
+    try:
+        r = _call("GET", url, headers=headers, timeout=10)
+        if r.status_code == 200:
+            return (r.json().get("result") or {}).get("AccountLatestTrades") or []
+        return None
+    except Exception as e:
+        logger.error("Recent Trades Error: %s", e)
+        return None
@@ -0,0 +1,86 @@
+# webhook_server.py
+# سرور HTTP داخلی (asyncio خالص، بدون وابستگی اضافه) برای دریافت آپدیت‌های تلگرام در حالت webhook.
+# هر POST معتبر مستقیماً در update_queue اپلیکیشن قرار می‌گیرد و پاسخ بلافاصله برمی‌گردد؛
+# پردازش همزمان آپدیت‌ها با concurrent_updates اپلیکیشن کنترل می‌شود.
+
+import asyncio
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY = 1024 * 1024
+
+
+async def _respond(writer, code, reason):
+    writer.write(f"HTTP/1.1 {code} {reason}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start(app, listen, port, path, secret):
+    """
+    شروع سرور webhook. خروجی: شیء asyncio.Server (برای بستن در زمان خاموشی).
+    درخواست‌هایی که مسیر یا توکن مخفی اشتباه دارند با 403/404 رد می‌شوند.
+    """
+    path = "/" + path.lstrip("/")
+    expected = (secret or "").encode()
+
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2:
+                return await _respond(writer, 400, "Bad Request")
+            method, target = parts[0], parts[1]
+
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b"\r\n", b"\n", b""): break
+                k, _, v = line.decode("latin-1").partition(":")
+                headers[k.strip().lower()] = v.strip()
+
+            if method != "POST":
+                return await _respond(writer, 405, "Method Not Allowed")
+            if target.split("?", 1)[0] != path:
+                return await _respond(writer, 404, "Not Found")
+            if expected and not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode(), expected):
+                logger.warning("Webhook request with invalid secret token rejected.")
+                return await _respond(writer, 403, "Forbidden")
+
+            try:
+                length = int(headers.get("content-length", 0))
+            except ValueError:
+                length = 0
+            if length <= 0 or length > MAX_BODY:
+                return await _respond(writer, 400, "Bad Request")
+            body = await asyncio.wait_for(reader.readexactly(length), timeout=10)
+
+            try:
+                data = json.loads(body)
+                if not isinstance(data, dict):
+                    raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+                update = Update.de_json(data, app.bot)
+            except (ValueError, TypeError, KeyError) as e:
+                # آپدیت خراب با 400 رد می‌شود؛ پاسخ 500 باعث ارسال دوباره همان آپدیت توسط تلگرام می‌شود
+                logger.warning(f"Webhook rejected malformed update: {e}")
+                return await _respond(writer, 400, "Bad Request")
+            await app.update_queue.put(update)
+            await _respond(writer, 200, "OK")
+        except Exception as e:
+            logger.error(f"Webhook Error: {e}")
+            try:
+                await _respond(writer, 500, "Internal Server Error")
+            except Exception:
+                pass
+
+    server = await asyncio.start_server(handle, listen, port)
+    logger.info(f"🌐 Webhook server listening on {listen}:{port}{path}")
+    return server
@@ -0,0 +1,139 @@
+# work_set.py
+# پردازش مجموعه کار هر مرحله executor در صفحه‌های محدود (keyset روی t.id) به جای fetch='all':
+# - حافظه: در هر لحظه حداکثر یک صفحه (BATCH_SIZE ردیف) در حافظه است.
+# - بودجه زمانی: بعد از پایان مهلت مرحله، صفحه بعدی خوانده نمی‌شود و بقیه به سیکل بعد می‌رود.
+# - انصاف: هر حساب در هر مرحله/سیکل حداکثر MAX_PER_ACCOUNT ردیف دارد. هر حسابی که به سقف رسید
+#   (یا مهلت وسط کارش تمام شد) مکان‌نمای خودش را دارد: آخرین ردیفی که واقعاً پردازش شد.
+#   سیکل بعد ردیف‌های آن حساب از بعد از همان ردیف (و سپس از ابتدا تا همان ردیف) پردازش می‌شوند،
+#   بدون اینکه ترتیب حساب‌های دیگر جابه‌جا شود (چرخشی برای هر حساب).
+#
+# هر پیمایش حداکثر دو دور است: دور اول ردیف‌های «جلوتر» از مکان‌نمای هر حساب، دور دوم
+# (فقط اگر مکان‌نمایی هست) ردیف‌های تا همان مکان‌نما برای حساب‌هایی که هنوز سهم دارند.
+
+import time
+
+import config
+import db_manager
+
+MAX_ID = 2 ** 63 - 1
+
+# نام مرحله -> {"start": مکان‌نمای پیش‌فرض (نقطه توقف مهلت)، "accounts": {account_id: آخرین t.id پردازش شده}}
+_resume = {}
+
+
+class WorkSet:
+    """
+    query: SELECT ... FROM trade_ops t ... WHERE ... (بدون ORDER BY/LIMIT)؛ شرط صفحه‌بندی اضافه می‌شود.
+    newest_first: صفحه‌ها از جدیدترین شروع شوند و از نقطه توقف مهلت ادامه داده نشود
+    (برای سیگنال‌های خرید که تازگی اولویت دارد و قدیمی‌ها منقضی می‌شوند)؛ فقط حساب‌هایی که به
+    سقف رسیدند از ردیف‌های قدیمی‌تر از آخرین ردیف پردازش شده‌شان ادامه می‌دهند.
+    due: تابع اختیاری روی هر ردیف (مثلاً زمان‌بندی PollScheduler)؛ ردیف‌هایی که هنوز نوبتشان
+    نرسیده برگردانده نمی‌شوند و از سهم حساب هم کم نمی‌کنند.
+    بعد از پایان پیمایش، complete نشان می‌دهد آیا کل مجموعه (قبل از پایان مهلت) دیده شد.
+    """
+
+    def __init__(self, step, query, params=(), deadline=None, newest_first=False, due=None):
+        cfg = config.BATCHING
+        self.step = step
+        self.query = query
+        self.params = tuple(params)
+        self.deadline = deadline
+        self.newest_first = newest_first
+        self.due = due
+        self.batch_size = cfg.get("BATCH_SIZE", 500)
+        self.per_account = cfg.get("MAX_PER_ACCOUNT", 100)
+        self.counts = {}
+        self.ids = set()        # شناسه همه ردیف‌های دیده شده (برای PollScheduler.retain)
+        self.complete = False
+
+        state = _resume.get(step) or {}
+        self._cursors = dict(state.get("accounts") or {})
+        self._start = MAX_ID if newest_first else state.get("start", 0)
+        self._served = {}       # account_id -> آخرین t.id پردازش شده در همین پیمایش
+        self._capped = set()    # حساب‌هایی که ردیفی از آن‌ها به خاطر سقف کنار رفت
+
+    def _cursor(self, account_id):
+        return self._cursors.get(account_id, self._start)
+
+    def _ahead(self, row_id, cursor):
+        """آیا ردیف در دور اول (بعد از مکان‌نمای حساب در جهت پیمایش) است؟"""
+        return row_id < cursor if self.newest_first else row_id > cursor
+
+    def _laps(self):
+        """[(شماره دور، lo، hi)]: بازه‌ای که هر دور باید بخواند (ردیف‌های خارج آن به کار آن دور نمی‌آیند)"""
+        cursors = list(self._cursors.values()) + [self._start]
+        if self.newest_first:
+            laps = [(1, 0, max(cursors))]
+            if self._cursors:
+                laps.append((2, min(cursors) - 1, MAX_ID))
+        else:
+            laps = [(1, min(cursors), MAX_ID)]
+            if max(cursors) > 0:
+                laps.append((2, 0, max(cursors)))
+        return laps
+
+    def _page(self, lo, hi, last):
+        if self.newest_first:
+            sql = f"{self.query} AND t.id > %s AND t.id < %s ORDER BY t.id DESC LIMIT %s"
+            args = (lo, last if last is not None else hi)
+        else:
+            sql = f"{self.query} AND t.id > %s AND t.id <= %s ORDER BY t.id LIMIT %s"
+            args = (last if last is not None else lo, hi)
+        return db_manager.execute_query(sql, self.params + args + (self.batch_size,), fetch='all')
+
+    def _out_of_time(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _save_resume(self, stopped_at=None):
+        """stopped_at: شناسه آخرین ردیف خوانده شده وقتی مهلت تمام شد (None = پیمایش کامل)"""
+        if stopped_at is None:
+            # همه حساب‌های بدون سقف کامل پردازش شدند؛ فقط حساب‌های به سقف رسیده ادامه دارند
+            accounts = {a: self._served.get(a, self._cursor(a)) for a in self._capped}
+            start = 0
+        else:
+            accounts = dict(self._cursors)
+            for a, last in self._served.items():
+                if a in self._capped or not self.newest_first:
+                    accounts[a] = last
+            start = stopped_at
+        if accounts or (start and not self.newest_first):
+            _resume[self.step] = {"start": start, "accounts": accounts}
+        else:
+            _resume.pop(self.step, None)
+
+    def batches(self):
+        for lap, lo, hi in self._laps():
+            last = None
+            while True:
+                if self._out_of_time():
+                    # حساب‌های بدون مکان‌نما سیکل بعد از همین نقطه ادامه می‌دهند
+                    stopped_at = last or 0
+                    self._save_resume(max(stopped_at, self._start) if lap == 1 else stopped_at)
+                    return
+                rows = self._page(lo, hi, last)
+                if not rows: break
+                last = rows[-1]['id']
+                batch = []
+                for row in rows:
+                    account_id = row['account_id']
+                    # دور اول فقط ردیف‌های جلوتر از مکان‌نمای حساب، دور دوم فقط بقیه
+                    if self._ahead(row['id'], self._cursor(account_id)) != (lap == 1): continue
+                    if self.due and not self.due(row): continue
+                    n = self.counts.get(account_id, 0)
+                    if n >= self.per_account:
+                        self._capped.add(account_id)
+                        continue
+                    self.counts[account_id] = n + 1
+                    self._served[account_id] = row['id']
+                    batch.append(row)
+                self.ids.update(row['id'] for row in rows)
+                if batch:
+                    yield batch
+                if len(rows) < self.batch_size: break
+
+        self.complete = True
+        self._save_resume()
+
+    def rows(self):
+        for batch in self.batches():
+            yield from batch